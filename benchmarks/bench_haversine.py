@@ -0,0 +1,77 @@
+""" Accuracy check and throughput benchmark of curry.geo.haversine_np.
+
+    Compares the vectorized distance with the haversine package on random
+    points and times both on the same rows.
+
+    Run from the repository root:
+
+        python benchmarks/bench_haversine.py [--rows 1000000] [--apply-rows 100000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from haversine import haversine
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from curry.geo import haversine_np  # noqa: E402
+
+# Maximum accepted difference with the haversine package, in km:
+TOLERANCE_KM = 1e-9
+
+
+def random_points ( rows, seed=0 ):
+    """ Random restaurant/delivery pairs around the coordinates of the dataset """
+    rng = np.random.default_rng( seed )
+    lat1 = rng.uniform( -90, 90, rows )
+    lng1 = rng.uniform( -180, 180, rows )
+    lat2 = np.clip( lat1 + rng.normal( 0, 5, rows ), -90, 90 )
+    lng2 = np.clip( lng1 + rng.normal( 0, 5, rows ), -180, 180 )
+
+    return pd.DataFrame( {'Restaurant_latitude': lat1, 'Restaurant_longitude': lng1,
+                          'Delivery_location_latitude': lat2, 'Delivery_location_longitude': lng2} )
+
+
+def apply_haversine ( df ):
+    """ The row by row version the Restaurant page used before """
+    return df.apply( lambda x: haversine( (x['Restaurant_latitude'], x['Restaurant_longitude']),
+                                          (x['Delivery_location_latitude'], x['Delivery_location_longitude']) ), axis=1 ).to_numpy()
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description=__doc__.splitlines()[0] )
+    parser.add_argument( '--rows', type=int, default=1_000_000, help='rows for the vectorized benchmark' )
+    parser.add_argument( '--apply-rows', type=int, default=100_000, help='rows for the accuracy check and the apply benchmark' )
+    args = parser.parse_args( argv )
+
+    df = random_points( args.rows )
+    sample = df.head( args.apply_rows )
+
+    start = time.perf_counter()
+    expected = apply_haversine( sample )
+    apply_time = time.perf_counter() - start
+
+    got = haversine_np( sample['Restaurant_latitude'], sample['Restaurant_longitude'],
+                        sample['Delivery_location_latitude'], sample['Delivery_location_longitude'] )
+    max_error = np.max( np.abs( got - expected ) )
+    print( 'accuracy: max |error| = {:.3e} km over {:,} rows'.format( max_error, len( sample ) ) )
+
+    start = time.perf_counter()
+    haversine_np( df['Restaurant_latitude'], df['Restaurant_longitude'],
+                  df['Delivery_location_latitude'], df['Delivery_location_longitude'] )
+    numpy_time = time.perf_counter() - start
+
+    print( 'apply:  {:,} rows in {:.3f}s ({:,.0f} rows/s)'.format( len( sample ), apply_time, len( sample ) / apply_time ) )
+    print( 'numpy:  {:,} rows in {:.3f}s ({:,.0f} rows/s)'.format( len( df ), numpy_time, len( df ) / numpy_time ) )
+
+    if max_error > TOLERANCE_KM:
+        sys.exit( 'haversine_np differs from the haversine package by more than {} km'.format( TOLERANCE_KM ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+""" Import time report and cold start budget of the pages.
+
+    Every page runs its module level imports on the first visit of a session
+    of a fresh server process. This script runs the module level imports of
+    each page in a new interpreter with python -X importtime, after importing
+    streamlit ( always loaded by the server ), and reports the cumulative
+    import cost of every module the page imports directly. Libraries that a
+    page imports inside a function are loaded only when a widget needs them,
+    so they are not counted here.
+
+    streamlit itself may load some of those libraries ( plotly.io ), which
+    hides their cost from the timing. So the report also lists the deferred
+    libraries ( DEFERRED ) imported at module level by the page or by the
+    curry modules it reaches through its module level imports.
+
+    With --check the script fails if the import time of a page exceeds its
+    budget ( the median of --repeat runs is compared, to smooth the noise of
+    a cold interpreter ) or if a page reaches a deferred library:
+
+        python benchmarks/bench_imports.py [--check] [--repeat 5]
+"""
+
+import argparse
+import ast
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+PAGES = ['Home.py', 'pages/1_Company_vision.py', 'pages/2_Delivery_vision.py', 'pages/3_Restaurant_vision.py']
+
+# Import time budget of each page, in ms, beyond streamlit itself
+BUDGET_MS = {'Home.py': 50,
+             'pages/1_Company_vision.py': 100,
+             'pages/2_Delivery_vision.py': 100,
+             'pages/3_Restaurant_vision.py': 100}
+
+# Libraries the pages import inside the widgets that need them
+DEFERRED = ['plotly', 'folium', 'streamlit_folium']
+
+MARKER = 'curry-page-imports'
+
+LINE = re.compile( r'import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)' )
+
+
+def module_imports ( path ):
+    """ This function returns the module level import statements of a script
+
+        Input: path of the script, relative to the repository root
+        Output: list of ast.Import and ast.ImportFrom
+    """
+    with open( os.path.join( ROOT, path ), encoding='utf-8' ) as f:
+        tree = ast.parse( f.read() )
+
+    return [node for node in tree.body if isinstance( node, (ast.Import, ast.ImportFrom) )]
+
+
+def page_imports ( page ):
+    """ This function returns the source of the module level import statements of a page script
+
+        Input: path of the page, relative to the repository root
+        Output: str with one import statement per line
+    """
+    return '\n'.join( ast.unparse( node ) for node in module_imports( page ) )
+
+
+def deferred_imports ( page ):
+    """ This function finds the deferred libraries imported at module level by a page or the curry modules it reaches
+
+        Output: list of ( script, module ) pairs
+    """
+    found = []
+    pending = [page]
+    seen = set( pending )
+    while pending:
+        path = pending.pop()
+        for node in module_imports( path ):
+            if isinstance( node, ast.Import ):
+                names = [alias.name for alias in node.names]
+            elif node.level == 0 and node.module:
+                # from curry import cache importa o módulo curry.cache
+                names = [node.module] + ['{}.{}'.format( node.module, alias.name ) for alias in node.names]
+            else:
+                continue
+            for name in names:
+                if name.split( '.' )[0] in DEFERRED:
+                    found.append( (path, name) )
+                source = name.replace( '.', '/' ) + '.py'
+                if name.startswith( 'curry.' ) and source not in seen and os.path.exists( os.path.join( ROOT, source ) ):
+                    seen.add( source )
+                    pending.append( source )
+
+    return found
+
+
+def import_times ( page ):
+    """ This function imports the modules of a page in a new interpreter and reads the -X importtime report
+
+        Output: dict {module imported directly by the page: cumulative microseconds}
+    """
+    code = 'import streamlit\nimport sys\nsys.stderr.write( "{}\\n" )\n{}\n'.format( MARKER, page_imports( page ) )
+    process = subprocess.run( [sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                              capture_output=True, text=True, check=True )
+    lines = process.stderr.split( MARKER + '\n', 1 )[1].splitlines()
+
+    # The modules imported directly are the least indented lines of the report
+    entries = [(len( m.group( 3 ) ), m.group( 4 ), int( m.group( 2 ) )) for m in map( LINE.match, lines ) if m]
+    top = min( (indent for indent, _, _ in entries), default=0 )
+
+    return {name: us for indent, name, us in entries if indent == top}
+
+
+def report ( page, repeat ):
+    """ This function measures a page repeat times
+
+        Output: median total in ms and the modules of the median run
+    """
+    runs = sorted( (import_times( page ) for _ in range( repeat )), key=lambda times: sum( times.values() ) )
+    modules = runs[len( runs ) // 2]
+
+    return statistics.median( sum( times.values() ) / 1000 for times in runs ), modules
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Report the import time of the pages and check it against a budget.' )
+    parser.add_argument( '--repeat', type=int, default=3, help='runs of each page ( the median is kept )' )
+    parser.add_argument( '--top', type=int, default=8, help='modules listed by page' )
+    parser.add_argument( '--check', action='store_true', help='fail if a page exceeds its budget' )
+    args = parser.parse_args( argv )
+
+    over = []
+    for page in PAGES:
+        total, modules = report( page, args.repeat )
+        budget = BUDGET_MS[page]
+        print( '{}: {:.0f} ms ( budget {} ms )'.format( page, total, budget ) )
+        for name, us in sorted( modules.items(), key=lambda item: -item[1] )[:args.top]:
+            print( '    {:>8.1f} ms  {}'.format( us / 1000, name ) )
+        if total > budget:
+            over.append( page )
+        for path, name in deferred_imports( page ):
+            print( '    deferred library {} imported at module level by {}'.format( name, path ) )
+            over.append( page )
+
+    if args.check and over:
+        raise SystemExit( 'over the import budget: {}'.format( ', '.join( sorted( set( over ) ) ) ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+""" Scaling benchmark of the parallel ingest ( curry.ingest.read_clean ).
+
+    Parses and cleans the same synthetic csv with 1, 2, 4, 8 and 16 worker
+    processes, checks that every result is identical to the single process
+    one and prints the speedup. Worker counts above the number of cores of
+    the machine are still run, but they cannot scale.
+
+    Run from the repository root:
+
+        python benchmarks/bench_ingest.py [--rows 1000000] [--workers 1 2 4 8 16] [--out ingest.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from benchmarks.bench_pipeline import dataset, environment, timed  # noqa: E402
+from curry.ingest import read_clean  # noqa: E402
+
+
+def bench_workers ( path, workers, repeat ):
+    """ This function times read_clean() for every number of workers
+
+        Output: dict {workers: seconds}
+    """
+    results = {}
+    serial = None
+    for n in workers:
+        results[n], df = timed( lambda: read_clean( path, n ), repeat )
+        if serial is None:
+            serial = read_clean( path, 1 ) if n != 1 else df
+        pd.testing.assert_frame_equal( df, serial )
+
+    return results
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Time the parallel parse and clean of the source csv.' )
+    parser.add_argument( '--rows', type=int, default=1_000_000, help='rows of the synthetic dataset' )
+    parser.add_argument( '--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='worker counts to time' )
+    parser.add_argument( '--repeat', type=int, default=3, help='runs of each worker count ( the median is kept )' )
+    parser.add_argument( '--out', default=None, help='optional JSON results file' )
+    args = parser.parse_args( argv )
+
+    path = dataset( args.rows )
+    results = bench_workers( path, args.workers, args.repeat )
+    base = results[args.workers[0]]
+
+    cpus = os.cpu_count()
+    print( '{:,} rows, {} cores'.format( args.rows, cpus ) )
+    print( '{:>8} {:>10} {:>8}'.format( 'workers', 'seconds', 'speedup' ) )
+    for n, seconds in results.items():
+        print( '{:>8} {:>10.3f} {:>7.2f}x{}'.format( n, seconds, base / seconds, '  ( > cores )' if n > cpus else '' ) )
+    print( 'every result identical to the single process one' )
+
+    if args.out:
+        with open( args.out, 'w' ) as f:
+            json.dump( {'environment': environment(), 'rows': args.rows,
+                        'timings': {str( n ): round( s, 6 ) for n, s in results.items()}}, f, indent=2, sort_keys=True )
+            f.write( '\n' )
+
+
+if __name__ == '__main__':
+    main()
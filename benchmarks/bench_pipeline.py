@@ -0,0 +1,175 @@
+""" Headless benchmark of the dashboard pipeline.
+
+    For each dataset size, synthetic orders are generated once ( see
+    generate_data.py, cached in benchmarks/data/ ) and the suite times:
+
+    - ingest: read_csv, clean_code, optimize, the Parquet snapshot and the
+      derived indexes ( as-of index, filter bitmaps );
+    - the aggregation behind every data function of the three pages, on the
+      sidebar defaults ( cutoff 2022-04-03, every traffic condition ).
+
+    No Streamlit server is needed. The results are written as JSON with
+    sorted keys, one timing per line, so two runs diff cleanly between commits:
+
+        python benchmarks/bench_pipeline.py --rows 10000 1000000 --out benchmarks/results.json
+        python benchmarks/bench_pipeline.py --rows 10000 --compare benchmarks/results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from benchmarks.generate_data import generate  # noqa: E402
+from curry import store  # noqa: E402
+from curry.asof import AsOfIndex  # noqa: E402
+from curry.filters import BitmapIndex  # noqa: E402
+from curry.geo import grid_geojson  # noqa: E402
+from curry.ingest import clean_code  # noqa: E402
+from curry.metrics import FrameMetrics  # noqa: E402
+from curry.schema import optimize  # noqa: E402
+
+DATA_DIR = os.path.join( 'benchmarks', 'data' )
+CUTOFF = '2022-04-03'
+TRAFFIC = ['Low', 'Medium', 'High', 'Jam']
+
+# Data function of the pages -> aggregation it runs ( curry.metrics ):
+PAGE_FUNCTIONS = {
+    'company.order_metric': lambda m: m.orders_by_day(),
+    'company.traffic_order_share': lambda m: m.orders_by_traffic(),
+    'company.traffic_order_city': lambda m: m.orders_by_city_traffic(),
+    'company.order_by_week': lambda m: m.orders_by_week(),
+    'company.order_share_by_week': lambda m: m.orders_per_courier_by_week(),
+    'company.country_maps': lambda m: (grid_geojson( m.delivery_grid() ), m.location_medians(), m.delivery_points()),
+    'delivery.calculate': lambda m: [m.extreme( col, op ) for col in ['Delivery_person_Age', 'Vehicle_condition'] for op in ['max', 'min']],
+    'delivery.courier_ratings': lambda m: m.courier_ratings(),
+    'delivery.ratings': lambda m: (m.ratings( 'Road_traffic_density' ), m.ratings( 'Weatherconditions' )),
+    'delivery.top_n': lambda m: m.top_couriers( 10 ),
+    'restaurant.courier_count': lambda m: m.courier_count(),
+    'restaurant.distance': lambda m: m.avg_distance(),
+    'restaurant.time': lambda m: [m.festival_time( f, op ) for f in ['Yes', 'No'] for op in ['mean', 'std']],
+    'restaurant.avg_std_time_graph': lambda m: (m.time_by( 'City' ), m.time_by( ['City', 'Type_of_order'] )),
+    'restaurant.dist_distr_city': lambda m: m.distance_by_city(),
+    'restaurant.avg_time_city': lambda m: m.time_by( ['City', 'Road_traffic_density'] ),
+}
+
+
+def timed ( function, repeat=1 ):
+    """ This function runs a function repeat times
+
+        Output: median wall time in seconds and the result of the last run
+    """
+    times = []
+    for _ in range( repeat ):
+        start = time.perf_counter()
+        result = function()
+        times.append( time.perf_counter() - start )
+
+    return statistics.median( times ), result
+
+
+def dataset ( rows ):
+    """ This function returns the path of the synthetic dataset of a size, generating it once """
+    path = os.path.join( DATA_DIR, 'orders_{}.csv'.format( rows ) )
+    if not os.path.exists( path ):
+        print( 'generating {:,} rows...'.format( rows ), flush=True )
+        generate( rows, path )
+
+    return path
+
+
+def bench_size ( rows, repeat ):
+    """ This function times the ingest and the page aggregations on one dataset size
+
+        Output: dict {stage: seconds}
+    """
+    path = dataset( rows )
+    results = {}
+
+    results['ingest.read_csv'], raw = timed( lambda: pd.read_csv( path ) )
+    results['ingest.clean_code'], df = timed( lambda: clean_code( raw ) )
+    results['ingest.optimize'], df = timed( lambda: optimize( df ) )
+    del raw
+
+    root = tempfile.mkdtemp( prefix='curry_bench_' )
+    try:
+        results['ingest.snapshot_write'], _ = timed( lambda: store.write_snapshot( df, path, root ) )
+        results['ingest.snapshot_read'], _ = timed( lambda: store.read_snapshot( path, root ), repeat )
+    finally:
+        shutil.rmtree( root, ignore_errors=True )
+
+    results['ingest.asof_index'], index = timed( lambda: AsOfIndex( df ) )
+    results['ingest.bitmap_index'], bitmaps = timed( lambda: BitmapIndex( df ) )
+
+    def metrics ():
+        selected = bitmaps.before( CUTOFF ) & bitmaps.select( Road_traffic_density=TRAFFIC )
+        return FrameMetrics( df.loc[bitmaps.mask( selected ), :], index.asof( CUTOFF, TRAFFIC ) )
+
+    results['pages.filter'], m = timed( metrics, repeat )
+    for name, function in PAGE_FUNCTIONS.items():
+        results['pages.' + name], _ = timed( lambda: function( m ), repeat )
+
+    return {stage: round( seconds, 6 ) for stage, seconds in results.items()}
+
+
+def environment ():
+    try:
+        revision = subprocess.run( ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True ).stdout.strip()
+    except OSError:
+        revision = ''
+
+    return {'revision': revision or None, 'python': platform.python_version(), 'pandas': pd.__version__,
+            'numpy': np.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count()}
+
+
+def compare ( results, previous ):
+    """ This function prints the ratio of every timing to the same timing of a previous results file """
+    print( '{:<40} {:>10} {:>10} {:>8}'.format( 'stage', 'before', 'after', 'ratio' ) )
+    for size, timings in results['timings'].items():
+        before = previous['timings'].get( size, {} )
+        for stage, seconds in timings.items():
+            if stage in before:
+                ratio = seconds / before[stage] if before[stage] else float( 'nan' )
+                print( '{:<40} {:>10.4f} {:>10.4f} {:>7.2f}x'.format( size + ' ' + stage, before[stage], seconds, ratio ) )
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Time the ingest and the page aggregations on synthetic data, headless.' )
+    parser.add_argument( '--rows', type=int, nargs='+', default=[10_000, 1_000_000], help='dataset sizes ( e.g. 10000 1000000 10000000 )' )
+    parser.add_argument( '--repeat', type=int, default=5, help='runs of each fast stage ( the median is kept )' )
+    parser.add_argument( '--out', default=os.path.join( 'benchmarks', 'results.json' ), help='results file' )
+    parser.add_argument( '--compare', default=None, metavar='RESULTS_JSON', help='previous results file to compare with' )
+    args = parser.parse_args( argv )
+
+    results = {'environment': environment(), 'timings': {}}
+    for rows in args.rows:
+        print( 'benchmarking {:,} rows...'.format( rows ), flush=True )
+        results['timings'][str( rows )] = bench_size( rows, args.repeat )
+
+    with open( args.out, 'w' ) as f:
+        json.dump( results, f, indent=2, sort_keys=True )
+        f.write( '\n' )
+    print( 'results written to {}'.format( args.out ) )
+
+    if args.compare:
+        with open( args.compare ) as f:
+            compare( results, json.load( f ) )
+    else:
+        for size, timings in results['timings'].items():
+            for stage, seconds in timings.items():
+                print( '{:>10} {:<40} {:>10.4f}s'.format( size, stage, seconds ) )
+
+
+if __name__ == '__main__':
+    main()
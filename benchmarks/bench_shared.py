@@ -0,0 +1,109 @@
+""" Resident memory of several server processes, in memory and in shared mode ( curry.shared ).
+
+    Starts --workers processes per data mode, as a load balancer would. Each
+    one loads the dataset of the mode and computes every table of the pages
+    for two sidebar selections ( its session state ). While all of them are
+    alive, their memory is read from /proc/<pid>/smaps_rollup ( Linux only ):
+
+    - private: pages only this process maps ( its own copy of the data, its sessions );
+    - pss: the share of every mapped page, so the total of the processes counts
+      the shared dataset once.
+
+        python benchmarks/bench_shared.py [--rows 2000000] [--workers 4]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+sys.path.insert( 0, ROOT )
+
+from benchmarks.bench_pipeline import dataset  # noqa: E402
+
+MODES = ['memory', 'shared']
+
+WORKER = '''
+import os, sys
+os.environ['CURRY_DATA_MODE'] = sys.argv[1]
+from curry import cache
+from curry.sql import CHECKS
+for cutoff, traffic in [('2022-04-03', ['Low', 'Medium', 'High', 'Jam']), ('2022-03-10', ['Jam'])]:
+    metrics = cache.frame_metrics( cutoff, traffic, sys.argv[2] )
+    for check in CHECKS.values():
+        check( metrics )
+print( 'ready', flush=True )
+sys.stdin.readline()
+'''
+
+
+def smaps ( pid ):
+    """ This function reads the memory summary of a process, in MB
+
+        Output: dict {field of smaps_rollup: MB}
+    """
+    fields = {}
+    with open( '/proc/{}/smaps_rollup'.format( pid ) ) as f:
+        for line in f:
+            parts = line.split()
+            if len( parts ) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip( ':' )] = int( parts[1] ) / 1024
+
+    return fields
+
+
+def measure ( mode, path, workers ):
+    """ This function starts the workers of a mode and measures them once they are all ready
+
+        Output: list of dicts with rss, pss and private MB of every worker
+    """
+    env = dict( os.environ, PYTHONPATH=ROOT )
+    processes = [subprocess.Popen( [sys.executable, '-c', WORKER, mode, path], cwd=ROOT, env=env, text=True,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE ) for _ in range( workers )]
+    try:
+        for process in processes:
+            process.stdout.readline()
+        results = []
+        for process in processes:
+            fields = smaps( process.pid )
+            results.append( {'rss': fields['Rss'], 'pss': fields['Pss'],
+                             'private': fields['Private_Clean'] + fields['Private_Dirty']} )
+    finally:
+        for process in processes:
+            process.stdin.write( '\n' )
+            process.stdin.flush()
+            process.wait()
+
+    return results
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Compare the resident memory of several workers in memory and shared mode.' )
+    parser.add_argument( '--rows', type=int, default=2_000_000, help='rows of the synthetic dataset' )
+    parser.add_argument( '--workers', type=int, default=4, help='server processes per mode' )
+    parser.add_argument( '--out', default=None, help='optional JSON results file' )
+    args = parser.parse_args( argv )
+
+    path = dataset( args.rows )
+    # Publish once before the workers start, as a deployment would
+    subprocess.run( [sys.executable, '-m', 'curry.shared', '--source', path], cwd=ROOT, check=True )
+
+    results = {}
+    print( '{:,} rows, {} workers'.format( args.rows, args.workers ) )
+    print( '{:>8} {:>14} {:>14} {:>14}'.format( 'mode', 'private / wkr', 'pss / wkr', 'total pss' ) )
+    for mode in MODES:
+        workers = results[mode] = measure( mode, path, args.workers )
+        print( '{:>8} {:>11.0f} MB {:>11.0f} MB {:>11.0f} MB'.format(
+            mode, max( w['private'] for w in workers ), max( w['pss'] for w in workers ), sum( w['pss'] for w in workers ) ) )
+
+    if args.out:
+        with open( args.out, 'w' ) as f:
+            json.dump( {'rows': args.rows, 'workers': args.workers, 'results': results}, f, indent=2, sort_keys=True )
+            f.write( '\n' )
+
+
+if __name__ == '__main__':
+    main()
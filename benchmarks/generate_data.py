@@ -0,0 +1,157 @@
+""" Synthetic orders in the shape of ftc_train.csv.
+
+    Keeps the quirks of the source file that clean_code() handles: strings
+    padded with a trailing space, 'NaN ' sentinels in the numeric and text
+    columns, 'conditions NaN' in Weatherconditions, dates as DD-MM-YYYY and
+    delivery times as '(min) NN'. Restaurants are placed around the cities of
+    the source file, with a few rows of mirrored or zero coordinates.
+
+    Rows are written in chunks, so 10M rows do not need 10M rows of memory.
+
+    Run from the repository root:
+
+        python benchmarks/generate_data.py --rows 1000000 --out benchmarks/data/orders_1000000.csv
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 500_000
+
+# Prefix of the delivery person ID and centre of the restaurants of each city:
+CITIES = [('INDORES', 22.745049, 75.892471), ('BANGRES', 12.914264, 77.678400), ('COIMBRES', 11.003669, 76.976494),
+          ('CHENRES', 13.082680, 80.270718), ('MYSRES', 12.295810, 76.639381), ('HYDRES', 17.385044, 78.486671),
+          ('PUNERES', 18.520430, 73.856744), ('MUMRES', 19.075984, 72.877656), ('KOLRES', 22.572646, 88.363895),
+          ('JAPRES', 26.912434, 75.787271), ('SURRES', 21.170240, 72.831061), ('RANCHIRES', 23.344100, 85.309562),
+          ('KOCRES', 9.931233, 76.267304), ('VADRES', 22.307159, 73.181219), ('AGRRES', 27.176670, 78.008075),
+          ('DEHRES', 30.316496, 78.032188), ('CHANDRES', 30.733315, 76.779419), ('AURGRES', 19.876165, 75.343314),
+          ('BHPRES', 23.259933, 77.412615), ('GOARES', 15.299326, 74.123996), ('LUDHRES', 30.900965, 75.857276),
+          ('ALHRES', 25.435801, 81.846311), ('KNPRES', 26.449923, 80.331871)]
+
+TRAFFIC = ['Low', 'Medium', 'High', 'Jam']
+WEATHER = ['Sunny', 'Stormy', 'Sandstorms', 'Cloudy', 'Fog', 'Windy']
+ORDERS = ['Snack', 'Meal', 'Drinks', 'Buffet']
+VEHICLES = ['motorcycle', 'scooter', 'electric_scooter', 'bicycle']
+AREAS = ['Metropolitian', 'Urban', 'Semi-Urban']
+
+FIRST_DAY = pd.Timestamp( '2022-02-11' )
+DAYS = 55
+
+
+def padded ( values ):
+    """ Text values with the trailing space of the source file """
+    return np.char.add( np.asarray( values, dtype=str ), ' ' ).astype( object )
+
+
+def with_nan ( rng, values, share, sentinel='NaN ' ):
+    """ This function replaces a share of the values by the sentinel of the source file """
+    values = np.asarray( values, dtype=object )
+    values[rng.random( len( values ) ) < share] = sentinel
+
+    return values
+
+
+def chunk ( rng, start, rows ):
+    """ This function generates the orders start .. start + rows
+
+        Input: random generator, number of the first order and number of orders
+        Output: DataFrame with the columns of ftc_train.csv
+    """
+    city = rng.integers( 0, len( CITIES ), rows )
+    prefix = np.array( [c[0] for c in CITIES] )[city]
+    centre_lat = np.array( [c[1] for c in CITIES] )[city]
+    centre_lng = np.array( [c[2] for c in CITIES] )[city]
+
+    restaurant = rng.integers( 1, 21, rows )
+    courier = rng.integers( 1, 4, rows )
+    courier_id = np.char.add( np.char.add( np.char.add( prefix, np.char.zfill( restaurant.astype( str ), 2 ) ), 'DEL' ),
+                              np.char.zfill( courier.astype( str ), 2 ) )
+
+    # Restaurants around the city centre; some rows of the source have mirrored or zero coordinates
+    rest_lat = centre_lat + rng.uniform( -0.1, 0.1, rows )
+    rest_lng = centre_lng + rng.uniform( -0.1, 0.1, rows )
+    quirk = rng.random( rows )
+    rest_lat[quirk < 0.02], rest_lng[quirk < 0.02] = -rest_lat[quirk < 0.02], -rest_lng[quirk < 0.02]
+    rest_lat[quirk > 0.995], rest_lng[quirk > 0.995] = 0.0, 0.0
+    delivery_lat = np.abs( rest_lat ) + rng.choice( [0.01, 0.02, 0.03, 0.05, 0.07, 0.1, 0.13], rows )
+    delivery_lng = np.abs( rest_lng ) + rng.choice( [0.01, 0.02, 0.03, 0.05, 0.07, 0.1, 0.13], rows )
+
+    age = rng.integers( 20, 40, rows )
+    traffic = rng.choice( len( TRAFFIC ), rows, p=[0.34, 0.24, 0.10, 0.32] )
+    weather = rng.integers( 0, len( WEATHER ), rows )
+    festival = rng.random( rows ) < 0.02
+    minutes = np.clip( 12 + 4 * traffic + 3 * (weather % 3) + 15 * festival + rng.normal( 0, 6, rows ), 10, 54 ).astype( int )
+
+    ordered = rng.integers( 8 * 60, 23 * 60, rows )
+    picked = ordered + rng.choice( [5, 10, 15], rows )
+
+    df = pd.DataFrame( {
+        'ID': padded( np.char.add( '0x', np.char.mod( '%x', np.arange( start, start + rows ) ) ) ),
+        'Delivery_person_ID': padded( courier_id ),
+        'Delivery_person_Age': with_nan( rng, age.astype( str ), 0.04 ),
+        'Delivery_person_Ratings': np.round( np.clip( rng.normal( 4.6, 0.3, rows ), 2.5, 5.0 ), 1 ).astype( str ).astype( object ),
+        'Restaurant_latitude': np.round( rest_lat, 6 ),
+        'Restaurant_longitude': np.round( rest_lng, 6 ),
+        'Delivery_location_latitude': np.round( delivery_lat, 6 ),
+        'Delivery_location_longitude': np.round( delivery_lng, 6 ),
+        'Order_Date': (FIRST_DAY + pd.to_timedelta( rng.integers( 0, DAYS, rows ), unit='D' )).strftime( '%d-%m-%Y' ),
+        'Time_Orderd': with_nan( rng, np.char.add( np.char.add( np.char.zfill( (ordered // 60).astype( str ), 2 ), ':' ),
+                                                   np.char.add( np.char.zfill( (ordered % 60).astype( str ), 2 ), ':00' ) ), 0.04 ),
+        'Time_Order_picked': np.char.add( np.char.add( np.char.zfill( (picked // 60 % 24).astype( str ), 2 ), ':' ),
+                                          np.char.add( np.char.zfill( (picked % 60).astype( str ), 2 ), ':00' ) ),
+        'Weatherconditions': with_nan( rng, np.char.add( 'conditions ', np.array( WEATHER )[weather] ), 0.01, 'conditions NaN' ),
+        'Road_traffic_density': with_nan( rng, padded( np.array( TRAFFIC )[traffic] ), 0.01 ),
+        'Vehicle_condition': rng.integers( 0, 4, rows ),
+        'Type_of_order': padded( rng.choice( ORDERS, rows ) ),
+        'Type_of_vehicle': padded( rng.choice( VEHICLES, rows, p=[0.58, 0.33, 0.08, 0.01] ) ),
+        'multiple_deliveries': with_nan( rng, rng.choice( ['0', '1', '2', '3'], rows, p=[0.31, 0.62, 0.045, 0.025] ), 0.02 ),
+        'Festival': with_nan( rng, padded( np.where( festival, 'Yes', 'No' ) ), 0.005 ),
+        'City': with_nan( rng, padded( rng.choice( AREAS, rows, p=[0.75, 0.22, 0.03] ) ), 0.03 ),
+        'Time_taken(min)': np.char.add( '(min) ', minutes.astype( str ) ),
+    } )
+
+    # The source file has no rating when the age is missing
+    df.loc[df['Delivery_person_Age'] == 'NaN ', 'Delivery_person_Ratings'] = 'NaN '
+
+    return df
+
+
+def generate ( rows, out, seed=0, chunk_rows=CHUNK_ROWS ):
+    """ This function writes rows synthetic orders to a csv file
+
+        Input: number of rows, output path, random seed and rows per chunk
+        Output: path of the file
+    """
+    folder = os.path.dirname( out )
+    if folder:
+        os.makedirs( folder, exist_ok=True )
+
+    rng = np.random.default_rng( seed )
+    tmp = out + '.tmp'
+    with open( tmp, 'w', newline='' ) as f:
+        for start in range( 0, rows, chunk_rows ):
+            chunk( rng, start, min( chunk_rows, rows - start ) ).to_csv( f, header=start == 0, index=False )
+    os.replace( tmp, out )
+
+    return out
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Write synthetic orders in the shape of ftc_train.csv.' )
+    parser.add_argument( '--rows', type=int, default=10_000, help='number of orders' )
+    parser.add_argument( '--out', default=None, help='output csv ( default benchmarks/data/orders_<rows>.csv )' )
+    parser.add_argument( '--seed', type=int, default=0, help='random seed' )
+    args = parser.parse_args( argv )
+
+    out = args.out or os.path.join( 'benchmarks', 'data', 'orders_{}.csv'.format( args.rows ) )
+    start = time.perf_counter()
+    generate( args.rows, out, args.seed )
+    print( 'wrote {:,} rows to {} in {:.1f}s'.format( args.rows, out, time.perf_counter() - start ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,452 @@
+""" Load test of the app: concurrent sessions against a real headless server, without a browser.
+
+    Starts `streamlit run Home.py` headless ( or attaches to --url ) and opens
+    --sessions websocket sessions, speaking the protocol of the browser: each
+    session sends a rerun with its widget states ( BackMsg ) and reads the
+    messages of the server ( ForwardMsg ) until the script finishes. The
+    latency of a rerun is the time from the request to script_finished, as a
+    user waits for it. Every session, until --duration ends:
+
+    - opens a page at random ( Home and every page of pages/, as listed by the server );
+    - moves the widgets the page drew: the date slider, the traffic multiselect,
+      the number inputs and the tabs, to random values;
+    - thinks for a random time ( exponential, --think-ms on average ) between reruns.
+
+    Before the timed run one session visits every page, so the cold start of
+    the server ( imports, dataset load ) is reported apart. The report has the
+    latency percentiles by page and action, the throughput in reruns per second,
+    the errors and the resident memory of the server over time ( /proc, Linux only ).
+    The data mode of the server comes from the environment ( CURRY_DATA_MODE ).
+
+        python benchmarks/load_test.py [--sessions 50] [--duration 60] [--think-ms 500]
+
+    With --compare the same load runs against two git revisions, each one
+    served from a temporary worktree ( the dataset is linked into it ), and
+    the reports are printed side by side:
+
+        python benchmarks/load_test.py --compare master HEAD~3 [--sessions 20]
+
+    The harness shares the host with the server: on a small box its own CPU
+    use ( parsing the messages of every session ) adds to the latencies.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+
+ROOT = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+
+# Files the app needs that git does not track, linked into the worktrees of --compare
+UNTRACKED = ['ftc_train.csv']
+
+WIDGETS = ['slider', 'multiselect', 'number_input', 'radio']
+
+PERCENTILES = [50, 90, 99]
+
+
+def free_port ():
+    """ This function returns a free TCP port of the host """
+    with socket.socket() as s:
+        s.bind( ('127.0.0.1', 0) )
+        return s.getsockname()[1]
+
+
+def start_server ( root, port, timeout=120 ):
+    """ This function starts a headless streamlit server on the app of a folder and waits until it is healthy
+
+        Input: folder with Home.py, port and seconds to wait
+        Output: Popen of the server
+    """
+    env = dict( os.environ, PYTHONPATH=root )
+    command = [sys.executable, '-m', 'streamlit', 'run', 'Home.py', '--server.headless', 'true',
+               '--server.port', str( port ), '--server.fileWatcherType', 'none', '--browser.gatherUsageStats', 'false']
+    # The log goes to a file: a pipe nobody reads fills up and blocks the server
+    log = tempfile.TemporaryFile( mode='w+' )
+    server = subprocess.Popen( command, cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT )
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            log.seek( 0 )
+            raise RuntimeError( 'the server exited: {}'.format( log.read() ) )
+        try:
+            with urllib.request.urlopen( 'http://127.0.0.1:{}/_stcore/health'.format( port ), timeout=1 ) as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep( 0.2 )
+
+    stop_server( server )
+    raise RuntimeError( 'the server did not answer in {}s'.format( timeout ) )
+
+
+def stop_server ( server ):
+    """ This function stops a server started by start_server() """
+    server.send_signal( signal.SIGTERM )
+    try:
+        server.wait( 10 )
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def rss_mb ( pid ):
+    """ This function reads the resident memory of a process, in MB ( None if it is gone ) """
+    try:
+        with open( '/proc/{}/status'.format( pid ) ) as f:
+            for line in f:
+                if line.startswith( 'VmRSS:' ):
+                    return int( line.split()[1] ) / 1024
+    except OSError:
+        return None
+
+
+def random_state ( kind, widget, rng ):
+    """ This function draws a random value for a widget drawn by a page
+
+        Input: widget type ( WIDGETS ), its element proto and a random.Random
+        Output: WidgetState with the id of the widget
+    """
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    state = WidgetState( id=widget.id )
+    if kind == 'slider':
+        # Dates are sent as microseconds, like any other slider value: a multiple of the step above the min
+        steps = int( (widget.max - widget.min) // widget.step )
+        values = sorted( widget.min + widget.step * rng.randint( 0, steps ) for _ in widget.default )
+        state.double_array_value.data.extend( values )
+    elif kind == 'multiselect':
+        options = range( len( widget.options ) )
+        state.int_array_value.data.extend( sorted( rng.sample( options, rng.randint( 1, len( options ) ) ) ) )
+    elif kind == 'number_input':
+        low = widget.min if widget.has_min else widget.default - 10 * widget.step
+        high = widget.max if widget.has_max else widget.default + 10 * widget.step
+        value = low + widget.step * rng.randint( 0, int( (high - low) // widget.step ) )
+        if widget.data_type == widget.INT:
+            state.int_value = int( value )
+        else:
+            state.double_value = value
+    else:
+        state.int_value = rng.randrange( len( widget.options ) )
+
+    return state
+
+
+class Session:
+    """ One user of the app, speaking the websocket protocol of the browser
+
+        Input: websocket url of the server and seconds to wait for a rerun
+    """
+
+    def __init__ ( self, url, timeout ):
+        self.url = url
+        self.timeout = timeout
+        self.pages = {}
+        self.page = None
+        self.widgets = {}
+        self.states = {}
+
+    async def connect ( self ):
+        from tornado.httpclient import HTTPRequest
+        from tornado.websocket import websocket_connect
+
+        self.ws = await websocket_connect( HTTPRequest( self.url, headers={'Sec-WebSocket-Protocol': 'streamlit'} ),
+                                           max_message_size=2**30 )
+
+    def close ( self ):
+        self.ws.close()
+
+    async def rerun ( self, page=None ):
+        """ This function reruns a page with the current widget states and waits for the end of the script
+
+            Input: name of the page ( None: the current one )
+            Output: (seconds, error message or None)
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        if page is not None and page != self.page:
+            # A new page starts from the defaults of its widgets
+            self.page, self.widgets, self.states = page, {}, {}
+        msg = BackMsg()
+        msg.rerun_script.page_script_hash = self.pages.get( self.page, '' )
+        msg.rerun_script.widget_states.widgets.extend( self.states.values() )
+
+        start = time.perf_counter()
+        await self.ws.write_message( msg.SerializeToString(), binary=True )
+        try:
+            error = await asyncio.wait_for( self._read_run(), self.timeout )
+        except asyncio.TimeoutError:
+            error = 'timeout'
+
+        return time.perf_counter() - start, error
+
+    async def _read_run ( self ):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        error = None
+        while True:
+            raw = await self.ws.read_message()
+            if raw is None:
+                return 'connection closed'
+            msg = ForwardMsg()
+            msg.ParseFromString( raw )
+            kind = msg.WhichOneof( 'type' )
+            if kind == 'new_session':
+                self.pages = {page.page_name: page.page_script_hash for page in msg.new_session.app_pages}
+                self.page = self.page or msg.new_session.app_pages[0].page_name
+            elif kind == 'delta' and msg.delta.WhichOneof( 'type' ) == 'new_element':
+                element = msg.delta.new_element
+                widget = element.WhichOneof( 'type' )
+                if widget in WIDGETS:
+                    self.widgets[getattr( element, widget ).id] = (widget, getattr( element, widget ))
+                elif widget == 'exception':
+                    error = error or element.exception.message
+            elif kind == 'script_finished':
+                if msg.script_finished != msg.FINISHED_SUCCESSFULLY:
+                    error = error or ForwardMsg.ScriptFinishedStatus.Name( msg.script_finished )
+                return error
+
+    def interact ( self, rng ):
+        """ This function moves one widget of the current page to a random value
+
+            Output: type of the widget moved ( None if the page has no widget )
+        """
+        if not self.widgets:
+            return None
+        widget_id = rng.choice( sorted( self.widgets ) )
+        kind, widget = self.widgets[widget_id]
+        self.states[widget_id] = random_state( kind, widget, rng )
+
+        return kind
+
+
+async def user ( url, samples, deadline, rng, think, timeout, origin ):
+    """ This function runs one session until the deadline, appending a sample per rerun
+
+        Input: websocket url, list of samples, deadline ( loop time ), random.Random,
+               mean think time and rerun timeout in seconds, start of the run ( perf_counter )
+    """
+    loop = asyncio.get_running_loop()
+    session = Session( url, timeout )
+    await asyncio.sleep( rng.uniform( 0, min( 1.0, think ) ) )
+    await session.connect()
+    try:
+        latency, error = await session.rerun()
+        samples.append( {'t': time.perf_counter() - origin, 'page': session.page, 'action': 'open',
+                         'latency': latency, 'error': error} )
+        while loop.time() < deadline:
+            await asyncio.sleep( rng.expovariate( 1 / think ) if think else 0 )
+            # One rerun in four opens a page, the others move a widget
+            action = None if rng.random() < 0.25 else session.interact( rng )
+            page = rng.choice( sorted( session.pages ) ) if action is None else None
+            latency, error = await session.rerun( page )
+            samples.append( {'t': time.perf_counter() - origin, 'page': session.page, 'action': action or 'open',
+                             'latency': latency, 'error': error} )
+    finally:
+        session.close()
+
+
+async def sample_memory ( pid, memory, deadline, interval, origin ):
+    """ This function samples the resident memory of the server until the deadline """
+    loop = asyncio.get_running_loop()
+    while loop.time() < deadline:
+        memory.append( {'t': time.perf_counter() - origin, 'rss': rss_mb( pid )} )
+        await asyncio.sleep( interval )
+    memory.append( {'t': time.perf_counter() - origin, 'rss': rss_mb( pid )} )
+
+
+async def warm_up ( url, timeout ):
+    """ This function visits every page once with one session ( the cold start of the server )
+
+        Output: list of (page, seconds, error)
+    """
+    session = Session( url, timeout )
+    await session.connect()
+    try:
+        await session.rerun()
+        return [(page, *await session.rerun( page )) for page in sorted( session.pages )]
+    finally:
+        session.close()
+
+
+async def load ( url, pid, args ):
+    """ This function runs the concurrent sessions and the memory sampler
+
+        Input: websocket url, pid of the server ( None: no memory samples ) and the parsed arguments
+        Output: dict with the samples of the reruns and of the memory, and the wall time
+    """
+    loop = asyncio.get_running_loop()
+    origin = time.perf_counter()
+    deadline = loop.time() + args.duration
+    rng = random.Random( args.seed )
+    samples, memory = [], []
+
+    tasks = [user( url, samples, deadline, random.Random( rng.random() ), args.think_ms / 1000, args.timeout, origin )
+             for _ in range( args.sessions )]
+    if pid is not None:
+        tasks.append( sample_memory( pid, memory, deadline, args.sample_s, origin ) )
+    await asyncio.gather( *tasks )
+
+    return {'samples': samples, 'memory': memory, 'wall': time.perf_counter() - origin}
+
+
+def summarize ( run ):
+    """ This function computes the latency percentiles, the throughput and the errors of a run
+
+        Input: dict returned by load()
+        Output: dict with the rows of the latency table, the totals and the memory over time
+    """
+    samples = run['samples']
+    groups = {'all': [s['latency'] for s in samples]}
+    for s in samples:
+        groups.setdefault( '{} / {}'.format( s['page'], s['action'] ), [] ).append( s['latency'] )
+
+    table = {}
+    for name, latencies in groups.items():
+        if latencies:
+            ms = np.asarray( latencies ) * 1000
+            table[name] = dict( {'reruns': len( ms ), 'max': float( ms.max() )},
+                                **{'p{}'.format( q ): float( np.percentile( ms, q ) ) for q in PERCENTILES} )
+
+    errors = {}
+    for s in samples:
+        if s['error']:
+            error = '{} / {}: {}'.format( s['page'], s['action'], s['error'].splitlines()[0][:100] )
+            errors[error] = errors.get( error, 0 ) + 1
+    rss = [m['rss'] for m in run['memory'] if m['rss'] is not None]
+
+    return {'latency_ms': table, 'reruns': len( samples ), 'throughput': len( samples ) / run['wall'],
+            'errors': errors, 'memory': run['memory'],
+            'rss_start': rss[0] if rss else None, 'rss_peak': max( rss ) if rss else None}
+
+
+def run_app ( root, args, url=None, pid=None ):
+    """ This function runs the load test against the app of a folder ( or against a running server )
+
+        Input: folder with Home.py, the parsed arguments, and url / pid of a running server
+        Output: dict with the cold start and the summary of the run
+    """
+    server = None
+    if url is None:
+        port = free_port()
+        server = start_server( root, port )
+        url, pid = 'ws://127.0.0.1:{}/_stcore/stream'.format( port ), server.pid
+    try:
+        cold = asyncio.run( warm_up( url, args.timeout ) )
+        result = summarize( asyncio.run( load( url, pid, args ) ) )
+    finally:
+        if server is not None:
+            stop_server( server )
+    result['cold_start'] = [{'page': page, 'latency': latency * 1000, 'error': error} for page, latency, error in cold]
+
+    return result
+
+
+def run_revision ( revision, args ):
+    """ This function runs the load test against a git revision, served from a temporary worktree
+
+        Input: any git revision and the parsed arguments
+        Output: dict of run_app(), with the commit tested
+    """
+    commit = subprocess.run( ['git', 'rev-parse', '--short', revision], cwd=ROOT, check=True,
+                             capture_output=True, text=True ).stdout.strip()
+    folder = tempfile.mkdtemp( prefix='curry-load-' )
+    worktree = os.path.join( folder, commit )
+    subprocess.run( ['git', 'worktree', 'add', '--detach', worktree, commit], cwd=ROOT, check=True, capture_output=True )
+    try:
+        for name in UNTRACKED:
+            if os.path.exists( os.path.join( ROOT, name ) ) and not os.path.exists( os.path.join( worktree, name ) ):
+                os.symlink( os.path.join( ROOT, name ), os.path.join( worktree, name ) )
+        result = run_app( worktree, args )
+    finally:
+        subprocess.run( ['git', 'worktree', 'remove', '--force', worktree], cwd=ROOT, capture_output=True )
+        shutil.rmtree( folder, ignore_errors=True )
+    result['revision'] = '{} ( {} )'.format( revision, commit )
+
+    return result
+
+
+def print_report ( results, args ):
+    """ This function prints the results of one or more runs, side by side
+
+        Input: dict {name of the run: dict of run_app()} and the parsed arguments
+    """
+    names = list( results )
+    print( '{} sessions, {}s, think time {} ms{}'.format( args.sessions, args.duration, args.think_ms,
+                                                         ', CURRY_DATA_MODE=' + os.environ['CURRY_DATA_MODE']
+                                                         if 'CURRY_DATA_MODE' in os.environ else '' ) )
+    width = max( 30, *(len( name ) + 2 for name in names) )
+    print( '{:<40}'.format( '' ) + ''.join( '{:>{}}'.format( name, width ) for name in names ) )
+
+    def row ( label, values ):
+        print( '{:<40}'.format( label ) + ''.join( '{:>{}}'.format( value, width ) for value in values ) )
+
+    row( 'throughput', ['{:.1f} reruns/s'.format( r['throughput'] ) for r in results.values()] )
+    row( 'reruns / errors', ['{} / {}'.format( r['reruns'], sum( r['errors'].values() ) ) for r in results.values()] )
+    row( 'server rss start / peak', ['{:.0f} / {:.0f} MB'.format( r['rss_start'], r['rss_peak'] )
+                                     if r['rss_peak'] is not None else '-' for r in results.values()] )
+    row( 'cold start', ['{:.0f} ms'.format( sum( c['latency'] for c in r['cold_start'] ) ) for r in results.values()] )
+
+    print( '\nlatency p50 / p90 / p99 / max, ms' )
+    groups = sorted( {name for r in results.values() for name in r['latency_ms']}, key=lambda name: (name != 'all', name) )
+    for group in groups:
+        cells = []
+        for r in results.values():
+            t = r['latency_ms'].get( group )
+            cells.append( '{:.0f} / {:.0f} / {:.0f} / {:.0f}'.format( t['p50'], t['p90'], t['p99'], t['max'] ) if t else '-' )
+        row( '{} ( {} )'.format( group, max( r['latency_ms'].get( group, {} ).get( 'reruns', 0 ) for r in results.values() ) )
+             if len( results ) == 1 else group, cells )
+
+    print( '\nserver rss over time, MB' )
+    for name, r in results.items():
+        memory = [m for m in r['memory'] if m['rss'] is not None]
+        step = max( 1, len( memory ) // 10 )
+        print( '  {:<{}} '.format( name, width - 2 ) + '  '.join( '{:.0f}s {:.0f}'.format( m['t'], m['rss'] )
+                                                                  for m in memory[::step] + memory[-1:] ) )
+
+    for name, r in results.items():
+        for message, count in r['errors'].items():
+            print( '{}: {} x {}'.format( name, count, message ) )
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Load test the app with concurrent headless sessions.' )
+    parser.add_argument( '--sessions', type=int, default=50, help='concurrent sessions' )
+    parser.add_argument( '--duration', type=float, default=60, help='seconds of load' )
+    parser.add_argument( '--think-ms', type=float, default=500, help='mean pause of a session between reruns' )
+    parser.add_argument( '--timeout', type=float, default=300, help='seconds to wait for a rerun' )
+    parser.add_argument( '--sample-s', type=float, default=1, help='seconds between memory samples' )
+    parser.add_argument( '--seed', type=int, default=0, help='seed of the random interactions' )
+    parser.add_argument( '--url', default=None, help='websocket of a running server, e.g. ws://host:8501/_stcore/stream' )
+    parser.add_argument( '--pid', type=int, default=None, help='pid of the running server of --url, for its memory' )
+    parser.add_argument( '--compare', nargs=2, metavar=('REV_A', 'REV_B'), help='run against two git revisions' )
+    parser.add_argument( '--out', default=None, help='optional JSON results file' )
+    args = parser.parse_args( argv )
+
+    if args.compare:
+        results = {revision: run_revision( revision, args ) for revision in args.compare}
+    else:
+        results = {args.url or 'working tree': run_app( ROOT, args, args.url, args.pid )}
+    print_report( results, args )
+
+    if args.out:
+        arguments = {key: value for key, value in vars( args ).items() if key != 'out'}
+        with open( args.out, 'w' ) as f:
+            json.dump( {'arguments': arguments, 'results': results}, f, indent=2, sort_keys=True )
+            f.write( '\n' )
+
+
+if __name__ == '__main__':
+    main()
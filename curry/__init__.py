@@ -0,0 +1,5 @@
+""" Shared data layer of the Curry Company dashboard.
+
+    The Streamlit pages in pages/ import from here instead of keeping
+    their own copies of the loading and cleaning code.
+"""
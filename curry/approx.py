@@ -0,0 +1,257 @@
+""" Approximate mode: distinct counts and medians from sketches kept per day.
+
+    The number of distinct delivery people ( in total and by week ) and the
+    median delivery coordinates of the map are exact only with the rows: a
+    hash table of every courier, a sort of every coordinate, growing with the
+    history. DaySketches keeps instead, for every day with orders:
+
+    - a HyperLogLog of the delivery people by traffic condition;
+    - quantile sketches of the delivery coordinates by city and traffic.
+
+    Both merge, so the sketches of the days before any cutoff combine into
+    the answer of that cutoff, and the days appended to the dataset only add
+    new sketches. The error bounds come from CURRY_DISTINCT_ERROR and
+    CURRY_QUANTILE_ERROR ( curry.config ); turn the mode on with
+    CURRY_APPROXIMATE=1. Check the errors against the exact tables:
+
+        python -m curry.approx --source ftc_train.csv [--distinct-error 0.01] [--quantile-error 0.01]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from curry import config
+from curry.ingest import DATASET_PATH
+from curry.metrics import FrameMetrics
+from curry.sketches import HyperLogLog, QuantileSketch, k_for_error, precision_for_error
+
+MAP_KEYS = ['City', 'Road_traffic_density']
+MAP_COLUMNS = ['Delivery_location_latitude', 'Delivery_location_longitude']
+
+# Columns the day sketches are built from:
+COLUMNS = ['Order_Date', 'Delivery_person_ID'] + MAP_KEYS + MAP_COLUMNS
+
+
+class DaySketches:
+    """ Mergeable sketches of the orders of every day
+
+        Input: cleaned DataFrame ( or None, to fold chunks later ), items per level of the
+               quantile sketches and index bits of the distinct counters ( None: no distinct counters )
+    """
+
+    def __init__ ( self, df=None, k=None, p=None ):
+        self.k = k or k_for_error( config.QUANTILE_ERROR )
+        self.p = p
+        self.couriers = {}
+        self.locations = {}
+        if df is not None:
+            self.fold( df )
+
+    def fold ( self, df ):
+        """ This function adds the orders of a DataFrame to the sketches of their days """
+        if self.p is not None:
+            for key, couriers in df.groupby( ['Order_Date', 'Road_traffic_density'], sort=False, observed=True )['Delivery_person_ID']:
+                sketch = self.couriers.get( key )
+                if sketch is None:
+                    sketch = self.couriers[key] = HyperLogLog( self.p )
+                sketch.update( couriers.to_numpy() )
+
+        for key, group in df.groupby( MAP_KEYS + ['Order_Date'], sort=False, observed=True ):
+            sketches = self.locations.get( key )
+            if sketches is None:
+                sketches = self.locations[key] = [QuantileSketch( self.k ) for _ in MAP_COLUMNS]
+            for sketch, col in zip( sketches, MAP_COLUMNS ):
+                sketch.update( group[col].to_numpy() )
+
+        return self
+
+    def append ( self, df ):
+        """ This function adds new orders to the sketches, in place ( see curry.cache ) """
+        return self.fold( df )
+
+    def view ( self, cutoff, traffic ):
+        """ This function returns the sketches of the orders with date < cutoff and the selected traffic
+
+            Output: SketchView
+        """
+        return SketchView( self, cutoff, traffic )
+
+
+class SketchView:
+    """ Tables answered by merging the day sketches before a cutoff """
+
+    def __init__ ( self, sketches, cutoff, traffic ):
+        self.sketches = sketches
+        self.cutoff = np.datetime64( pd.Timestamp( cutoff ) )
+        self.traffic = list( traffic )
+
+    def _couriers ( self ):
+        # Distinct counters of the selected days, by day
+        for (day, traffic), sketch in self.sketches.couriers.items():
+            if np.datetime64( day ) < self.cutoff and traffic in self.traffic:
+                yield day, sketch
+
+    def courier_count ( self ):
+        """ Approximate number of distinct delivery people """
+        total = HyperLogLog( self.sketches.p )
+        for _, sketch in self._couriers():
+            total.merge( sketch )
+
+        return int( round( total.count() ) )
+
+    def couriers_by_week ( self ):
+        """ Approximate number of distinct delivery people by week of the year ( columns week_of_year, Delivery_person_ID ) """
+        weeks = {}
+        for day, sketch in self._couriers():
+            week = pd.Timestamp( day ).strftime( '%U' )
+            if week not in weeks:
+                weeks[week] = HyperLogLog( self.sketches.p )
+            weeks[week].merge( sketch )
+
+        return pd.DataFrame( [[week, int( round( sketch.count() ) )] for week, sketch in sorted( weeks.items() )],
+                             columns=['week_of_year', 'Delivery_person_ID'] )
+
+    def location_medians ( self ):
+        """ Approximate median delivery location by city and traffic """
+        merged = {}
+        for (city, traffic, day), sketches in self.sketches.locations.items():
+            if np.datetime64( day ) >= self.cutoff or traffic not in self.traffic:
+                continue
+            if (city, traffic) not in merged:
+                merged[(city, traffic)] = [QuantileSketch( self.sketches.k ) for _ in MAP_COLUMNS]
+            for total, sketch in zip( merged[(city, traffic)], sketches ):
+                total.merge( sketch )
+
+        rows = [[city, traffic] + [sketch.median() for sketch in sketches]
+                for (city, traffic), sketches in sorted( merged.items() )]
+
+        return pd.DataFrame( rows, columns=MAP_KEYS + MAP_COLUMNS )
+
+
+def build_sketches ( df ):
+    """ This function builds the day sketches of the dataset with the error bounds of curry.config
+
+        Input: cleaned DataFrame
+        Output: DaySketches
+    """
+    return DaySketches( df, k_for_error( config.QUANTILE_ERROR ), precision_for_error( config.DISTINCT_ERROR ) )
+
+
+class ApproxMetrics ( FrameMetrics ):
+    """ FrameMetrics with the distinct counts and the medians answered by the day sketches
+
+        Input: DataFrame already filtered by the sidebar ( or the whole dataset and the mask of the
+               selected rows, see FrameMetrics ), the AsOfView and the SketchView of the same filters
+    """
+
+    def __init__ ( self, df, asof, sketches, mask=None ):
+        super().__init__( df, asof, mask )
+        self.sketches = sketches
+
+    def orders_per_courier_by_week ( self ):
+        # Orders by week from the daily counts of the as-of index, as in stream mode ( no pass over the rows )
+        counts = self.asof.counts_by_day()
+        df_aux4 = (pd.DataFrame( {'week_of_year': pd.DatetimeIndex( counts.index ).strftime( '%U' ), 'ID': counts.to_numpy()} )
+                     .groupby( 'week_of_year' )
+                     .sum()
+                     .reset_index())
+        df_aux6 = pd.merge( df_aux4, self.sketches.couriers_by_week(), how='inner' )
+        df_aux6['Orders_by_deliver'] = df_aux6['ID'] / df_aux6['Delivery_person_ID']
+
+        return df_aux6
+
+    def location_medians ( self ):
+        return self.sketches.location_medians()
+
+    def courier_count ( self ):
+        return self.sketches.courier_count()
+
+
+# Cutoffs and traffic selections of the validation
+CHECK_CUTOFFS = ['2022-02-13', '2022-03-10', '2022-04-06', '2022-06-04']
+CHECK_TRAFFIC = [['Low'], ['High', 'Jam'], ['Low', 'Medium', 'High', 'Jam']]
+
+
+def rank_error ( values, estimate, q=0.5 ):
+    """ This function measures how far an estimate is from the q-quantile of the values, in rank
+
+        Input: array of values, estimated quantile and q
+        Output: distance between q and the range of ranks of the estimate ( 0 when it is an exact quantile )
+    """
+    values = values[~np.isnan( values )]
+    if len( values ) == 0:
+        return 0.0
+    low, high = np.mean( values < estimate ), np.mean( values <= estimate )
+
+    return float( max( low - q, q - high, 0.0 ) )
+
+
+def validate ( source=DATASET_PATH, distinct_error=None, quantile_error=None ):
+    """ This function compares the approximate tables with the exact ones
+
+        Input: path of the source csv and the error bounds ( None: the ones of curry.config )
+        Output: dict of the largest errors: relative error of the courier counts, of the weekly
+                courier counts and rank error of the medians
+    """
+    from curry.cache import frame_metrics, get_dataset
+
+    distinct_error = distinct_error or config.DISTINCT_ERROR
+    quantile_error = quantile_error or config.QUANTILE_ERROR
+    sketches = DaySketches( get_dataset( source ), k_for_error( quantile_error ), precision_for_error( distinct_error ) )
+
+    worst = {'courier_count': 0.0, 'couriers_by_week': 0.0, 'location_medians': 0.0}
+    for cutoff in CHECK_CUTOFFS:
+        for traffic in CHECK_TRAFFIC:
+            selected = frame_metrics( cutoff, traffic, source )
+            exact = FrameMetrics( selected.df, selected.asof )
+            approx = ApproxMetrics( exact.df, exact.asof, sketches.view( cutoff, traffic ) )
+
+            count = exact.courier_count()
+            if count:
+                worst['courier_count'] = max( worst['courier_count'], abs( approx.courier_count() / count - 1 ) )
+
+            weeks = pd.merge( exact.orders_per_courier_by_week(), approx.orders_per_courier_by_week(),
+                              on='week_of_year', suffixes=('', '_approx') )
+            if len( weeks ):
+                error = (weeks['Delivery_person_ID_approx'] / weeks['Delivery_person_ID'] - 1).abs().max()
+                worst['couriers_by_week'] = max( worst['couriers_by_week'], error )
+
+            df = exact.df
+            for city, traffic_value, *medians in approx.location_medians().itertuples( index=False ):
+                group = df.loc[(df['City'] == city) & (df['Road_traffic_density'] == traffic_value), MAP_COLUMNS]
+                for col, median in zip( MAP_COLUMNS, medians ):
+                    error = rank_error( group[col].to_numpy( dtype=np.float64 ), median )
+                    worst['location_medians'] = max( worst['location_medians'], error )
+
+    return worst
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Check the approximate distinct counts and medians against the exact ones.' )
+    parser.add_argument( '--source', default=DATASET_PATH, help='source csv file' )
+    parser.add_argument( '--distinct-error', type=float, default=config.DISTINCT_ERROR,
+                         help='relative standard error of the distinct counts' )
+    parser.add_argument( '--quantile-error', type=float, default=config.QUANTILE_ERROR, help='rank error of the medians' )
+    args = parser.parse_args( argv )
+
+    start = time.perf_counter()
+    worst = validate( args.source, args.distinct_error, args.quantile_error )
+    # A distinct count is accepted within 3 standard errors, a median within the rank error
+    bounds = {'courier_count': 3 * args.distinct_error, 'couriers_by_week': 3 * args.distinct_error,
+              'location_medians': args.quantile_error}
+
+    print( '{} cutoffs x {} traffic selections in {:.1f}s'.format( len( CHECK_CUTOFFS ), len( CHECK_TRAFFIC ),
+                                                                  time.perf_counter() - start ) )
+    for name, error in worst.items():
+        print( '  {:<18} largest error {:.4f} ( bound {:.4f} )'.format( name, error, bounds[name] ) )
+
+    over = [name for name, error in worst.items() if error > bounds[name]]
+    if over:
+        raise SystemExit( 'over the error bound: {}'.format( ', '.join( over ) ) )
+
+
+if __name__ == '__main__':
+    main()
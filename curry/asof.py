@@ -0,0 +1,425 @@
+""" As-of index: per day cumulative aggregates for the date slider.
+
+    Every page keeps the orders with Order_Date < cutoff and groups them again
+    on every rerun. Since the slider always selects a prefix of the days, the
+    aggregates can be accumulated day by day once per dataset: for each group
+    the running count, sum, sum of squares, min and max of the value columns.
+    A cutoff then resolves with a binary search on the days, in O(groups),
+    whatever the number of rows.
+
+    Every grouping is also split by Road_traffic_density, so the traffic filter
+    of the sidebar is applied by combining the aggregates of the selected
+    traffic conditions, again without touching the rows.
+
+    Usage:
+
+        index = AsOfIndex( df )
+        view = index.asof( data_slider, traffic_options )
+        view.agg( 'City', {'Time_taken(min)': ['mean', 'std']} )
+
+    Check that every grouping answers the same means and deviations as
+    groupby().agg() on the selected rows, for a few cutoffs and selections:
+
+        python -m curry.asof --source ftc_train.csv [--tolerance 1e-11]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# Groupings used by the pages:
+GROUPINGS = [['Festival'],
+             ['City'],
+             ['City', 'Road_traffic_density'],
+             ['City', 'Type_of_order'],
+             ['Road_traffic_density'],
+             ['Weatherconditions'],
+             ['Delivery_person_ID']]
+
+# Value columns aggregated for every grouping:
+VALUES = ['Time_taken(min)', 'Delivery_person_Ratings']
+
+DATE_COLUMN = 'Order_Date'
+
+# Column of the sidebar filter, added to every grouping:
+SPLIT_COLUMN = 'Road_traffic_density'
+
+# Columns the index is built from ( the loader reads them apart from the ones of the pages, see curry.columns ):
+COLUMNS = list( dict.fromkeys( [DATE_COLUMN] + [col for keys in GROUPINGS for col in keys] + VALUES ) )
+
+STATS = ['count', 'sum', 'mean', 'std', 'var', 'min', 'max']
+
+# Number of partial daily tables kept by fold() before they are merged:
+MAX_PENDING = 16
+
+# Sidebar selections compared with pandas by check() ( cutoff dates, traffic conditions ):
+CHECK_CUTOFFS = ['2022-02-13', '2022-03-10', '2022-04-06', '2022-06-04']
+CHECK_TRAFFIC = [['Low'], ['High', 'Jam'], ['Low', 'Medium', 'High', 'Jam']]
+
+# Largest difference accepted by check(), relative to the pandas value ( absolute below 1 ):
+TOLERANCE = 1e-11
+
+
+def merge_daily ( frames ):
+    """ This function merges daily aggregates: counts and sums are added, min and max are reduced
+
+        The rows are grouped by integer codes of the index levels rather than
+        by the labels, which keeps the memory of the merge close to the size
+        of its inputs.
+
+        Input: list of DataFrames returned by PrefixTable._daily()
+        Output: DataFrame
+    """
+    first = frames[0]
+    names = first.index.names
+
+    key = np.zeros( sum( len( f ) for f in frames ), dtype=np.int64 )
+    codes, levels = [], []
+    for i in range( len( names ) ):
+        labels = first.index.get_level_values( i ).append( [f.index.get_level_values( i ) for f in frames[1:]] )
+        level_codes, uniques = pd.factorize( labels, sort=True )
+        key = key * len( uniques ) + level_codes
+        codes.append( level_codes )
+        levels.append( uniques )
+
+    order = np.argsort( key, kind='stable' )
+    key = key[order]
+    starts = np.flatnonzero( np.r_[True, key[1:] != key[:-1]] )
+
+    merged = {}
+    for name, reduce in [('count', np.add), ('sum', np.add), ('sumsq', np.add), ('min', np.fmin), ('max', np.fmax)]:
+        values = np.concatenate( [f[name].to_numpy() for f in frames] )
+        merged[name] = pd.DataFrame( reduce.reduceat( values[order], starts, axis=0 ), columns=first[name].columns )
+
+    result = pd.concat( merged, axis=1 )
+    result.index = pd.MultiIndex( levels=levels, codes=[c[order][starts] for c in codes], names=names )
+
+    return result
+
+
+class PrefixTable:
+    """ Cumulative aggregates of the value columns of one grouping, day by day
+
+        The daily aggregates of every group are kept in self.daily, so new
+        orders are merged in without going back to the old rows. The running
+        totals are sorted by group and then by day, so the state of every group
+        at a given day is found with one vectorized binary search.
+    """
+
+    def __init__ ( self, df, keys, values, days, date=DATE_COLUMN, split=SPLIT_COLUMN ):
+        self.keys = list( keys )
+        self.split = split
+        self.group_keys = self.keys + ([split] if split is not None and split not in self.keys else [])
+        self.values = list( values )
+        self.date = date
+
+        self.daily = self._daily( df )
+        self.pending = []
+        self._accumulate( days )
+
+    def _daily ( self, df ):
+        """ This function aggregates the rows of a DataFrame by group and day """
+        frame = df.loc[: , self.group_keys + [self.date]].copy()
+        squares = []
+        for col in self.values:
+            frame[col] = df[col].to_numpy( dtype=np.float64 )
+            frame[col + '_sq'] = frame[col] ** 2
+            squares.append( col + '_sq' )
+
+        daily = frame.groupby( self.group_keys + [self.date], sort=True, observed=True )
+        sumsq = daily[squares].sum()
+        sumsq.columns = self.values
+
+        # Sorting explicitly: groupby( observed=True ) keeps the order of appearance of categoricals
+        return pd.concat( {'count': daily[self.values].count(),
+                           'sum': daily[self.values].sum(),
+                           'sumsq': sumsq,
+                           'min': daily[self.values].min(),
+                           'max': daily[self.values].max()}, axis=1 ).sort_index()
+
+    def _accumulate ( self, days ):
+        """ This function computes the running totals of every group over the days """
+        self.n_days = len( days )
+        index = self.daily.index
+
+        codes, labels = index.droplevel( self.date ).factorize()
+        day = np.searchsorted( days, index.get_level_values( self.date ).to_numpy() )
+
+        self.code = codes
+        self.key = codes * self.n_days + day
+        self.labels = labels.set_names( self.group_keys )
+        self.count = self.daily['count'].groupby( codes ).cumsum().to_numpy()
+        self.sum = self.daily['sum'].groupby( codes ).cumsum().to_numpy()
+        self.sumsq = self.daily['sumsq'].groupby( codes ).cumsum().to_numpy()
+        self.min = self.daily['min'].groupby( codes ).cummin().to_numpy()
+        self.max = self.daily['max'].groupby( codes ).cummax().to_numpy()
+
+    def fold ( self, df ):
+        """ This function aggregates new orders by group and day, to be merged by finish()
+
+            Pending partials are merged every few chunks, or as soon as they hold
+            as many rows as the merged table, so the memory stays bounded by the
+            size of the aggregates and not by the number of chunks.
+        """
+        self.pending.append( self._daily( df ) )
+        if len( self.pending ) >= MAX_PENDING or sum( len( p ) for p in self.pending ) >= len( self.daily ):
+            self.daily = merge_daily( [self.daily] + self.pending )
+            self.pending = []
+
+    def finish ( self, days ):
+        """ This function merges the pending partials and updates the running totals """
+        if self.pending:
+            self.daily = merge_daily( [self.daily] + self.pending )
+            self.pending = []
+        self._accumulate( days )
+
+    def append ( self, df, days ):
+        """ This function merges new orders into the daily aggregates and updates the running totals
+
+            The cost depends on the new rows and on the number of (group, day)
+            pairs, not on the rows already indexed.
+
+            Input: DataFrame with the new orders and the days of the whole index
+        """
+        self.fold( df )
+        self.finish( days )
+
+    def rows_before ( self, day ):
+        """ This function returns, for every group, the row with its state before the given day index
+
+            Output: positions of the rows and labels of the groups that have orders before the day
+        """
+        groups = np.arange( len( self.labels ) )
+        pos = np.searchsorted( self.key, groups * self.n_days + day, side='left' ) - 1
+        valid = pos >= 0
+        valid[valid] = self.code[pos[valid]] == groups[valid]
+
+        return pos[valid], self.labels[valid]
+
+    def state ( self, day, selection=None ):
+        """ This function returns the aggregates of every group before the given day index
+
+            The split groups are filtered by the selection and combined into the
+            groups of the grouping keys.
+
+            Input: day index and accepted values of the split column (None for all)
+            Output: dict {component: 2d array (groups x values)} and labels of the groups
+        """
+        pos, labels = self.rows_before( day )
+        if selection is not None and self.split is not None:
+            keep = labels.get_level_values( self.split ).isin( selection ) if isinstance( labels, pd.MultiIndex ) \
+                   else labels.isin( selection )
+            pos, labels = pos[keep], labels[keep]
+
+        state = {'count': self.count[pos], 'sum': self.sum[pos], 'sumsq': self.sumsq[pos],
+                 'min': self.min[pos], 'max': self.max[pos]}
+        if self.group_keys == self.keys:
+            return state, labels
+        if len( labels ) == 0:
+            return state, labels.droplevel( self.split )
+
+        # Combining the split groups: sums are added, min and max are reduced.
+        # Labels are sorted by the grouping keys first, so factorize numbers the groups in order
+        groups, labels = labels.droplevel( self.split ).factorize()
+        labels = labels.set_names( self.keys )
+        n_groups = len( labels )
+        combined = {}
+        for name, values in state.items():
+            if name in ('min', 'max'):
+                out = np.full( (n_groups, values.shape[1]), np.inf if name == 'min' else -np.inf )
+                (np.minimum if name == 'min' else np.maximum).at( out, groups, values )
+                out[np.isinf( out )] = np.nan
+            else:
+                out = np.zeros( (n_groups, values.shape[1]) )
+                np.add.at( out, groups, values )
+            combined[name] = out
+
+        return combined, labels
+
+    def stat ( self, state, col, stat ):
+        """ This function evaluates one statistic of one value column from the aggregates of state() """
+        j = self.values.index( col )
+        n = state['count'][:, j]
+        if stat == 'count':
+            return n.astype( np.int64 )
+        if stat == 'sum':
+            return state['sum'][:, j]
+        if stat == 'mean':
+            with np.errstate( invalid='ignore', divide='ignore' ):
+                return state['sum'][:, j] / n
+        if stat in ('std', 'var'):
+            s = state['sum'][:, j]
+            with np.errstate( invalid='ignore', divide='ignore' ):
+                var = (state['sumsq'][:, j] - s * s / n) / (n - 1)
+            var = np.where( n > 1, np.maximum( var, 0.0 ), np.nan )
+            return np.sqrt( var ) if stat == 'std' else var
+        if stat == 'min':
+            return state['min'][:, j]
+        if stat == 'max':
+            return state['max'][:, j]
+        raise ValueError( 'unknown statistic: {}'.format( stat ) )
+
+
+class AsOfIndex:
+    """ Prefix aggregates of the dataset for every grouping used by the pages """
+
+    def __init__ ( self, df, groupings=GROUPINGS, values=VALUES, date=DATE_COLUMN, split=SPLIT_COLUMN ):
+        self.date = date
+        self.split = split
+        self.days = np.unique( df[date].to_numpy() )
+        self.tables = {tuple( keys ): PrefixTable( df, keys, values, self.days, date, split ) for keys in groupings}
+
+    def fold ( self, df ):
+        """ This function folds a chunk of new orders into the index; call finish() before querying
+
+            Input: DataFrame with the new orders ( same columns as the indexed one )
+        """
+        self.days = np.union1d( self.days, df[self.date].to_numpy() )
+        for table in self.tables.values():
+            table.fold( df )
+
+    def finish ( self ):
+        """ This function updates the running totals after fold() """
+        for table in self.tables.values():
+            table.finish( self.days )
+
+    def append ( self, df ):
+        """ This function adds new orders to the index, in place
+
+            Input: DataFrame with the new orders ( same columns as the indexed one )
+        """
+        self.fold( df )
+        self.finish()
+
+    def day ( self, cutoff ):
+        """ This function returns the number of days strictly before the cutoff """
+        return int( np.searchsorted( self.days, np.datetime64( pd.Timestamp( cutoff ) ), side='left' ) )
+
+    def asof ( self, cutoff, selection=None ):
+        """ This function returns the view of the aggregates for the orders with date < cutoff
+
+            Input: cutoff date and accepted values of the split column (None for all)
+            Output: AsOfView
+        """
+        return AsOfView( self, self.day( cutoff ), selection )
+
+
+class AsOfView:
+    """ Aggregates of the orders before a cutoff, with the interface of groupby().agg() """
+
+    def __init__ ( self, index, day, selection=None ):
+        self.index = index
+        self.day = day
+        self.selection = selection
+
+    def agg ( self, keys, spec ):
+        """ This function returns the same DataFrame as df.groupby( keys ).agg( spec ) on the rows before the cutoff
+
+            Input: grouping column(s) and a dict {value column: statistic or list of statistics}
+            Output: DataFrame indexed by the grouping columns
+        """
+        keys = [keys] if isinstance( keys, str ) else list( keys )
+        table = self.index.tables.get( tuple( keys ) )
+        if table is None:
+            raise KeyError( 'grouping not indexed: {}'.format( keys ) )
+
+        state, labels = table.state( self.day, self.selection )
+        columns = {}
+        for col, stats in spec.items():
+            if isinstance( stats, str ):
+                columns[col] = table.stat( state, col, stats )
+            else:
+                for stat in stats:
+                    columns[(col, stat)] = table.stat( state, col, stat )
+
+        result = pd.DataFrame( columns, index=labels )
+        if all( isinstance( stats, str ) for stats in spec.values() ):
+            return result
+        result.columns = pd.MultiIndex.from_tuples( result.columns )
+
+        return result
+
+    def counts_by_day ( self, keys=() ):
+        """ This function returns the number of orders per day before the cutoff, grouped by keys
+
+            Input: grouping column(s), possibly none
+            Output: Series indexed by the keys and the date
+        """
+        keys = [keys] if isinstance( keys, str ) else list( keys )
+        split = self.index.split
+        table = self.index.tables[tuple( keys or [split] )]
+
+        daily = table.daily
+        keep = np.ones( len( daily ), dtype=bool )
+        if self.day < len( self.index.days ):
+            keep &= daily.index.get_level_values( table.date ) < self.index.days[self.day]
+        if self.selection is not None and split is not None:
+            keep &= daily.index.get_level_values( split ).isin( self.selection )
+
+        counts = daily['count'].iloc[:, 0][keep]
+
+        return counts.groupby( level=keys + [table.date], sort=True, observed=True ).sum()
+
+
+def check ( df, index=None, stats=('mean', 'std') ):
+    """ This function compares the as-of aggregates with groupby().agg() on the rows before every check cutoff
+
+        The groups must be the same, and so must the missing values ( the
+        deviation of a group with one order ).
+
+        Input: cleaned DataFrame, its AsOfIndex ( None: built here ) and the statistics to compare
+        Output: dict {(grouping, value column, statistic): largest difference}, inf when the groups differ
+    """
+    index = AsOfIndex( df ) if index is None else index
+    spec = {col: list( stats ) for col in VALUES}
+    dates = df[DATE_COLUMN].to_numpy()
+
+    worst = {}
+    for cutoff in CHECK_CUTOFFS:
+        before = dates < np.datetime64( pd.Timestamp( cutoff ) )
+        for traffic in CHECK_TRAFFIC:
+            rows = df.loc[before & df[SPLIT_COLUMN].isin( traffic ).to_numpy(), :]
+            for keys in GROUPINGS:
+                got = index.asof( cutoff, traffic ).agg( keys, spec )
+                expected = rows.groupby( keys, observed=True ).agg( spec )
+                same_groups = len( got ) == len( expected ) and got.index.isin( expected.index ).all()
+                expected = expected.reindex( got.index )
+                for col in got.columns:
+                    a, b = got[col].to_numpy( dtype=np.float64 ), expected[col].to_numpy( dtype=np.float64 )
+                    if not same_groups or (np.isnan( a ) != np.isnan( b )).any():
+                        error = np.inf
+                    else:
+                        known = ~np.isnan( b )
+                        error = (np.abs( a[known] - b[known] ) / np.maximum( np.abs( b[known] ), 1.0 )).max( initial=0.0 )
+                    name = (', '.join( keys ),) + col
+                    worst[name] = max( worst.get( name, 0.0 ), error )
+
+    return worst
+
+
+def main ( argv=None ):
+    from curry.ingest import load_dataset
+
+    parser = argparse.ArgumentParser( description='Check the as-of aggregates against pandas groupby().agg().' )
+    parser.add_argument( '--source', default='ftc_train.csv', help='source csv file' )
+    parser.add_argument( '--tolerance', type=float, default=TOLERANCE, help='largest difference accepted, relative' )
+    args = parser.parse_args( argv )
+
+    df = load_dataset( args.source, columns=COLUMNS )
+    start = time.perf_counter()
+    worst = check( df )
+    print( '{} cutoffs x {} traffic selections in {:.1f}s'.format( len( CHECK_CUTOFFS ), len( CHECK_TRAFFIC ),
+                                                                  time.perf_counter() - start ) )
+    for (keys, col, stat), error in sorted( worst.items() ):
+        print( '  {:<32} {:<24} {:<5} largest difference {:.1e}'.format( keys, col, stat, error ) )
+
+    over = ['{} {} {}'.format( *name ) for name, error in worst.items() if error > args.tolerance]
+    if over:
+        raise SystemExit( 'as-of aggregates differ from pandas: {}'.format( ', '.join( over ) ) )
+    print( 'every grouping matches pandas within {:.0e}'.format( args.tolerance ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+""" Process wide cache of the cleaned dataset.
+
+    Streamlit executes the page scripts again on every widget interaction and
+    for every session, but imported modules live as long as the server process.
+    Keeping the cleaned DataFrame here means it is loaded once per process and
+    shared by all pages and sessions, and loaded again only when the source
+    file changes.
+
+    The shared frame is frozen: its arrays are read only, and every caller gets
+    its own shallow copy, so new columns added by a session stay in that session.
+
+    A page asks only for the columns its tables read ( curry.columns ): the
+    frame of each set of columns is read once from the snapshot, so a server
+    whose users open the lighter pages never loads the others. Structures
+    derived from the dataset ( like the as-of index ) read their own columns
+    for the build only, are cached with the frames and dropped together when
+    the source file changes. When daily files are appended to the snapshot
+    (see curry.store), only the new parts are read, and the derived
+    structures with an append() method are updated instead of rebuilt.
+
+    With CURRY_DATA_MODE=shared the frame is not loaded by each process: it
+    maps the version of the dataset published by curry.shared, and maps the
+    new one when it is swapped.
+
+    With CURRY_DATA_MODE=stream ( see curry.config ) the rows are not kept at
+    all: get_metrics() answers the pages from the partial aggregates of
+    curry.stream, built once per version of the source file. With
+    CURRY_DATA_MODE=sql it queries the SQLite database of curry.sql, and with
+    CURRY_DATA_MODE=views it reads the tables precomputed by curry.views.
+"""
+
+import copy
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from curry import config, store
+from curry.asof import COLUMNS as ASOF_COLUMNS, AsOfIndex
+from curry.filters import COLUMNS as BITMAP_COLUMNS, BitmapIndex
+from curry.ingest import DATASET_PATH, load_dataset
+from curry.instrument import instrument
+from curry.metrics import FrameMetrics
+from curry.schema import assemble_frame, optimize
+
+_lock = threading.RLock()
+_datasets = {}
+_summaries = {}
+_databases = {}
+
+
+def freeze ( df ):
+    """ This function returns a read only copy of a DataFrame
+
+        The columns of each numpy dtype are copied into one 2D array ( a
+        consolidated block ) and the codes of every categorical into an array
+        of their own; all of them are marked read only and the frame is built
+        around them ( curry.schema.assemble_frame ), so every array pandas
+        hands out of it is read only too.
+
+        Input: DataFrame
+        Output: new DataFrame
+    """
+    numeric, arrays = {}, {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance( dtype, pd.CategoricalDtype ):
+            codes = df[col].cat.codes.to_numpy().copy()
+            codes.flags.writeable = False
+            arrays[col] = pd.Categorical.from_codes( codes, dtype=dtype )
+        elif isinstance( dtype, np.dtype ):
+            numeric.setdefault( dtype, [] ).append( col )
+        else:
+            arrays[col] = df[col].array
+
+    blocks = []
+    for columns in numeric.values():
+        values = np.stack( [df[col].to_numpy() for col in columns] )
+        values.flags.writeable = False
+        blocks.append( (values, columns) )
+
+    return assemble_frame( blocks, arrays, df.columns, df.index )
+
+
+def _file_key ( path ):
+    stat = os.stat( path )
+
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _snapshot_parts ( path ):
+    manifest = store.read_manifest( path )
+    if not store.is_fresh( manifest, path ):
+        return None
+
+    return list( manifest['parts'] )
+
+
+class _Entry:
+    """ Cached dataset of one source file: its frames by set of columns, and the structures derived from it """
+
+    def __init__ ( self, key, parts, frames=None, derived=None, derived_columns=None ):
+        self.key = key
+        self.parts = parts
+        self.frames = frames or {}
+        self.derived = derived or {}
+        self.derived_columns = derived_columns or {}
+
+
+def _load ( path, key ):
+    if _snapshot_parts( path ) is None and store.pq is not None:
+        try:
+            # The whole csv is cleaned once, into the snapshot every set of columns is read from
+            store.rebuild( path )
+        except OSError:
+            # Read only deployments clean the columns of every frame from the csv instead
+            pass
+
+    return _Entry( key, _snapshot_parts( path ) )
+
+
+def _read ( entry, path, columns ):
+    # Columns of the dataset from the snapshot, or parsed and cleaned from the csv without one
+    if entry.parts is not None:
+        return store.read_parts( path, entry.parts, columns=columns )
+
+    return load_dataset( path, columns )
+
+
+def _frame ( entry, path, columns ):
+    # Frame of a set of columns ( None: all ), read on the first request and then shared
+    name = None if columns is None else tuple( columns )
+    with _lock:
+        df = entry.frames.get( name )
+        if df is None:
+            df = entry.frames[name] = freeze( _read( entry, path, columns ) )
+
+    return df
+
+
+def _projection ( columns ):
+    # The shared dataset is mapped whole: the pages of the columns nobody reads are never loaded anyway
+    return None if columns is None or config.DATA_MODE == 'shared' else list( columns )
+
+
+def _append ( entry, path, parts ):
+    """ This function adds the appended snapshot parts to a cached entry
+
+        The new parts are read once, with the columns of every cached frame
+        and derived structure. The new entry gets updated copies of the
+        derived structures, so the sessions still reading the old entry are
+        not affected.
+    """
+    needed = list( entry.frames ) + list( entry.derived_columns.values() )
+    columns = None if None in needed else list( dict.fromkeys( col for cols in needed for col in cols ) )
+    new = store.read_parts( path, parts[len( entry.parts ):], columns=columns )
+
+    frames = {name: freeze( optimize( pd.concat( [df, new.loc[: , list( df.columns )]], ignore_index=True ) ) )
+              for name, df in entry.frames.items()}
+
+    derived = {}
+    for name, structure in entry.derived.items():
+        if hasattr( structure, 'append' ):
+            structure = copy.deepcopy( structure )
+            structure.append( new )
+            derived[name] = structure
+
+    return _Entry( entry.key, parts, frames, derived, {name: entry.derived_columns[name] for name in derived} )
+
+
+def _shared_entry ( path ):
+    from curry.shared import attach, live_version
+
+    version = live_version( path )
+    with _lock:
+        entry = _datasets.get( path )
+        if entry is None or entry.key != version:
+            # A new version drops the structures derived from the old one
+            # O mapeamento já é somente leitura: nada a copiar
+            entry = _datasets[path] = _Entry( version, None, {None: attach( path, version )} )
+
+    return entry
+
+
+def _entry ( path ):
+    path = os.path.abspath( path )
+    if config.DATA_MODE == 'shared':
+        return _shared_entry( path )
+
+    key = _file_key( path )
+    parts = _snapshot_parts( path )
+
+    with _lock:
+        entry = _datasets.get( path )
+        if entry is None or entry.key != key:
+            entry = _load( path, key )
+        elif parts is not None and entry.parts is not None and parts != entry.parts:
+            if parts[:len( entry.parts )] == entry.parts:
+                entry = _append( entry, path, parts )
+            else:
+                entry = _load( path, key )
+        _datasets[path] = entry
+
+    return entry
+
+
+def get_dataset ( path=DATASET_PATH, columns=None ):
+    """ This function returns the cleaned dataset from the process cache
+
+        The columns are loaded on the first call and again only when the size
+        or the modification time of the source file changes.
+
+        Input: path of the source csv and list of columns ( None for all )
+        Output: read only DataFrame ( a shallow copy of the shared frame )
+    """
+    return _frame( _entry( path ), path, _projection( columns ) ).copy( deep=False )
+
+
+def get_derived ( name, build, path=DATASET_PATH, columns=None ):
+    """ This function returns a structure derived from the dataset, built once per version of the source
+
+        Input: name of the structure, function building it from the DataFrame, path of the source csv
+               and list of columns the build reads ( None for all )
+        Output: the structure returned by build
+    """
+    entry = _entry( path )
+
+    with _lock:
+        if name not in entry.derived:
+            columns = _projection( columns )
+            # The columns are read for the build only, unless the frame of all the columns is cached
+            df = entry.frames.get( None )
+            if df is None:
+                df = _frame( entry, path, None ) if columns is None else _read( entry, path, columns )
+            entry.derived[name] = build( df )
+            entry.derived_columns[name] = columns
+
+    return entry.derived[name]
+
+
+def get_asof_index ( path=DATASET_PATH ):
+    """ This function returns the as-of index (curry.asof) of the dataset """
+    return get_derived( 'asof', AsOfIndex, path, ASOF_COLUMNS )
+
+
+def get_bitmap_index ( path=DATASET_PATH ):
+    """ This function returns the filter bitmaps (curry.filters) of the dataset """
+    return get_derived( 'bitmaps', BitmapIndex, path, BITMAP_COLUMNS )
+
+
+def get_sketches ( path=DATASET_PATH ):
+    """ This function returns the day sketches (curry.approx) of the dataset, for the approximate mode """
+    from curry.approx import COLUMNS, build_sketches
+
+    return get_derived( 'sketches', build_sketches, path, COLUMNS )
+
+
+def dataset_version ( path=DATASET_PATH ):
+    """ This function returns the version of the dataset: the size and modification time
+        of the source file and the number of appended snapshot parts
+
+        Input: path of the source csv
+        Output: tuple
+    """
+    parts = _snapshot_parts( os.path.abspath( path ) )
+
+    return _file_key( path ) + (len( parts ) if parts else 0,)
+
+
+def get_summary ( path=DATASET_PATH ):
+    """ This function returns the streamed partial aggregates (curry.stream) of the source file
+
+        The source is read in chunks within the memory budget of curry.config,
+        once per version of the file.
+
+        Input: path of the source csv
+        Output: StreamSummary
+    """
+    from curry.stream import build_summary
+
+    path = os.path.abspath( path )
+    key = _file_key( path )
+    with _lock:
+        cached = _summaries.get( path )
+        if cached is None or cached[0] != key:
+            cached = _summaries[path] = (key, build_summary( path ))
+
+    return cached[1]
+
+
+def get_database ( path=DATASET_PATH ):
+    """ This function returns the SQLite database (curry.sql) of the source file
+
+        The database is updated once per version of the dataset: rebuilt when
+        the source file changes, extended when daily files are appended.
+
+        Input: path of the source csv
+        Output: path of the database
+    """
+    from curry.sql import build_database
+
+    path = os.path.abspath( path )
+    with _lock:
+        version = dataset_version( path )
+        cached = _databases.get( path )
+        if cached is None or cached[0] != version:
+            database = build_database( path )
+            cached = _databases[path] = (dataset_version( path ), database)
+
+    return cached[1]
+
+
+def frame_metrics ( cutoff, traffic, path=DATASET_PATH, columns=None ):
+    """ This function computes the metrics of the pages from the cached dataset, in memory
+
+        Input: cutoff date, selected traffic conditions, path of the source csv and list of columns
+               of the selected rows ( None for all )
+        Output: FrameMetrics; ApproxMetrics with CURRY_APPROXIMATE=1
+    """
+    df = get_dataset( path, columns )
+    bitmaps = get_bitmap_index( path )
+    selected = bitmaps.before( cutoff ) & bitmaps.select( Road_traffic_density=traffic )
+    # Only the mask here: the rows are copied by the first table that reads them
+    mask = bitmaps.mask( selected )
+    asof = get_asof_index( path ).asof( cutoff, traffic )
+    if config.APPROXIMATE:
+        from curry.approx import ApproxMetrics
+        return ApproxMetrics( df, asof, get_sketches( path ).view( cutoff, traffic ), mask )
+
+    return FrameMetrics( df, asof, mask )
+
+
+@instrument
+def get_metrics ( cutoff, traffic, path=DATASET_PATH, columns=None ):
+    """ This function returns the metrics of the pages for the orders before the cutoff with the selected traffic
+
+        Input: cutoff date, selected traffic conditions, path of the source csv and the columns the page
+               reads ( curry.columns.page_columns; None for all, only used in memory )
+        Output: FrameMetrics; SummaryMetrics in stream mode; SqlMetrics in sql mode;
+                ViewMetrics in views mode, when the precomputed views are up to date
+    """
+    if config.DATA_MODE == 'stream':
+        from curry.stream import SummaryMetrics
+        return SummaryMetrics( get_summary( path ), cutoff, traffic )
+
+    if config.DATA_MODE == 'sql':
+        from curry.sql import SqlMetrics
+        return SqlMetrics( get_database( path ), cutoff, traffic )
+
+    if config.DATA_MODE == 'views':
+        from curry.views import load_views
+        views = load_views( path )
+        metrics = views.metrics( cutoff, traffic ) if views is not None else None
+        if metrics is not None:
+            return metrics
+
+    return frame_metrics( cutoff, traffic, path, columns )
+
+
+def clear ():
+    """ This function drops every cached dataset """
+    with _lock:
+        _datasets.clear()
+        _summaries.clear()
+        _databases.clear()
@@ -0,0 +1,178 @@
+""" Column manifests of the pages: every page loads only the columns its tables read.
+
+    The cleaned dataset has more than twenty columns, and a page reads a
+    handful of them: the Delivery page never touches the coordinates, the
+    order times or the ID of the orders. Every page declares the tables it
+    draws, in the format of curry.planner, and asks get_metrics() for the
+    columns they read ( curry.metrics.COLUMNS ):
+
+        TABLES = [('courier_ratings',), ('top_couriers',), ('extreme', 'Delivery_person_Age')]
+        metrics = get_metrics( data_slider, traffic_options, 'ftc_train.csv', columns=page_columns( TABLES ) )
+
+    The cache then reads only those columns from the snapshot ( or parses and
+    cleans only them from the csv, curry.ingest ), and the frames of the
+    metrics hold nothing else: a table reading a column its page did not
+    declare fails. The check runs every page in memory, on every tab and a
+    few selections of the sidebar, and fails on those columns:
+
+        python -m curry.columns --source ftc_train.csv [--check]
+"""
+
+import argparse
+import ast
+import datetime
+import glob
+import os
+import time
+
+import pandas as pd
+
+from curry.ingest import DATASET_PATH
+from curry.metrics import COLUMNS
+
+# Folder of the pages, relative to the folder streamlit runs from:
+PAGES_DIR = 'pages'
+
+# Name of the list of tables declared by a page:
+TABLES_NAME = 'TABLES'
+
+# Sidebar selections of the check: the default one and a narrower one ( cutoff date, traffic conditions )
+CHECK_SELECTIONS = [(None, None), (datetime.datetime( 2022, 3, 15 ), ['High', 'Jam'])]
+
+
+def page_columns ( tables ):
+    """ This function returns the columns of the dataset read by the tables of a page
+
+        Input: list of tables, as tuples (method, arguments...) of curry.metrics.COLUMNS
+        Output: sorted list of columns
+    """
+    columns = set()
+    for method, *args in tables:
+        columns.update( COLUMNS[method]( *args ) )
+
+    return sorted( columns )
+
+
+def declared_tables ( page ):
+    """ This function reads the list of tables a page script declares, without running it
+
+        Input: path of the page
+        Output: list of tables, None if the page declares none ( it does not read the dataset )
+    """
+    with open( page, encoding='utf-8' ) as f:
+        tree = ast.parse( f.read() )
+    for node in tree.body:
+        if isinstance( node, ast.Assign ) and any( getattr( target, 'id', None ) == TABLES_NAME for target in node.targets ):
+            return ast.literal_eval( node.value )
+
+    return None
+
+
+def pages ():
+    """ This function lists the page scripts, in the order of the sidebar """
+    return sorted( glob.glob( os.path.join( PAGES_DIR, '*.py' ) ) )
+
+
+def dataset_columns ( source=DATASET_PATH ):
+    """ This function returns the columns of the cleaned dataset: the ones of the csv and the distance """
+    return list( pd.read_csv( source, nrows=0 ).columns ) + ['distance']
+
+
+def undeclared ( message, declared, columns ):
+    """ This function finds the columns of the dataset named in an error that the page did not declare
+
+        Output: sorted list of columns
+    """
+    # Errors of pandas quote the names: 'ID' is not found in 'Delivery_person_ID'
+    return sorted( col for col in columns if col not in declared and "'{}'".format( col ) in message )
+
+
+def run_page ( page ):
+    """ This function runs a page in memory on every tab and selection of the check
+
+        Output: list of error messages
+    """
+    from streamlit.testing.v1 import AppTest
+
+    from curry import cache, config
+
+    # The columns are projected only by the frames of the memory mode
+    config.DATA_MODE, config.APPROXIMATE = 'memory', False
+    cache.clear()
+
+    errors = []
+    at = AppTest.from_file( page, default_timeout=300 ).run()
+    for cutoff, traffic in CHECK_SELECTIONS:
+        if cutoff is not None and at.sidebar.slider:
+            at.sidebar.slider[0].set_value( cutoff )
+        if traffic is not None and at.sidebar.multiselect:
+            at.sidebar.multiselect[0].set_value( traffic )
+        for tab in (at.radio[0].options if at.radio else [None]):
+            if tab is not None:
+                at.radio[0].set_value( tab )
+            at.run()
+            errors += [e.message for e in at.exception]
+
+    return list( dict.fromkeys( errors ) )
+
+
+def check ( source=DATASET_PATH ):
+    """ This function checks the column manifest of every page
+
+        Output: dict {page: list of problems}, only for the pages with problems
+    """
+    columns = dataset_columns( source )
+    problems = {}
+    for page in pages():
+        tables = declared_tables( page )
+        if tables is None:
+            continue
+        declared = page_columns( tables )
+        found = ['unknown column {}'.format( col ) for col in declared if col not in columns]
+        for message in run_page( page ):
+            missing = undeclared( message, declared, columns )
+            found += (['touches undeclared column {}'.format( col ) for col in missing] if missing
+                      else ['error: {}'.format( message.splitlines()[0][:100] )])
+        if found:
+            problems[page] = found
+
+    return problems
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Show the columns loaded by every page and check their manifests.' )
+    parser.add_argument( '--source', default=DATASET_PATH, help='source csv file' )
+    parser.add_argument( '--check', action='store_true', help='run the pages and fail on the columns they did not declare' )
+    args = parser.parse_args( argv )
+
+    from curry import store
+
+    store.rebuild( args.source )
+    start = time.perf_counter()
+    full = store.read_snapshot( args.source )
+    print( 'all {} columns: {:.1f} MB in {:.0f} ms'.format( len( full.columns ), full.memory_usage( deep=True ).sum() / 2**20,
+                                                              (time.perf_counter() - start) * 1000 ) )
+    for page in pages():
+        tables = declared_tables( page )
+        if tables is None:
+            print( '{}: no dataset'.format( page ) )
+            continue
+        columns = page_columns( tables )
+        start = time.perf_counter()
+        df = store.read_snapshot( args.source, columns=columns )
+        print( '{}: {} columns, {:.1f} MB in {:.0f} ms'.format( page, len( columns ), df.memory_usage( deep=True ).sum() / 2**20,
+                                                               (time.perf_counter() - start) * 1000 ) )
+        print( '    ' + ', '.join( columns ) )
+
+    if args.check:
+        problems = check( args.source )
+        for page, found in problems.items():
+            for problem in found:
+                print( '{}: {}'.format( page, problem ) )
+        if problems:
+            raise SystemExit( 'column manifest check failed: {}'.format( ', '.join( problems ) ) )
+        print( 'every page reads only its declared columns' )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+""" Settings of the dashboard, read from environment variables.
+
+    CURRY_DATA_MODE              'memory' ( default ): the cleaned dataset is kept in memory;
+                                 'stream': the source is read in chunks into partial aggregates;
+                                 'sql': the metrics are SQL queries on a SQLite copy of the snapshot;
+                                 'views': the tables precomputed by python -m curry.views are read;
+                                 'shared': the dataset is memory mapped from the files published by curry.shared
+    CURRY_STREAM_MAX_MEMORY_MB   peak resident memory of the process in stream mode ( default 512 )
+    CURRY_INGEST_WORKERS         processes parsing and cleaning the source csv ( default 1 )
+    CURRY_APPROXIMATE            '1': distinct couriers and map medians come from per day sketches ( default '0' )
+    CURRY_DISTINCT_ERROR         relative standard error of the approximate distinct counts ( default 0.01 )
+    CURRY_QUANTILE_ERROR         rank error of the approximate medians ( default 0.01 )
+    CURRY_TABS                   'lazy' ( default ): only the selected tab of a page runs;
+                                 'eager': every tab runs on every rerun ( st.tabs )
+    CURRY_PROFILE                '1' records the time, rows and memory of the data functions ( default '0' )
+    CURRY_PROFILE_FILE           JSON lines file of the records ( default curry_timings.jsonl )
+    CURRY_FIGURE_CACHE_MB        size of the cache of rendered figures and maps ( default 64, 0 disables it )
+"""
+
+import os
+
+DATA_MODE = os.environ.get( 'CURRY_DATA_MODE', 'memory' )
+
+STREAM_MAX_MEMORY_MB = int( os.environ.get( 'CURRY_STREAM_MAX_MEMORY_MB', '512' ) )
+
+INGEST_WORKERS = int( os.environ.get( 'CURRY_INGEST_WORKERS', '1' ) )
+
+APPROXIMATE = os.environ.get( 'CURRY_APPROXIMATE', '0' ) == '1'
+
+DISTINCT_ERROR = float( os.environ.get( 'CURRY_DISTINCT_ERROR', '0.01' ) )
+
+QUANTILE_ERROR = float( os.environ.get( 'CURRY_QUANTILE_ERROR', '0.01' ) )
+
+FIGURE_CACHE_MB = float( os.environ.get( 'CURRY_FIGURE_CACHE_MB', '64' ) )
+
+TABS = os.environ.get( 'CURRY_TABS', 'lazy' )
+
+PROFILE = os.environ.get( 'CURRY_PROFILE', '0' ) == '1'
+
+PROFILE_FILE = os.environ.get( 'CURRY_PROFILE_FILE', 'curry_timings.jsonl' )
@@ -0,0 +1,126 @@
+""" Process wide cache of rendered figures and maps.
+
+    The pages build their Plotly figures and the folium map again on every
+    rerun, even when only the tab changed. Here the built artifacts are kept
+    serialized ( the figure JSON and the map HTML ), keyed by the page, the
+    widget, the date cutoff, the traffic selection and the dataset version,
+    so a repeated view costs one deserialization.
+
+    The cache is a LRU bounded by the size of the serialized artifacts
+    ( CURRY_FIGURE_CACHE_MB, see curry.config ), with hit and miss counters.
+
+    Usage:
+
+        key = render_key( 'Company', 'order_metric', data_slider, traffic_options )
+        fig = cached_figure( key, lambda: order_metric( metrics ) )
+"""
+
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from curry import config
+from curry.cache import dataset_version
+from curry.ingest import DATASET_PATH
+
+
+class FigureCache:
+    """ LRU cache of serialized artifacts, bounded by their total size in bytes """
+
+    def __init__ ( self, max_bytes ):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get ( self, key, build ):
+        """ This function returns the artifact of a key, building and storing it on a miss
+
+            Input: hashable key and function returning the serialized artifact ( str )
+            Output: str
+        """
+        with self._lock:
+            value = self.items.get( key )
+            if value is not None:
+                self.items.move_to_end( key )
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = build()
+        size = len( value )
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key not in self.items:
+                self.items[key] = value
+                self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.items.popitem( last=False )
+                self.size -= len( evicted )
+                self.evictions += 1
+
+        return value
+
+    def stats ( self ):
+        """ This function returns the counters of the cache """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len( self.items ), 'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def clear ( self ):
+        with self._lock:
+            self.items.clear()
+            self.size = 0
+
+
+_cache = FigureCache( int( config.FIGURE_CACHE_MB * 2**20 ) )
+
+
+def render_key ( page, widget, cutoff, traffic, *extra, path=DATASET_PATH ):
+    """ This function builds the cache key of a rendered artifact
+
+        Input: page and widget names, date cutoff, selected traffic conditions,
+               other arguments of the widget and path of the source csv
+        Output: tuple
+    """
+    return (page, widget, pd.Timestamp( cutoff ).date().isoformat(), tuple( sorted( traffic ) ),
+            dataset_version( path )) + extra
+
+
+def cached_figure ( key, build ):
+    """ This function returns a Plotly figure from the cache, building it on a miss
+
+        Input: key of render_key() and function returning the figure
+        Output: plotly Figure
+    """
+    # Plotly só é carregado quando um gráfico é mostrado ( benchmarks/bench_imports.py )
+    import plotly.io as pio
+
+    return pio.from_json( _cache.get( key, lambda: build().to_json() ), skip_invalid=True )
+
+
+def cached_html ( key, build ):
+    """ This function returns the HTML of a map from the cache, building it on a miss
+
+        Input: key of render_key() and function returning the HTML
+        Output: str
+    """
+    return _cache.get( key, build )
+
+
+def stats ():
+    """ This function returns the hit and miss counters of the figure cache """
+    return _cache.stats()
+
+
+def clear ():
+    """ This function drops every cached figure """
+    _cache.clear()
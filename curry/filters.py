@@ -0,0 +1,111 @@
+""" Row filters of the sidebar backed by precomputed bitmaps.
+
+    The low cardinality columns are stored once per dataset as categorical
+    codes, with one packed bitmap ( one bit per row ) for each of their values.
+    A filter like "Road_traffic_density in ['Low', 'Jam']" is then the OR of two
+    bitmaps, and combining it with the date filter is an AND, instead of string
+    comparisons over every row.
+
+    Usage:
+
+        bitmaps = BitmapIndex( df )
+        bits = bitmaps.before( data_slider ) & bitmaps.select( Road_traffic_density=traffic_options )
+        df = df.loc[bitmaps.mask( bits ), :]
+"""
+
+import numpy as np
+import pandas as pd
+
+# Columns indexed by default:
+BITMAP_COLUMNS = ['Road_traffic_density', 'City', 'Festival', 'Weatherconditions', 'Type_of_vehicle']
+
+DATE_COLUMN = 'Order_Date'
+
+# Columns the default index is built from:
+COLUMNS = BITMAP_COLUMNS + [DATE_COLUMN]
+
+
+class BitmapIndex:
+    """ Packed per value bitmaps of the low cardinality columns of a DataFrame """
+
+    def __init__ ( self, df, columns=BITMAP_COLUMNS, date=DATE_COLUMN ):
+        self.date = date
+        self.n_rows = len( df )
+        self.dates = df[date].to_numpy()
+        self.categories = {}
+        self.codes = {}
+        self.bitmaps = {}
+
+        for col in columns:
+            categorical = pd.Categorical( df[col] )
+            codes = categorical.codes
+            self.categories[col] = categorical.categories
+            self.codes[col] = codes
+            self.bitmaps[col] = {value: np.packbits( codes == i )
+                                 for i, value in enumerate( categorical.categories )}
+
+    def append ( self, df ):
+        """ This function adds the rows of new orders at the end of the index, in place
+
+            The codes of the stored rows are kept ( new values get new codes )
+            and the bitmaps are rebuilt from the codes, without string comparisons.
+
+            Input: DataFrame with the new orders
+        """
+        self.n_rows += len( df )
+        self.dates = np.concatenate( [self.dates, df[self.date].to_numpy()] )
+
+        for col in self.codes:
+            categories = self.categories[col].union( pd.Index( df[col].dropna().unique() ), sort=False )
+            codes = np.concatenate( [self.codes[col], categories.get_indexer( df[col] )] )
+            codes = codes.astype( np.min_scalar_type( -len( categories ) ) )
+
+            self.categories[col] = categories
+            self.codes[col] = codes
+            self.bitmaps[col] = {value: np.packbits( codes == i ) for i, value in enumerate( categories )}
+
+    def all ( self ):
+        """ Bitmap with every row selected """
+        return np.packbits( np.ones( self.n_rows, dtype=bool ) )
+
+    def none ( self ):
+        """ Bitmap with no row selected """
+        return np.zeros( (self.n_rows + 7) // 8, dtype=np.uint8 )
+
+    def isin ( self, col, values ):
+        """ This function returns the bitmap of the rows where col is one of the values
+
+            Input: indexed column and list of values
+            Output: packed bitmap ( numpy uint8 array )
+        """
+        bitmaps = self.bitmaps[col]
+        bits = self.none()
+        for value in values:
+            if value in bitmaps:
+                bits |= bitmaps[value]
+
+        return bits
+
+    def select ( self, **filters ):
+        """ This function returns the bitmap of the rows matching every filter
+
+            Input: keyword arguments {column: list of accepted values}
+            Output: packed bitmap ( numpy uint8 array )
+        """
+        bits = self.all()
+        for col, values in filters.items():
+            bits &= self.isin( col, values )
+
+        return bits
+
+    def before ( self, cutoff ):
+        """ This function returns the bitmap of the rows with date < cutoff """
+        return np.packbits( self.dates < np.datetime64( pd.Timestamp( cutoff ) ) )
+
+    def mask ( self, bits ):
+        """ This function unpacks a bitmap into a boolean mask over the rows """
+        return np.unpackbits( bits, count=self.n_rows ).view( bool )
+
+    def count ( self, bits ):
+        """ This function returns the number of selected rows of a bitmap """
+        return int( np.unpackbits( bits, count=self.n_rows ).sum() )
@@ -0,0 +1,122 @@
+""" Great-circle distances and spatial binning on whole arrays of coordinates.
+
+    Same formula and earth radius as the haversine package, evaluated with
+    numpy on whole columns instead of one Python call per row.
+
+    The delivery locations are also binned into a fixed lat/lon grid, so the
+    map draws one GeoJSON layer with at most MAX_CELLS cells whatever the
+    number of orders.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Mean earth radius in km, the default of the haversine package:
+AVG_EARTH_RADIUS_KM = 6371.0088
+
+# Side of the grid cells in degrees, and maximum number of cells sent to the map
+# ( the grid is made coarser until it fits ):
+GRID_DEGREES = 0.5
+MAX_CELLS = 2000
+
+# Cells are numbered row * GRID_RADIX + column, with rows and columns shifted to be positive:
+GRID_RADIX = 2**16
+
+DISTANCE_COLUMNS = ['Restaurant_latitude', 'Restaurant_longitude',
+                    'Delivery_location_latitude', 'Delivery_location_longitude']
+
+
+def haversine_np ( lat1, lng1, lat2, lng2 ):
+    """ This function calculates the haversine distance between two arrays of points
+
+        Input: latitudes and longitudes (in degrees) of the first and second points
+        Output: numpy array with the distances in km
+    """
+    lat1 = np.radians( np.asarray( lat1, dtype=np.float64 ) )
+    lng1 = np.radians( np.asarray( lng1, dtype=np.float64 ) )
+    lat2 = np.radians( np.asarray( lat2, dtype=np.float64 ) )
+    lng2 = np.radians( np.asarray( lng2, dtype=np.float64 ) )
+
+    d = ( np.sin( (lat2 - lat1) * 0.5 ) ** 2
+        + np.cos( lat1 ) * np.cos( lat2 ) * np.sin( (lng2 - lng1) * 0.5 ) ** 2 )
+
+    return 2 * AVG_EARTH_RADIUS_KM * np.arcsin( np.sqrt( d ) )
+
+
+def delivery_distance ( df ):
+    """ This function calculates the distance between restaurant and delivery location of every order
+
+        Input: DataFrame with the restaurant and delivery coordinates
+        Output: numpy array with the distances in km
+    """
+    return haversine_np( df['Restaurant_latitude'].to_numpy(), df['Restaurant_longitude'].to_numpy(),
+                         df['Delivery_location_latitude'].to_numpy(), df['Delivery_location_longitude'].to_numpy() )
+
+
+def grid_cells ( lat, lng, degrees=GRID_DEGREES ):
+    """ This function returns the grid cell of every point
+
+        Input: arrays of latitudes and longitudes (in degrees) and side of the cells
+        Output: numpy array of int64 cell numbers
+    """
+    row = np.floor( np.asarray( lat, dtype=np.float64 ) / degrees ).astype( np.int64 ) + GRID_RADIX // 2
+    col = np.floor( np.asarray( lng, dtype=np.float64 ) / degrees ).astype( np.int64 ) + GRID_RADIX // 2
+
+    return row * GRID_RADIX + col
+
+
+def grid_summary ( cells, counts, sums, degrees=GRID_DEGREES, max_cells=MAX_CELLS ):
+    """ This function adds up the orders and delivery times by grid cell
+
+        Cells of the same number are merged, and the grid is made coarser
+        ( cells twice as large ) until it has at most max_cells cells.
+
+        Input: cell numbers of grid_cells(), order counts and sums of Time_taken(min) of each entry,
+               side of the cells and maximum number of cells
+        Output: DataFrame with the corner ( lat, lng ), side ( degrees ), orders and avg_time of every cell
+    """
+    cells = np.asarray( cells, dtype=np.int64 )
+    counts = np.asarray( counts, dtype=np.float64 )
+    sums = np.asarray( sums, dtype=np.float64 )
+    row = cells // GRID_RADIX - GRID_RADIX // 2
+    col = cells % GRID_RADIX - GRID_RADIX // 2
+
+    if len( cells ) == 0:
+        return pd.DataFrame( {'lat': [], 'lng': [], 'degrees': [], 'orders': [], 'avg_time': []} )
+
+    while True:
+        row_min, col_min = row.min(), col.min()
+        width = col.max() - col_min + 1
+        keys, inverse = np.unique( (row - row_min) * width + (col - col_min), return_inverse=True )
+        if len( keys ) <= max_cells or degrees >= 180:
+            break
+        row, col, degrees = np.floor_divide( row, 2 ), np.floor_divide( col, 2 ), degrees * 2
+
+    orders = np.bincount( inverse, weights=counts, minlength=len( keys ) )
+    total = np.bincount( inverse, weights=sums, minlength=len( keys ) )
+    keep = orders > 0
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        avg_time = total / orders
+
+    return pd.DataFrame( {'lat': (keys // width + row_min) * degrees,
+                          'lng': (keys % width + col_min) * degrees,
+                          'degrees': degrees,
+                          'orders': orders.astype( np.int64 ),
+                          'avg_time': np.round( avg_time, 2 )} ).loc[keep, :].reset_index( drop=True )
+
+
+def grid_geojson ( grid ):
+    """ This function converts the cells of grid_summary() into a GeoJSON FeatureCollection of squares
+
+        Input: DataFrame returned by grid_summary()
+        Output: dict
+    """
+    features = []
+    for lat, lng, side, orders, avg_time in zip( grid['lat'].tolist(), grid['lng'].tolist(), grid['degrees'].tolist(),
+                                                 grid['orders'].tolist(), grid['avg_time'].tolist() ):
+        ring = [[lng, lat], [lng + side, lat], [lng + side, lat + side], [lng, lat + side], [lng, lat]]
+        features.append( {'type': 'Feature',
+                          'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+                          'properties': {'orders': orders, 'avg_time': avg_time}} )
+
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,342 @@
+""" Ingest of the Curry Company orders dataset (ftc_train.csv).
+
+    Every page used to keep its own copy of clean_code() with a row by row
+    loop over 'Time_taken(min)'. This module holds the single shared version,
+    written column at a time so the cost stays in pandas/numpy.
+
+    With CURRY_INGEST_WORKERS > 1 ( see curry.config ) the source csv is split
+    in byte ranges at line boundaries, and every range is parsed and cleaned
+    by its own process; the results are joined in file order, so the cleaned
+    DataFrame is the same as the one of a single process.
+
+    read_clean() and load_dataset() also take the list of cleaned columns a
+    page reads ( see curry.columns ): only the csv columns they come from are
+    parsed and cleaned, plus the ones of the NaN filter, so the rows are the
+    same whatever the projection.
+
+    The output is checked against the per-page cleaning it replaced
+    ( legacy_clean_code ) from the terminal:
+
+        python -m curry.ingest --source ftc_train.csv --check
+"""
+
+import argparse
+import io
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from curry import config
+from curry.geo import delivery_distance
+from curry.instrument import instrument
+from curry.schema import optimize
+
+# Path of the source dataset, relative to the folder streamlit runs from:
+DATASET_PATH = 'ftc_train.csv'
+
+# Version of the output of clean_code(), stored with the snapshots.
+# Bump it whenever the cleaned columns change, so old snapshots are rebuilt.
+CLEAN_VERSION = 4
+
+# Text columns that come padded with spaces in the source file:
+STRIP_COLUMNS = ['ID', 'Delivery_person_ID', 'Road_traffic_density', 'Type_of_order',
+                 'Type_of_vehicle', 'Festival', 'City']
+
+# Columns of the NaN filter of clean_code(), read whatever the projection:
+FILTER_COLUMNS = ['Delivery_person_Age', 'multiple_deliveries', 'Weatherconditions', 'City']
+
+# Columns the 'distance' column is computed from:
+DISTANCE_COLUMNS = ['Restaurant_latitude', 'Restaurant_longitude', 'Delivery_location_latitude', 'Delivery_location_longitude']
+
+
+@instrument
+def clean_code ( df_raw ):
+    """ This function cleans the DataFrame
+
+        Types of cleaning:
+        1. Removing NaN datas
+        2. Changing the type of the columns
+        3. Removing spaces from strings variables
+        4. Formatation of Date Column
+        5. Cleaning of Time column - removing text from number variable
+        6. Distance between restaurant and delivery location, in the 'distance' column
+
+        All the steps are vectorized: the NaN filters are combined in a single
+        boolean mask and the time column is parsed with .str.extract.
+        The input DataFrame is not modified. It may hold only some of the
+        columns of the csv ( see source_columns() ): the steps of the missing
+        ones are skipped.
+
+        Input: DataFrame
+        Output: DataFrame
+    """
+    # Linhas com conteudo NaN ( idade, multiplas entregas, clima e cidade ):
+    city = df_raw['City'].str.strip()
+    linhas_validas = ( (df_raw['Delivery_person_Age'] != 'NaN ')
+                     & (df_raw['multiple_deliveries'] != 'NaN ')
+                     & (df_raw['Weatherconditions'] != 'conditions NaN')
+                     & (city != 'NaN') )
+
+    df = df_raw.loc[linhas_validas, :].reset_index( drop=True )
+
+    # Remover espaco da string
+    for col in STRIP_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].str.strip()
+
+    # Conversao de tipos
+    df['Delivery_person_Age'] = df['Delivery_person_Age'].astype( int )
+    if 'Delivery_person_Ratings' in df.columns:
+        df['Delivery_person_Ratings'] = df['Delivery_person_Ratings'].astype( float )
+    df['multiple_deliveries'] = df['multiple_deliveries'].astype( int )
+    if 'Order_Date' in df.columns:
+        df['Order_Date'] = pd.to_datetime( df['Order_Date'], format='%d-%m-%Y' )
+
+    # Remover o texto do tempo de entrega: '(min) 24' -> 24
+    if 'Time_taken(min)' in df.columns:
+        df['Time_taken(min)'] = df['Time_taken(min)'].str.extract( r'(\d+)', expand=False ).astype( int )
+
+    # Distancia entre restaurante e local de entrega, calculada uma unica vez:
+    if all( col in df.columns for col in DISTANCE_COLUMNS ):
+        df['distance'] = delivery_distance( df )
+
+    return df
+
+
+def legacy_clean_code ( df_raw ):
+    """ This function is the clean_code() the Delivery and Restaurant pages used to keep, row by row
+
+        Kept unchanged as the reference of check(); it modifies the input DataFrame.
+
+        Input: DataFrame
+        Output: DataFrame
+    """
+    # Remover espaco da string
+    df_raw.loc[: , 'ID'] = df_raw.loc[: , 'ID' ].str.strip()
+    df_raw.loc[: , 'Delivery_person_ID'] = df_raw.loc[: , 'Delivery_person_ID' ].str.strip()
+    df_raw.loc[: , 'Road_traffic_density'] = df_raw.loc[: , 'Road_traffic_density' ].str.strip()
+    df_raw.loc[: , 'Type_of_order'] = df_raw.loc[: , 'Type_of_order' ].str.strip()
+    df_raw.loc[: , 'Type_of_vehicle'] = df_raw.loc[: , 'Type_of_vehicle' ].str.strip()
+    df_raw.loc[: , 'Festival'] = df_raw.loc[: , 'Festival' ].str.strip()
+    df_raw.loc[: , 'City'] = df_raw.loc[: , 'City' ].str.strip()
+
+    # Excluir as linhas com a idade dos entregadores vazia
+    # ( Conceitos de seleção condicional )
+    linhas_vazias = df_raw['Delivery_person_Age'] != 'NaN '
+    df_raw = df_raw.loc[linhas_vazias, :]
+
+    # Conversao de texto/categoria/string para numeros inteiros
+    df_raw['Delivery_person_Age'] = df_raw['Delivery_person_Age'].astype( int )
+
+    # Conversao de texto/categoria/strings para numeros decimais
+    df_raw['Delivery_person_Ratings'] = df_raw['Delivery_person_Ratings'].astype( float )
+
+    # Conversao de texto para data
+    df_raw['Order_Date'] = pd.to_datetime( df_raw['Order_Date'], format='%d-%m-%Y' )
+
+    # Remove as linhas de algumas colunas que tenham o
+    # conteudo igual a NaN:
+    linhas_vazias = df_raw['multiple_deliveries'] != 'NaN '
+    linhas_vazias2 = df_raw['Weatherconditions'] != 'conditions NaN'
+    df_raw = df_raw.loc[linhas_vazias, :]
+    df_raw = df_raw.loc[linhas_vazias2, :]
+    df_raw = df_raw.loc[df_raw['City'] != 'NaN' , :]
+    df_raw['multiple_deliveries'] = df_raw['multiple_deliveries'].astype( int )
+
+    # Comando para remover o texto de números
+    df_raw = df_raw.reset_index( drop=True )
+    for i in range( len( df_raw ) ):
+        df_raw.loc[i, 'Time_taken(min)'] = re.findall( r'\d+', df_raw.loc[i, 'Time_taken(min)'] )
+
+    # Transformando os elementos da coluna "Time_taken" de listas para int:
+    df_raw['Time_taken(min)'] = df_raw['Time_taken(min)'].explode().astype(int)
+
+    return df_raw
+
+
+def check ( path=DATASET_PATH ):
+    """ This function compares clean_code() with the per-page cleaning it replaced, on a csv file
+
+        The rows, their order, the columns and the dtypes must be the same;
+        'distance', which the pages computed later, is left out.
+
+        Input: path of the csv file
+        Output: dict with the rows, the seconds of each version and the list of columns that differ
+    """
+    df_raw = pd.read_csv( path )
+
+    start = time.perf_counter()
+    with pd.option_context( 'mode.chained_assignment', None ):
+        expected = legacy_clean_code( df_raw.copy() )
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    got = clean_code( df_raw ).drop( columns='distance' )
+    vectorized = time.perf_counter() - start
+
+    different = [col for col in expected.columns if col not in got.columns or not got[col].equals( expected[col] )
+                 or got[col].dtype != expected[col].dtype]
+    different += [col for col in got.columns if col not in expected.columns]
+    if list( got.columns ) != list( expected.columns ):
+        different.append( 'column order' )
+
+    return {'rows': len( expected ), 'legacy': legacy, 'vectorized': vectorized, 'different': different}
+
+
+def source_columns ( columns ):
+    """ This function returns the csv columns clean_code() needs to produce some cleaned columns
+
+        Input: list of cleaned columns ( None for all )
+        Output: list of csv columns ( None for all )
+    """
+    if columns is None:
+        return None
+    needed = [col for col in columns if col != 'distance'] + FILTER_COLUMNS
+    if 'distance' in columns:
+        needed += DISTANCE_COLUMNS
+
+    return list( dict.fromkeys( needed ) )
+
+
+def _clean ( df_raw, columns ):
+    """ This function cleans a parsed csv and keeps the requested columns, in the compact schema """
+    df = clean_code( df_raw )
+    if columns is not None:
+        df = df.loc[: , list( columns )]
+
+    return optimize( df )
+
+
+def byte_ranges ( path, parts ):
+    """ This function splits a csv file in byte ranges that start and end at line boundaries
+
+        The header line is left out of the ranges. The rows of the dataset
+        have no quoted line breaks, so every line is one row.
+
+        Input: path of the csv and number of ranges
+        Output: header ( bytes ) and list of (start, stop) offsets, without empty ranges
+    """
+    size = os.path.getsize( path )
+    with open( path, 'rb' ) as f:
+        header = f.readline()
+        bounds = [f.tell()]
+        for i in range( 1, parts ):
+            f.seek( max( bounds[0], size * i // parts ) )
+            f.readline()
+            bounds.append( max( f.tell(), bounds[-1] ) )
+    bounds.append( size )
+
+    return header, [(start, stop) for start, stop in zip( bounds[:-1], bounds[1:] ) if stop > start]
+
+
+def _clean_range ( path, header, start, stop, columns=None ):
+    """ This function parses and cleans one byte range of the csv ( runs in a worker ) """
+    with open( path, 'rb' ) as f:
+        f.seek( start )
+        data = f.read( stop - start )
+
+    return _clean( pd.read_csv( io.BytesIO( header + data ), usecols=source_columns( columns ) ), columns )
+
+
+def concat_clean ( frames ):
+    """ This function joins cleaned frames in the compact schema, in the given order
+
+        The categories of every part are united ( sorted, as optimize() does )
+        and the integers are downcast again over the whole frame.
+
+        Input: list of DataFrames returned by optimize( clean_code( ... ) )
+        Output: DataFrame
+    """
+    if len( frames ) == 1:
+        return frames[0]
+
+    categories = {col: union_categoricals( [df[col] for df in frames], sort_categories=True )
+                  for col in frames[0].columns if isinstance( frames[0][col].dtype, pd.CategoricalDtype )}
+    df = pd.concat( [frame.drop( columns=list( categories ) ) for frame in frames], ignore_index=True )
+    for col, values in categories.items():
+        df[col] = values
+
+    return optimize( df.loc[: , list( frames[0].columns )] )
+
+
+def read_clean ( path=DATASET_PATH, workers=None, columns=None ):
+    """ This function parses and cleans the source csv, in the compact schema of curry.schema
+
+        With more than one worker the file is split by byte_ranges() and the
+        ranges are cleaned in a process pool.
+
+        Input: path of the csv file, number of worker processes ( default CURRY_INGEST_WORKERS )
+               and list of cleaned columns to keep ( None for all )
+        Output: DataFrame
+    """
+    workers = workers or config.INGEST_WORKERS
+    if workers <= 1:
+        return _clean( pd.read_csv( path, usecols=source_columns( columns ) ), columns )
+
+    header, ranges = byte_ranges( path, workers )
+    if len( ranges ) <= 1:
+        return _clean( pd.read_csv( path, usecols=source_columns( columns ) ), columns )
+
+    starts, stops = zip( *ranges )
+    n = len( ranges )
+    with ProcessPoolExecutor( max_workers=workers ) as pool:
+        frames = list( pool.map( _clean_range, [path] * n, [header] * n, starts, stops, [columns] * n ) )
+
+    return concat_clean( frames )
+
+
+@instrument
+def load_dataset ( path=DATASET_PATH, columns=None ):
+    """ This function returns the cleaned DataFrame of the source csv, in the compact schema of curry.schema
+
+        The cleaned frame is read from the columnar snapshot when it is fresh
+        (see curry.store). Otherwise the csv is parsed and cleaned and the
+        snapshot is written for the next load; with a list of columns only
+        those are cleaned, and no snapshot is written.
+
+        Input: path of the csv file and list of columns ( None for all )
+        Output: DataFrame
+    """
+    from curry import store
+
+    df = store.read_snapshot( path, columns=columns )
+    if df is not None:
+        return df
+    if columns is not None:
+        return read_clean( path, columns=columns )
+
+    df = read_clean( path )
+    try:
+        store.write_snapshot( df, path )
+    except (ImportError, OSError):
+        # Read only deployments keep working, only without the snapshot
+        pass
+
+    return df
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Clean the orders csv, or check clean_code() against the per-page cleaning.' )
+    parser.add_argument( '--source', default=DATASET_PATH, help='source csv file' )
+    parser.add_argument( '--check', action='store_true', help='compare clean_code() with legacy_clean_code()' )
+    args = parser.parse_args( argv )
+
+    if not args.check:
+        start = time.perf_counter()
+        df = read_clean( args.source )
+        print( '{:,} rows cleaned in {:.2f}s'.format( len( df ), time.perf_counter() - start ) )
+        return
+
+    result = check( args.source )
+    print( '{:,} rows: legacy {:.2f}s, clean_code {:.3f}s'.format( result['rows'], result['legacy'], result['vectorized'] ) )
+    if result['different']:
+        raise SystemExit( 'clean_code differs from the per-page cleaning: {}'.format( ', '.join( result['different'] ) ) )
+    print( 'clean_code matches the per-page cleaning' )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+""" Opt-in instrumentation of the data functions.
+
+    With CURRY_PROFILE=1 ( see curry.config ) every function decorated with
+    @instrument records, on each call:
+
+    - the wall time;
+    - the rows in ( of its first argument ) and out ( of its result );
+    - the peak memory allocated during the call ( tracemalloc ).
+
+    tracemalloc traces the whole process: the Streamlit sessions run in
+    parallel threads, so the peak of a call also counts what the other
+    sessions allocated meanwhile. Calls that overlapped an instrumented call
+    of another thread are marked as shared: their peak counts the memory of
+    the other sessions, and may miss part of their own, since every call
+    resets the peak of the process.
+    The sections are not serialized behind a lock: a session waiting on it
+    while holding a st.cache_data lock could deadlock with the other one.
+
+    The metrics also call scan() for every full pass they make over the
+    selected rows ( a pandas filter or groupby, a SQL query ), so the number of
+    scans of a rerun shows how well the aggregation planner ( curry.planner )
+    shared them between the widgets.
+
+    The records of a rerun are shown by debug_panel() in the sidebar and
+    appended as JSON lines to CURRY_PROFILE_FILE, tagged with the page, the
+    git revision and the host, so reruns can be compared across deployments.
+
+    Without CURRY_PROFILE the decorator returns the function unchanged.
+"""
+
+import functools
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+from curry import config
+
+_local = threading.local()
+_file_lock = threading.Lock()
+_sections_lock = threading.Lock()
+_sections = {}       # thread -> instrumented calls open in it
+_shared = set()      # threads whose open calls overlapped another thread
+_revision = None
+
+
+def _records ():
+    if not hasattr( _local, 'records' ):
+        _local.records = []
+        _local.peaks = []
+        _local.scans = []
+
+    return _local.records
+
+
+def scan ( label, rows=None ):
+    """ This function records a full pass over the selected rows ( when CURRY_PROFILE=1 )
+
+        Input: what the pass computes and the number of rows read ( None when unknown, as in SQL )
+    """
+    if config.PROFILE:
+        _records()
+        _local.scans.append( {'scan': label, 'rows': rows} )
+
+
+def rows ( value ):
+    """ This function returns the number of rows of a value: DataFrame, Series, metrics, figure or tuple of them
+
+        Output: int, or None for values without rows
+    """
+    from curry.metrics import Metrics
+
+    if isinstance( value, (pd.DataFrame, pd.Series, pd.Index) ):
+        return len( value )
+    if isinstance( value, (tuple, list) ):
+        counts = [rows( v ) for v in value]
+        counts = [c for c in counts if c is not None]
+        return sum( counts ) if counts else None
+    if isinstance( value, Metrics ):
+        return value.rows()
+    if type( value ).__module__.startswith( 'plotly.' ):
+        # Plotly figure: points of every trace
+        points = 0
+        for trace in value.data:
+            for attr in ('x', 'values', 'labels'):
+                if attr in trace and trace[attr] is not None:
+                    points += len( trace[attr] )
+                    break
+        return points
+
+    return None
+
+
+def instrument ( function ):
+    """ This function decorates a data function so its calls are recorded ( when CURRY_PROFILE=1 ) """
+    if not config.PROFILE:
+        return function
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    @functools.wraps( function )
+    def wrapper ( *args, **kwargs ):
+        records = _records()
+        peaks = _local.peaks
+
+        # Nested calls share the tracemalloc peak: the caller keeps the highest peak seen so far
+        if peaks:
+            peaks[-1] = max( peaks[-1], tracemalloc.get_traced_memory()[1] )
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        peaks.append( start_memory )
+
+        thread = threading.get_ident()
+        with _sections_lock:
+            _sections[thread] = _sections.get( thread, 0 ) + 1
+            if len( _sections ) > 1:
+                _shared.update( _sections )
+
+        start = time.perf_counter()
+        try:
+            result = function( *args, **kwargs )
+        finally:
+            wall = time.perf_counter() - start
+            peak = max( peaks.pop(), tracemalloc.get_traced_memory()[1] )
+            if peaks:
+                peaks[-1] = max( peaks[-1], peak )
+            with _sections_lock:
+                shared = thread in _shared
+                _sections[thread] -= 1
+                if not _sections[thread]:
+                    del _sections[thread]
+                    _shared.discard( thread )
+
+        records.append( {'function': function.__name__,
+                         'wall_ms': round( wall * 1000, 3 ),
+                         'rows_in': rows( args[0] ) if args else None,
+                         'rows_out': rows( result ),
+                         'peak_kb': round( (peak - start_memory) / 1024, 1 ),
+                         'peak_shared': shared} )
+
+        return result
+
+    return wrapper
+
+
+def revision ():
+    """ This function returns the git revision of the code, or None outside a git checkout """
+    global _revision
+    if _revision is None:
+        try:
+            _revision = subprocess.run( ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                        cwd=os.path.dirname( os.path.abspath( __file__ ) ), timeout=5 ).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            _revision = ''
+
+    return _revision or None
+
+
+def flush ( page ):
+    """ This function returns the records of the current rerun and appends them to CURRY_PROFILE_FILE
+
+        The full scans of the rerun are written as one record of the function 'scans'.
+
+        Input: name of the page
+        Output: list of dicts
+    """
+    records = _records()
+    scans = _local.scans
+    _local.records = []
+    _local.scans = []
+    if scans:
+        records.append( {'function': 'scans', 'scans': len( scans ), 'labels': [s['scan'] for s in scans]} )
+    if not records:
+        return records
+
+    tags = {'ts': time.time(), 'page': page, 'revision': revision(), 'host': socket.gethostname(),
+            'data_mode': config.DATA_MODE}
+    records = [dict( tags, **record ) for record in records]
+    with _file_lock:
+        with open( config.PROFILE_FILE, 'a' ) as f:
+            for record in records:
+                f.write( json.dumps( record ) + '\n' )
+
+    return records
+
+
+def debug_panel ( page ):
+    """ This function shows the records of the current rerun in the sidebar ( when CURRY_PROFILE=1 )
+
+        Input: name of the page
+    """
+    if not config.PROFILE:
+        return
+
+    import streamlit as st
+    from curry import figures
+
+    records = flush( page )
+    scans = [record for record in records if record['function'] == 'scans']
+    records = [record for record in records if record['function'] != 'scans']
+    with st.sidebar.expander( 'Debug: timings', expanded=False ):
+        if records:
+            df = pd.DataFrame( records ).loc[: , ['function', 'wall_ms', 'rows_in', 'rows_out', 'peak_kb', 'peak_shared']]
+            st.dataframe( df, hide_index=True )
+            st.caption( 'Total: {:.1f} ms'.format( df['wall_ms'].sum() ) )
+            st.caption( 'peak_kb is the peak of the whole process during the call: with peak_shared, other sessions '
+                        'were running instrumented calls meanwhile and their memory is included.' )
+        else:
+            st.caption( 'No data function ran in this rerun ( cached figures ).' )
+        if scans:
+            st.caption( 'Full scans of the selected rows: {} ( {} )'.format( scans[0]['scans'], ', '.join( scans[0]['labels'] ) ) )
+        else:
+            st.caption( 'Full scans of the selected rows: 0' )
+        st.caption( 'Figure cache: {hits} hits, {misses} misses, {entries} entries'.format( **figures.stats() ) )
@@ -0,0 +1,31 @@
+""" Layout helpers shared by the pages.
+
+    st.tabs runs the body of every tab on every rerun, visible or not. In the
+    lazy mode ( CURRY_TABS=lazy, see curry.config ) the tabs are drawn as a
+    horizontal radio and only the selected one gets a container; the others
+    get None, so the pages skip their work:
+
+        tab1, tab2, tab3 = page_tabs( ['Management Vision', 'Tactical Vision', 'Geographic Vision'], key='company' )
+        if tab1:
+            with tab1:
+                ...
+"""
+
+import streamlit as st
+
+from curry import config
+
+
+def page_tabs ( labels, key ):
+    """ This function creates the tabs of a page
+
+        Input: labels of the tabs and a key unique to the page
+        Output: list with a container for each tab, None for the tabs that are not selected ( lazy mode )
+    """
+    if config.TABS != 'lazy':
+        return st.tabs( labels )
+
+    selected = st.radio( 'Tabs', labels, horizontal=True, label_visibility='collapsed', key='tabs_' + key )
+
+    # Repeated labels ( like the '_' placeholders ) select their first tab
+    return [st.container() if i == labels.index( selected ) else None for i in range( len( labels ) )]
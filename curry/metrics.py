@@ -0,0 +1,348 @@
+""" Aggregated tables behind the charts of the pages.
+
+    Every chart of the pages is drawn from a small aggregated table. The
+    classes here compute those tables, so the pages only render them and the
+    data can come from different sources:
+
+    - FrameMetrics: pandas on the rows of the cleaned dataset selected by the
+      sidebar, plus the as-of index for the grouped means and deviations;
+    - curry.stream.SummaryMetrics: partial aggregates folded chunk by chunk,
+      for datasets larger than the memory.
+
+    Both return the same columns, so the pages do not know which one they use.
+
+    Sources that read rows also answer partials(): the mergeable aggregates
+    ( count, sum, sum of squares, min, max ) of several value columns by a
+    grouping, in one pass. curry.planner uses them to share one scan between
+    the widgets of a page.
+
+    COLUMNS lists the columns of the rows every table reads; the pages load
+    only the columns of their tables ( curry.columns ), so a method reading
+    a new column must declare it there.
+"""
+
+import numpy as np
+import pandas as pd
+
+from curry.geo import MAX_CELLS, grid_cells, grid_summary
+from curry.instrument import scan
+
+# Statistics returned by partials(), in the order of their columns:
+PARTIALS = ['count', 'sum', 'sumsq', 'min', 'max']
+
+# Maximum number of delivery locations sent to the clustered markers of the map:
+MAX_POINTS = 5000
+
+LOCATION = ['Delivery_location_latitude', 'Delivery_location_longitude']
+
+# Table -> columns of the selected rows read by FrameMetrics ( none for the tables of the as-of index ):
+COLUMNS = {'rows': lambda: [],
+           'courier_ratings': lambda: [],
+           'ratings': lambda col: [],
+           'time_by': lambda group: [],
+           'festival_time': lambda: [],
+           'orders_by_day': lambda: ['Order_Date', 'ID'],
+           'orders_by_traffic': lambda: ['Road_traffic_density', 'ID'],
+           'orders_by_city_traffic': lambda: ['City', 'Road_traffic_density', 'ID'],
+           'orders_by_week': lambda: ['Order_Date', 'ID'],
+           'orders_per_courier_by_week': lambda: ['Order_Date', 'ID', 'Delivery_person_ID'],
+           'location_medians': lambda: ['City', 'Road_traffic_density'] + LOCATION,
+           'delivery_grid': lambda: LOCATION + ['Time_taken(min)'],
+           'delivery_points': lambda: LOCATION,
+           'extreme': lambda col: [col],
+           'courier_time': lambda: ['City', 'Delivery_person_ID', 'Time_taken(min)'],
+           'top_couriers': lambda: ['City', 'Delivery_person_ID', 'Time_taken(min)'],
+           'courier_count': lambda: ['Delivery_person_ID'],
+           'avg_distance': lambda: ['distance'],
+           'distance_by_city': lambda: ['City', 'distance']}
+
+
+def extremes_by_group ( df, group, col, n, tie=None ):
+    """ This function selects the n smallest and the n largest values of a column in every group
+
+        The rows are bucketed by group once and each group is partially
+        selected with np.partition: only the rows up to the n-th value of a
+        group are sorted, O(rows) for any number of groups, instead of
+        sorting the whole frame. Equal values are ordered by the tie column,
+        also at the n-th value ( the rows kept are the first ones by tie ), as
+        a stable sort_values( [group, col] ) of a frame ordered by the tie column.
+
+        Input: DataFrame, grouping column, value column, number of rows per group and
+               column breaking the ties ( None: the position of the rows in df )
+        Output: tuple of DataFrames (smallest, largest), ordered by group and then by the value
+    """
+    codes, groups = pd.factorize( df[group], sort=True )
+    values = df[col].to_numpy( dtype=np.float64 )
+    # Ties by the values themselves, not by the order of the categories ( see curry.schema )
+    labels = None if tie is None else df[tie].to_numpy()
+    order = np.argsort( codes, kind='stable' )
+    bounds = np.searchsorted( codes[order], np.arange( len( groups ) + 1 ) )
+
+    def select ( rows, v, k ):
+        # Every row up to the k-th value ( the ties of the k-th included ), sorted by value and tie
+        if k < len( rows ):
+            # NaN last, as in sort_values: they stay when the k-th value is one of them
+            keep = ~(v > np.partition( v, k - 1 )[k - 1])
+            rows, v = rows[keep], v[keep]
+        ties = rows if labels is None else pd.factorize( labels[rows], sort=True )[0]
+        return rows[np.lexsort( (ties, v) )[:k]]
+
+    smallest, largest = [], []
+    for start, stop in zip( bounds[:-1], bounds[1:] ):
+        rows = order[start:stop]
+        k = min( n, len( rows ) )
+        if k == 0:
+            continue
+        smallest.append( select( rows, values[rows], k ) )
+        largest.append( select( rows, -values[rows], k ) )
+
+    def take ( parts ):
+        positions = np.concatenate( parts ) if parts else np.array( [], dtype=np.int64 )
+        return df.iloc[positions].reset_index( drop=True )
+
+    return take( smallest ), take( largest )
+
+
+def observed ( df ):
+    """ This function drops the categories without rows from the categorical columns of a grouped table
+
+        plotly groups a colour column by every category of its dtype, and fails
+        on the categories missing from the table ( e.g. an empty selection ).
+
+        Input: DataFrame
+        Output: the same DataFrame, with its categoricals reduced to the values present
+    """
+    for col in df.columns:
+        if isinstance( df[col].dtype, pd.CategoricalDtype ):
+            df[col] = df[col].cat.remove_unused_categories()
+
+    return df
+
+
+class Metrics:
+    """ Metrics answered by the as-of index (curry.asof), common to every source """
+
+    def __init__ ( self, asof ):
+        self.asof = asof
+
+    def rows ( self ):
+        """ Number of selected orders """
+        return int( self.asof.agg( 'Road_traffic_density', {'Time_taken(min)': 'count'} )['Time_taken(min)'].sum() )
+
+    def courier_ratings ( self ):
+        """ Average rating of each delivery person """
+        return self.asof.agg( 'Delivery_person_ID', {'Delivery_person_Ratings': 'mean'} ).reset_index()
+
+    def ratings ( self, col ):
+        """ Average and standard deviation of the ratings by the given column """
+        return self.asof.agg( col, {'Delivery_person_Ratings': ['mean', 'std']} )
+
+    def time_by ( self, group ):
+        """ Average and standard deviation of the delivery time by the given column(s) """
+        df_time = self.asof.agg( group, {'Time_taken(min)': ['mean', 'std']} )
+        df_time.columns = ['avg_time', 'std_time']
+
+        return df_time.reset_index()
+
+    def festival_time ( self, festival, operation ):
+        """ Average ('mean') or standard deviation ('std') of the delivery time with or without festival """
+        df_time = self.asof.agg( 'Festival', {'Time_taken(min)': ['mean', 'std']} )
+
+        return np.round( df_time['Time_taken(min)', operation].get( festival, np.nan ), 2 )
+
+    def top_couriers ( self, n=10 ):
+        """ The n fastest and the n slowest delivery people of each city ( equal times by Delivery_person_ID )
+
+            Output: tuple of DataFrames (fastest, slowest)
+        """
+        return extremes_by_group( self.courier_time(), 'City', 'Time_taken(min)', n, tie='Delivery_person_ID' )
+
+    def delivery_grid ( self, max_cells=MAX_CELLS ):
+        """ Orders and average delivery time by grid cell of the delivery location ( see curry.geo ) """
+        cells, counts, sums = self._cell_totals()
+
+        return grid_summary( cells, counts, sums, max_cells=max_cells )
+
+    def delivery_points ( self, limit=MAX_POINTS ):
+        """ At most limit delivery locations for the clustered markers: here the centres of the grid cells """
+        grid = self.delivery_grid( max_cells=limit )
+
+        return pd.DataFrame( {'Delivery_location_latitude': grid['lat'] + grid['degrees'] / 2,
+                              'Delivery_location_longitude': grid['lng'] + grid['degrees'] / 2} )
+
+    def partials ( self, keys, values ):
+        """ Count, sum, sum of squares, min and max of the value columns by the keys, in one pass
+
+            Output: DataFrame indexed by the keys ( one row without keys ), with the columns (value, statistic);
+                    None for sources without rows
+        """
+        return None
+
+
+class FrameMetrics ( Metrics ):
+    """ Metrics computed with pandas on the selected rows of the dataset
+
+        With a mask the tables copy out of the dataset only the selected rows
+        of the columns they read, and the whole rows are copied by df on first
+        use: a rerun answered by the as-of index and the figure cache
+        ( curry.figures ), or a tab that is not shown ( curry.layout ), copies
+        nothing.
+
+        Input: DataFrame already filtered by the sidebar ( or the whole dataset and the boolean
+               mask of the selected rows ) and the AsOfView of the same filters
+    """
+
+    def __init__ ( self, df, asof, mask=None ):
+        super().__init__( asof )
+        self.data = df
+        self.mask = mask
+        self.selected = df if mask is None else None
+        self.n_rows = len( df ) if mask is None else int( np.count_nonzero( mask ) )
+        self.positions = None
+
+    @property
+    def df ( self ):
+        """ Selected rows, copied from the dataset on first use """
+        if self.selected is None:
+            self.selected = self.data.loc[self.mask, :]
+            # Copying the selected rows is itself a pass over them
+            scan( 'filter', self.n_rows )
+
+        return self.selected
+
+    def rows ( self ):
+        return self.n_rows
+
+    def _scan ( self, label, columns=None ):
+        # Every method reading the rows goes through here, so its pass is counted ( curry.instrument.scan );
+        # while the rows are not copied, a method reading a few columns gets only those
+        scan( label, self.n_rows )
+        if columns is not None and self.selected is None:
+            if self.positions is None:
+                self.positions = np.flatnonzero( self.mask )
+            # df.loc[mask, columns] filtra as linhas inteiras antes de escolher as colunas
+            return self.data.loc[: , list( columns )].take( self.positions )
+
+        return self.df
+
+    def orders_by_day ( self ):
+        df = self._scan( 'orders_by_day', ['Order_Date', 'ID'] )
+
+        return df.loc[: , ['Order_Date', 'ID']].groupby( 'Order_Date' ).count().reset_index()
+
+    def orders_by_traffic ( self ):
+        df = self._scan( 'orders_by_traffic', ['Road_traffic_density', 'ID'] )
+        pedidos_por_tipodetrafego = (df.loc[: , ['Road_traffic_density', 'ID']]
+                                       .groupby( 'Road_traffic_density', observed=True )
+                                       .count()
+                                       .reset_index())
+        pedidos_por_tipodetrafego['perc_entrega'] = pedidos_por_tipodetrafego['ID'] / pedidos_por_tipodetrafego['ID'].sum()
+
+        return pedidos_por_tipodetrafego
+
+    def orders_by_city_traffic ( self ):
+        df = self._scan( 'orders_by_city_traffic', ['City', 'Road_traffic_density', 'ID'] )
+
+        return observed( df.loc[: , ['City', 'Road_traffic_density', 'ID']]
+                           .groupby( ['City', 'Road_traffic_density'], observed=True )
+                           .count()
+                           .reset_index() )
+
+    def _with_week ( self, label, columns ):
+        df = self._scan( label, ['Order_Date'] + columns )
+        # Week of the year as a local column ( the shared dataset is read only ):
+        return df.assign( week_of_year=df['Order_Date'].dt.strftime( '%U' ) )
+
+    def orders_by_week ( self ):
+        df = self._with_week( 'orders_by_week', ['ID'] )
+
+        return (df.loc[: , ['week_of_year', 'ID']]
+                  .groupby( 'week_of_year' )
+                  .count()
+                  .reset_index())
+
+    def orders_per_courier_by_week ( self ):
+        df = self._with_week( 'orders_per_courier_by_week', ['ID', 'Delivery_person_ID'] )
+        df_aux4 = (df.loc[: , ['ID', 'week_of_year']]
+                     .groupby( 'week_of_year' )
+                     .count()
+                     .reset_index())
+        df_aux5 = (df.loc[: , ['Delivery_person_ID', 'week_of_year']]
+                     .groupby( 'week_of_year' )
+                     .nunique()
+                     .reset_index())
+
+        # Joining two DFs and creating the column of orders average by Deliveries:
+        df_aux6 = pd.merge( df_aux4, df_aux5, how='inner' )
+        df_aux6['Orders_by_deliver'] = df_aux6['ID'] / df_aux6['Delivery_person_ID']
+
+        return df_aux6
+
+    def location_medians ( self ):
+        df = self._scan( 'location_medians', ['City', 'Road_traffic_density', 'Delivery_location_latitude', 'Delivery_location_longitude'] )
+
+        return (df.loc[: , ['City', 'Road_traffic_density', 'Delivery_location_latitude', 'Delivery_location_longitude']]
+                  .groupby( ['City', 'Road_traffic_density'], observed=True )
+                  .median()
+                  .reset_index())
+
+    def _cell_totals ( self ):
+        df = self._scan( 'delivery_grid', ['Delivery_location_latitude', 'Delivery_location_longitude', 'Time_taken(min)'] )
+        cells = grid_cells( df['Delivery_location_latitude'].to_numpy(), df['Delivery_location_longitude'].to_numpy() )
+
+        return cells, np.ones( len( df ) ), df['Time_taken(min)'].to_numpy()
+
+    def delivery_points ( self, limit=MAX_POINTS ):
+        """ At most limit delivery locations for the clustered markers, sampled from the selected orders """
+        df = self._scan( 'delivery_points', ['Delivery_location_latitude', 'Delivery_location_longitude'] )
+        if len( df ) > limit:
+            df = df.sample( n=limit, random_state=0 )
+
+        return df.reset_index( drop=True )
+
+    def extreme ( self, col, operation ):
+        """ Maximum ('max') or minimum ('min') of a column """
+        df = self._scan( 'extreme', [col] )
+        if operation == 'max':
+            return df.loc[: , col].max()
+        elif operation == 'min':
+            return df.loc[: , col].min()
+
+    def courier_time ( self ):
+        """ Average delivery time of each delivery person in each city """
+        df = self._scan( 'courier_time', ['City', 'Delivery_person_ID', 'Time_taken(min)'] )
+
+        return df.groupby( ['City', 'Delivery_person_ID'], observed=True )['Time_taken(min)'].mean().reset_index()
+
+    def courier_count ( self ):
+        """ Number of distinct delivery people """
+        return len( self._scan( 'courier_count', ['Delivery_person_ID'] ).loc[: , 'Delivery_person_ID'].unique() )
+
+    def avg_distance ( self ):
+        """ Average distance between restaurants and delivery locations """
+        return np.round( self._scan( 'avg_distance', ['distance'] )['distance'].mean(), 2 )
+
+    def distance_by_city ( self ):
+        """ Average distance between restaurants and delivery locations by city """
+        df = self._scan( 'distance_by_city', ['City', 'distance'] )
+
+        return df.loc[: , ['City', 'distance']].groupby( 'City', observed=True ).mean().reset_index()
+
+    def partials ( self, keys, values ):
+        df = self._scan( 'plan {}'.format( '+'.join( keys ) or 'total' ), list( keys ) + list( values ) )
+        frame = df.loc[: , list( keys ) + list( values )]
+        squares = ['{} sumsq'.format( col ) for col in values]
+        for col, square in zip( values, squares ):
+            frame[square] = frame[col].astype( np.float64 ) ** 2
+
+        # Without keys every row falls in one group
+        grouped = frame.groupby( list( keys ) if keys else np.zeros( len( frame ), dtype=np.int8 ), observed=True, sort=True )
+        spec = dict( {col: ['count', 'sum', 'min', 'max'] for col in values}, **{square: 'sum' for square in squares} )
+        result = grouped.agg( spec )
+
+        table = pd.concat( {col: pd.DataFrame( {'count': result[(col, 'count')], 'sum': result[(col, 'sum')],
+                                                'sumsq': result[(square, 'sum')], 'min': result[(col, 'min')],
+                                                'max': result[(col, 'max')]} )
+                            for col, square in zip( values, squares )}, axis=1 )
+
+        return table if keys else table.reset_index( drop=True )
@@ -0,0 +1,219 @@
+""" Aggregation planner: the metrics of a page computed in the fewest passes over the rows.
+
+    Each widget of a page asks its metrics for one small table, and a source
+    reading rows ( FrameMetrics, SqlMetrics ) answers every call with its own
+    pass: four extremes are four scans, two groupings of the same column are
+    two scans. A page declares instead, right after get_metrics(), all the
+    tables it is going to draw:
+
+        metrics = plan_metrics( metrics, [('festival_time',), ('time_by', 'City'), ('extreme', 'Vehicle_condition')] )
+
+    The declared aggregations ( AGGREGATIONS: one value column by a grouping )
+    are planned; the other tables of the list only feed the column manifest
+    of the page ( curry.columns ). The planner drops the aggregations the
+    as-of index already answers ( no scan at all ), merges the rest into
+    grouping sets, and on the first call computes the mergeable partial
+    aggregates ( count, sum, sum of squares, min, max ) of each set in one
+    pass ( Metrics.partials ). Every planned table is then rolled up from its
+    set, and the other calls go to the wrapped metrics as before.
+
+    The groupings of low cardinality columns are merged in a single set ( the
+    product of their categories stays small ); any other grouping gets its
+    own pass. The number of passes of a rerun is shown by the debug panel of
+    curry.instrument ( CURRY_PROFILE=1 ).
+"""
+
+import numpy as np
+import pandas as pd
+
+from curry.metrics import MAX_POINTS, Metrics
+
+TIME = 'Time_taken(min)'
+RATINGS = 'Delivery_person_Ratings'
+
+# Declared table -> (grouping columns, value column) it aggregates:
+AGGREGATIONS = {'festival_time': lambda: (('Festival',), TIME),
+                'time_by': lambda group: (tuple( np.atleast_1d( group ) ), TIME),
+                'ratings': lambda col: ((col,), RATINGS),
+                'extreme': lambda col: ((), col),
+                'avg_distance': lambda: ((), 'distance'),
+                'distance_by_city': lambda: (('City',), 'distance')}
+
+# Columns with a handful of categories: their groupings share one pass
+LOW_CARDINALITY = ['Festival', 'City', 'Road_traffic_density', 'Type_of_order', 'Weatherconditions', 'Type_of_vehicle']
+
+# How the partial aggregates of a fine grouping roll up to a coarser one
+ROLLUP = {'count': 'sum', 'sum': 'sum', 'sumsq': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def indexed ( asof, keys, value ):
+    """ This function tells if the as-of index answers an aggregation without reading the rows
+
+        Input: AsOfView ( or None ), grouping columns and value column
+        Output: bool
+    """
+    if asof is None:
+        return False
+    table = asof.index.tables.get( tuple( keys ) )
+
+    return table is not None and value in table.values
+
+
+def plan ( needs ):
+    """ This function groups the aggregations that read the rows into passes
+
+        Input: list of (grouping columns, value column)
+        Output: list of passes (grouping columns, value columns)
+    """
+    passes = {}
+    for keys, value in needs:
+        # Low cardinality groupings ( and the totals ) go to one shared pass
+        shared = all( key in LOW_CARDINALITY for key in keys )
+        passes.setdefault( None if shared else keys, [] ).append( (keys, value) )
+
+    result = []
+    for group, members in passes.items():
+        keys = []
+        for member_keys, _ in members:
+            keys += [key for key in member_keys if key not in keys]
+        values = list( dict.fromkeys( value for _, value in members ) )
+        result.append( (tuple( keys ) if group is None else group, values) )
+
+    return result
+
+
+def rollup ( table, keys, value ):
+    """ This function rolls the partial aggregates of a pass up to a coarser grouping
+
+        Input: partials of a pass ( Metrics.partials ), grouping columns and value column
+        Output: DataFrame of count, sum, sumsq, min and max indexed by the keys ( one row without keys )
+    """
+    part = table[value]
+    if not keys:
+        return pd.DataFrame( {stat: [getattr( part[stat], reduce )()] for stat, reduce in ROLLUP.items()} )
+    if list( part.index.names ) == list( keys ):
+        return part
+
+    return part.groupby( level=list( keys ), observed=True, sort=True ).agg( ROLLUP )
+
+
+def stat ( part, operation ):
+    """ This function evaluates a statistic ('mean', 'std', 'min' or 'max') from the rolled up aggregates
+
+        Output: Series ( the same formulas as the as-of index, curry.asof )
+    """
+    n = part['count'].astype( np.float64 )
+    if operation == 'mean':
+        return part['sum'] / n
+    if operation == 'std':
+        s = part['sum']
+        var = ((part['sumsq'] - s * s / n) / (n - 1)).where( n > 1 ).clip( lower=0 )
+        return np.sqrt( var )
+
+    return part[operation]
+
+
+class PlannedMetrics ( Metrics ):
+    """ Metrics of a page with the declared tables computed in shared passes
+
+        Input: metrics reading rows and the aggregations they have to answer
+    """
+
+    def __init__ ( self, metrics, needs ):
+        super().__init__( metrics.asof )
+        self.metrics = metrics
+        self.needs = set( needs )
+        self.passes = plan( sorted( self.needs ) )
+        self.tables = None
+
+    def __getattr__ ( self, name ):
+        # Tables not declared by the page come from the wrapped metrics
+        if name == 'metrics':
+            raise AttributeError( name )
+        return getattr( self.metrics, name )
+
+    def _part ( self, keys, value ):
+        keys = tuple( keys )
+        if (keys, value) not in self.needs:
+            return None
+        if self.tables is None:
+            # All the passes run on the first declared table asked by the page
+            self.tables = [(pass_keys, values, self.metrics.partials( pass_keys, values )) for pass_keys, values in self.passes]
+        for pass_keys, values, table in self.tables:
+            if value in values and set( keys ) <= set( pass_keys ):
+                return rollup( table, keys, value )
+
+    def rows ( self ):
+        return self.metrics.rows()
+
+    def courier_ratings ( self ):
+        return self.metrics.courier_ratings()
+
+    def top_couriers ( self, n=10 ):
+        return self.metrics.top_couriers( n )
+
+    def delivery_points ( self, limit=MAX_POINTS ):
+        return self.metrics.delivery_points( limit )
+
+    def ratings ( self, col ):
+        part = self._part( (col,), RATINGS )
+        if part is None:
+            return self.metrics.ratings( col )
+
+        return pd.DataFrame( {(RATINGS, 'mean'): stat( part, 'mean' ), (RATINGS, 'std'): stat( part, 'std' )} )
+
+    def time_by ( self, group ):
+        keys = tuple( np.atleast_1d( group ) )
+        part = self._part( keys, TIME )
+        if part is None:
+            return self.metrics.time_by( group )
+
+        return pd.DataFrame( {'avg_time': stat( part, 'mean' ), 'std_time': stat( part, 'std' )} ).reset_index()
+
+    def festival_time ( self, festival, operation ):
+        part = self._part( ('Festival',), TIME )
+        if part is None:
+            return self.metrics.festival_time( festival, operation )
+
+        return np.round( stat( part, operation ).get( festival, np.nan ), 2 )
+
+    def extreme ( self, col, operation ):
+        part = self._part( (), col )
+        if part is None:
+            return self.metrics.extreme( col, operation )
+
+        return part[operation].iloc[0]
+
+    def avg_distance ( self ):
+        part = self._part( (), 'distance' )
+        if part is None:
+            return self.metrics.avg_distance()
+
+        return np.round( stat( part, 'mean' ).iloc[0], 2 )
+
+    def distance_by_city ( self ):
+        part = self._part( ('City',), 'distance' )
+        if part is None:
+            return self.metrics.distance_by_city()
+
+        return stat( part, 'mean' ).rename( 'distance' ).reset_index()
+
+
+def plan_metrics ( metrics, declared ):
+    """ This function wraps the metrics of a page so its declared tables share their passes over the rows
+
+        Input: metrics returned by get_metrics() and list of declared tables, as tuples
+               (method, arguments...), e.g. ('time_by', ['City', 'Type_of_order']); the tables
+               that are not in AGGREGATIONS are left to the metrics
+        Output: PlannedMetrics; the same metrics when they do not read rows ( stream and views modes )
+                or when the as-of index answers every declared table
+    """
+    if type( metrics ).partials is Metrics.partials:
+        return metrics
+
+    needs = [AGGREGATIONS[method]( *args ) for method, *args in declared if method in AGGREGATIONS]
+    needs = [(keys, value) for keys, value in needs if not indexed( metrics.asof, keys, value )]
+    if not needs:
+        return metrics
+
+    return PlannedMetrics( metrics, needs )
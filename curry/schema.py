@@ -0,0 +1,109 @@
+""" Compact in-memory schema of the cleaned dataset.
+
+    After clean_code() the text columns are Python object strings and the
+    numbers are 64 bit. optimize() stores the low cardinality text columns as
+    categoricals and downcasts the numbers to the smallest type that holds
+    their values, which divides the resident memory of every replica.
+
+    Print the bytes per column before and after:
+
+        python -m curry.schema --source ftc_train.csv
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Text columns with few distinct values, stored as categoricals:
+CATEGORY_COLUMNS = ['City', 'Road_traffic_density', 'Type_of_order', 'Type_of_vehicle',
+                    'Festival', 'Weatherconditions', 'Delivery_person_ID', 'Time_Orderd', 'Time_Order_picked']
+
+# Integer columns, downcast to the smallest integer type that holds their range:
+INTEGER_COLUMNS = ['Delivery_person_Age', 'Vehicle_condition', 'multiple_deliveries', 'Time_taken(min)']
+
+# Float columns where float32 precision is enough. The ratings stay float64: their means and
+# deviations are displayed, and float32 values like 4.7 would move them ( 3.842000012 instead of 3.842 )
+FLOAT32_COLUMNS = ['Restaurant_latitude', 'Restaurant_longitude',
+                   'Delivery_location_latitude', 'Delivery_location_longitude']
+
+
+def optimize ( df ):
+    """ This function converts the cleaned DataFrame to the compact schema
+
+        Input: DataFrame returned by clean_code()
+        Output: new DataFrame with categoricals, downcast numbers and datetime64 dates
+    """
+    df = df.copy()
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype( 'category' )
+
+    for col in INTEGER_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric( df[col], downcast='integer' )
+
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype( np.float32 )
+
+    if 'Order_Date' in df.columns:
+        df['Order_Date'] = pd.to_datetime( df['Order_Date'] )
+
+    return df
+
+
+def assemble_frame ( blocks, arrays, columns, index ):
+    """ This function builds a DataFrame around existing arrays, without copying them
+
+        Every 2D array ( one row per column, the layout of a pandas block )
+        becomes the single block of a frame of its own; the frames are joined
+        and put back in the order of the columns as views of those blocks, so
+        they stay consolidated and keep the flags of the arrays ( the views of
+        a read only array are read only ).
+
+        Input: list of (2D array, its columns), dict {column: 1D or extension array},
+               order of the columns and index
+        Output: DataFrame
+    """
+    frames = [pd.DataFrame( values.T, index=index, columns=block_columns, copy=False ) for values, block_columns in blocks]
+    frames.append( pd.DataFrame( arrays, index=index, copy=False ) )
+    df = pd.concat( frames, axis=1, copy=False )
+
+    # Sem copy on write o reindex das colunas copia os blocos ( take ); com ele, só fatia
+    with pd.option_context( 'mode.copy_on_write', True ):
+        return df.reindex( columns=list( columns ), copy=False )
+
+
+def memory_report ( before, after ):
+    """ This function compares the memory used by each column of two versions of the DataFrame
+
+        Input: DataFrame before and after optimize()
+        Output: DataFrame with dtypes and bytes per column, plus a total row
+    """
+    report = pd.DataFrame( {'dtype_before': before.dtypes.astype( str ),
+                            'bytes_before': before.memory_usage( index=False, deep=True ),
+                            'dtype_after': after.dtypes.astype( str ),
+                            'bytes_after': after.memory_usage( index=False, deep=True )} )
+    report.loc['total'] = ['', report['bytes_before'].sum(), '', report['bytes_after'].sum()]
+    report['ratio'] = report['bytes_after'] / report['bytes_before']
+
+    return report
+
+
+def main ( argv=None ):
+    from curry.ingest import clean_code
+
+    parser = argparse.ArgumentParser( description='Print the memory used per column before and after optimize().' )
+    parser.add_argument( '--source', default='ftc_train.csv', help='source csv file' )
+    args = parser.parse_args( argv )
+
+    before = clean_code( pd.read_csv( args.source ) )
+    after = optimize( before )
+    with pd.option_context( 'display.width', 160, 'display.max_columns', None, 'display.float_format', '{:.3f}'.format ):
+        print( memory_report( before, after ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+""" Local HTTP/JSON service of the dashboard metrics.
+
+    The metrics of the pages ( curry.metrics ) are served without running a
+    page script: the dataset and its indexes are loaded once at start and kept
+    in memory by curry.cache, so each request only answers from them.
+
+        python -m curry.server --source ftc_train.csv --port 8765
+
+        curl 'http://127.0.0.1:8765/metrics/orders_by_day?cutoff=2022-04-03&traffic=Low,Jam'
+        curl 'http://127.0.0.1:8765/metrics/top_couriers?n=5'
+        curl 'http://127.0.0.1:8765/metrics/festival_time?festival=Yes&operation=std'
+
+    Every metric takes the sidebar filters as query parameters: cutoff
+    ( orders before this date, default all ) and traffic ( comma separated,
+    default every condition ). The other parameters only accept the values
+    the pages use ( see FESTIVALS, RATING_COLUMNS, TIME_GROUPS, ... ); an
+    invalid one is answered with status 400. GET /metrics lists the metrics
+    and GET /health returns the dataset version.
+"""
+
+import argparse
+import json
+import math
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from curry import cache
+from curry.ingest import DATASET_PATH
+
+DEFAULT_CUTOFF = '2100-01-01'
+DEFAULT_TRAFFIC = ['Low', 'Medium', 'High', 'Jam']
+
+# Values accepted for the parameters of the metrics ( the columns and groupings the pages ask for,
+# answered by every data mode ); the first one is the default:
+FESTIVALS = ['Yes', 'No']
+MEAN_STD = ['mean', 'std']
+MAX_MIN = ['max', 'min']
+RATING_COLUMNS = ['Road_traffic_density', 'Weatherconditions']
+TIME_GROUPS = ['City', 'City,Type_of_order', 'City,Road_traffic_density']
+EXTREME_COLUMNS = ['Delivery_person_Age', 'Vehicle_condition']
+
+
+def choice ( params, name, allowed, required=False ):
+    """ This function returns a query parameter, checked against the accepted values
+
+        Input: dict of query parameters, name of the parameter, list of accepted values ( the first
+               is the default ) and whether the parameter must be given
+        Output: str
+    """
+    if required and name not in params:
+        raise KeyError( name )
+    value = params.get( name, allowed[0] )
+    if value not in allowed:
+        raise ValueError( 'invalid {}: {!r}, expected one of {}'.format( name, value, ', '.join( allowed ) ) )
+
+    return value
+
+
+def count ( params, name='n', default=10 ):
+    """ This function returns a positive integer query parameter """
+    value = params.get( name, str( default ) )
+    if not value.isdigit() or int( value ) < 1:
+        raise ValueError( 'invalid {}: {!r}, expected an integer of at least 1'.format( name, value ) )
+
+    return int( value )
+
+
+# Metric -> function of (metrics, query parameters):
+METRICS = {
+    'orders_by_day': lambda m, q: m.orders_by_day(),
+    'orders_by_traffic': lambda m, q: m.orders_by_traffic(),
+    'orders_by_city_traffic': lambda m, q: m.orders_by_city_traffic(),
+    'orders_by_week': lambda m, q: m.orders_by_week(),
+    'orders_per_courier_by_week': lambda m, q: m.orders_per_courier_by_week(),
+    'top_couriers': lambda m, q: dict( zip( ['fastest', 'slowest'], m.top_couriers( count( q ) ) ) ),
+    'festival_time': lambda m, q: m.festival_time( choice( q, 'festival', FESTIVALS ), choice( q, 'operation', MEAN_STD ) ),
+    'courier_ratings': lambda m, q: m.courier_ratings(),
+    'ratings': lambda m, q: m.ratings( choice( q, 'col', RATING_COLUMNS ) ).reset_index(),
+    'time_by': lambda m, q: m.time_by( choice( q, 'group', TIME_GROUPS ).split( ',' ) ),
+    'extreme': lambda m, q: m.extreme( choice( q, 'col', EXTREME_COLUMNS, required=True ), choice( q, 'operation', MAX_MIN ) ),
+    'courier_count': lambda m, q: m.courier_count(),
+    'avg_distance': lambda m, q: m.avg_distance(),
+    'distance_by_city': lambda m, q: m.distance_by_city(),
+    'location_medians': lambda m, q: m.location_medians(),
+    'delivery_grid': lambda m, q: m.delivery_grid(),
+}
+
+
+def to_json ( value ):
+    """ This function converts a metric ( DataFrame, dict of them or number ) to JSON compatible values """
+    if isinstance( value, pd.DataFrame ):
+        if isinstance( value.columns, pd.MultiIndex ):
+            value = value.copy()
+            value.columns = ['_'.join( str( c ) for c in col if c != '' ) for col in value.columns]
+        return json.loads( value.to_json( orient='records', date_format='iso' ) )
+    if isinstance( value, dict ):
+        return {key: to_json( v ) for key, v in value.items()}
+    if isinstance( value, (np.integer, np.floating) ):
+        value = value.item()
+    if isinstance( value, float ) and not math.isfinite( value ):
+        return None
+
+    return value
+
+
+def query ( name, params, path=DATASET_PATH ):
+    """ This function answers a metric for the given query parameters
+
+        Input: name of the metric, dict of query parameters and path of the source csv
+        Output: dict ready to be serialized
+    """
+    if name not in METRICS:
+        raise KeyError( name )
+
+    cutoff = params.get( 'cutoff', DEFAULT_CUTOFF )
+    traffic = params['traffic'].split( ',' ) if params.get( 'traffic' ) else DEFAULT_TRAFFIC
+    unknown = [value for value in traffic if value not in DEFAULT_TRAFFIC]
+    if unknown:
+        raise ValueError( 'invalid traffic: {}, expected some of {}'.format( ','.join( unknown ), ', '.join( DEFAULT_TRAFFIC ) ) )
+    start = time.perf_counter()
+    metrics = cache.get_metrics( pd.Timestamp( cutoff ), traffic, path )
+    data = to_json( METRICS[name]( metrics, params ) )
+
+    return {'metric': name, 'cutoff': cutoff, 'traffic': traffic, 'data': data,
+            'elapsed_ms': round( (time.perf_counter() - start) * 1000, 3 )}
+
+
+class Handler ( BaseHTTPRequestHandler ):
+    """ Answers GET /health, GET /metrics and GET /metrics/<name>?<parameters> """
+
+    source = DATASET_PATH
+
+    def do_GET ( self ):
+        url = urlparse( self.path )
+        params = {key: values[-1] for key, values in parse_qs( url.query ).items()}
+        parts = [p for p in url.path.split( '/' ) if p]
+
+        if parts == ['health']:
+            return self.reply( 200, {'status': 'ok', 'dataset_version': list( cache.dataset_version( self.source ) )} )
+        if parts == ['metrics']:
+            return self.reply( 200, {'metrics': sorted( METRICS )} )
+        if len( parts ) == 2 and parts[0] == 'metrics':
+            try:
+                return self.reply( 200, query( parts[1], params, self.source ) )
+            except KeyError as error:
+                if parts[1] not in METRICS:
+                    return self.reply( 404, {'error': 'unknown metric: {}'.format( parts[1] )} )
+                return self.reply( 400, {'error': 'missing or unknown parameter: {}'.format( error )} )
+            except (ValueError, TypeError) as error:
+                return self.reply( 400, {'error': str( error )} )
+            except Exception as error:
+                # Qualquer outra falha do backend ( ex.: sqlite3.Error ) ainda responde JSON
+                return self.reply( 500, {'error': '{}: {}'.format( type( error ).__name__, error )} )
+
+        return self.reply( 404, {'error': 'not found: {}'.format( url.path )} )
+
+    def reply ( self, status, body ):
+        payload = json.dumps( body ).encode()
+        self.send_response( status )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str( len( payload ) ) )
+        self.end_headers()
+        self.wfile.write( payload )
+
+    def log_message ( self, format, *args ):
+        pass
+
+
+def serve ( source=DATASET_PATH, host='127.0.0.1', port=8765 ):
+    """ This function loads the dataset and serves the metrics until interrupted
+
+        Input: path of the source csv, host and port
+    """
+    start = time.perf_counter()
+    cache.get_metrics( pd.Timestamp( DEFAULT_CUTOFF ), DEFAULT_TRAFFIC, source )
+    print( 'dataset loaded in {:.2f}s, serving on http://{}:{}'.format( time.perf_counter() - start, host, port ), flush=True )
+
+    handler = type( 'SourceHandler', (Handler,), {'source': source} )
+    server = ThreadingHTTPServer( (host, port), handler )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Serve the dashboard metrics as JSON.' )
+    parser.add_argument( '--source', default=DATASET_PATH, help='source csv file' )
+    parser.add_argument( '--host', default='127.0.0.1', help='address to listen on' )
+    parser.add_argument( '--port', type=int, default=8765, help='port to listen on' )
+    args = parser.parse_args( argv )
+
+    serve( args.source, args.host, args.port )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+""" Shared mode: one memory mapped copy of the cleaned dataset for every server process.
+
+    Several streamlit servers on one host each keep their own copy of the
+    cleaned frame. With CURRY_DATA_MODE=shared the dataset is instead
+    published once, next to the snapshot of curry.store, as a folder of raw
+    column files:
+
+    - one 2D .npy array per numeric dtype, laid out like the blocks of pandas;
+    - the codes of every categorical as .npy, with its categories in layout.json;
+    - the text columns as Arrow IPC files.
+
+    Every process memory maps those files read only and assembles the frame
+    around them without copying ( the same block construction pyarrow uses ):
+    the pages of the dataset live once in the page cache of the host, and the
+    resident memory of each process grows only with its sessions. The blocks
+    are already consolidated, so pandas never merges them into private copies.
+
+    Each publication is a new version folder; the CURRENT file names the live
+    one and is replaced atomically, so a process sees either the old or the
+    new version, never half of one. Processes holding the old version keep
+    their mapping until their next rerun attaches the new one. The first
+    process that finds the published version older than the snapshot
+    publishes it again, under a file lock; it can also be published ahead:
+
+        python -m curry.shared --source ftc_train.csv [--append orders_2022-06-05.csv]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from curry import store
+from curry.ingest import CLEAN_VERSION, DATASET_PATH
+from curry.schema import assemble_frame
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - pyarrow comes with streamlit
+    pa = None
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no file locks outside POSIX: concurrent publications are still atomic
+    fcntl = None
+
+# Version of the file layout; bump it whenever it changes, so old publications are replaced:
+SHARED_VERSION = 1
+
+SHARED_FOLDER = 'shared'
+CURRENT_FILE = 'CURRENT'
+LAYOUT_FILE = 'layout.json'
+LOCK_FILE = 'publish.lock'
+
+
+def shared_dir ( source, root=store.SNAPSHOT_DIR ):
+    """ Folder of the published versions of a given source file """
+    return os.path.join( store.snapshot_dir( source, root ), SHARED_FOLDER )
+
+
+def version_of ( manifest ):
+    """ This function names the version of the dataset described by a snapshot manifest
+
+        Input: manifest of curry.store
+        Output: str
+    """
+    key = json.dumps( [SHARED_VERSION, CLEAN_VERSION, manifest['source'], manifest['parts']], sort_keys=True )
+
+    return 'v-' + hashlib.sha1( key.encode() ).hexdigest()[:12]
+
+
+def current_version ( source, root=store.SNAPSHOT_DIR ):
+    """ This function returns the published version of a source file, None if nothing is published """
+    try:
+        with open( os.path.join( shared_dir( source, root ), CURRENT_FILE ) ) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_frame ( df, folder ):
+    """ This function writes a DataFrame as memory mappable column files
+
+        Input: cleaned DataFrame ( compact schema of curry.schema ) and an empty folder
+    """
+    layout = {'rows': len( df ), 'columns': list( df.columns ), 'blocks': [], 'categoricals': [], 'strings': []}
+
+    numeric = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance( dtype, pd.CategoricalDtype ):
+            part = 'codes-{}.npy'.format( len( layout['categoricals'] ) )
+            np.save( os.path.join( folder, part ), df[col].cat.codes.to_numpy() )
+            layout['categoricals'].append( {'file': part, 'column': col, 'categories': df[col].cat.categories.tolist()} )
+        elif dtype == object:
+            part = 'strings-{}.arrow'.format( len( layout['strings'] ) )
+            table = pa.table( {col: pa.array( df[col].to_numpy(), type=pa.string() )} )
+            with pa.OSFile( os.path.join( folder, part ), 'wb' ) as f:
+                with pa.ipc.new_file( f, table.schema ) as writer:
+                    writer.write_table( table )
+            layout['strings'].append( {'file': part, 'column': col} )
+        else:
+            numeric.setdefault( str( dtype ), [] ).append( col )
+
+    # One 2D array per dtype, one row per column: the layout of a consolidated pandas block
+    for i, columns in enumerate( numeric.values() ):
+        part = 'block-{}.npy'.format( i )
+        np.save( os.path.join( folder, part ), np.stack( [df[col].to_numpy() for col in columns] ) )
+        layout['blocks'].append( {'file': part, 'columns': columns} )
+
+    with open( os.path.join( folder, LAYOUT_FILE ), 'w' ) as f:
+        json.dump( layout, f, indent=2 )
+
+
+def read_frame ( folder ):
+    """ This function memory maps the column files of write_frame() into a DataFrame, without copying them
+
+        Input: folder of a published version
+        Output: read only DataFrame
+    """
+    with open( os.path.join( folder, LAYOUT_FILE ) ) as f:
+        layout = json.load( f )
+
+    blocks = []
+    for block in layout['blocks']:
+        values = np.asarray( np.load( os.path.join( folder, block['file'] ), mmap_mode='r' ) )
+        blocks.append( (values, block['columns']) )
+    arrays = {}
+    for categorical in layout['categoricals']:
+        codes = np.asarray( np.load( os.path.join( folder, categorical['file'] ), mmap_mode='r' ) )
+        arrays[categorical['column']] = pd.Categorical.from_codes( codes, categorical['categories'] )
+    for strings in layout['strings']:
+        table = pa.ipc.open_file( pa.memory_map( os.path.join( folder, strings['file'] ) ) ).read_all()
+        arrays[strings['column']] = pd.arrays.ArrowStringArray( table.column( strings['column'] ) )
+
+    # Os blocos ficam consolidados, como no arquivo ( curry.schema.assemble_frame )
+    return assemble_frame( blocks, arrays, layout['columns'], pd.RangeIndex( layout['rows'] ) )
+
+
+class _PublishLock:
+    """ Exclusive lock of the publications of one source file, across processes """
+
+    def __init__ ( self, folder ):
+        os.makedirs( folder, exist_ok=True )
+        self.path = os.path.join( folder, LOCK_FILE )
+
+    def __enter__ ( self ):
+        self.file = open( self.path, 'w' )
+        if fcntl is not None:
+            fcntl.flock( self.file, fcntl.LOCK_EX )
+        return self
+
+    def __exit__ ( self, *exc ):
+        if fcntl is not None:
+            fcntl.flock( self.file, fcntl.LOCK_UN )
+        self.file.close()
+
+
+def publish ( source=DATASET_PATH, root=store.SNAPSHOT_DIR, force=False ):
+    """ This function publishes the current snapshot of a source file as the live shared version
+
+        The snapshot is rebuilt first if it is out of date. The new version is
+        written to a temporary folder, renamed, and then named in CURRENT with
+        an atomic replace; the versions before the previous one are removed
+        ( the processes still mapping them keep their pages until they let go ).
+
+        Input: path of the source csv, snapshot folder and force flag ( publish even if up to date )
+        Output: name of the live version
+    """
+    folder = shared_dir( source, root )
+
+    with _PublishLock( folder ):
+        store.rebuild( source, root )
+        manifest = store.read_manifest( source, root )
+        version = version_of( manifest )
+        previous = current_version( source, root )
+        if previous == version and not force:
+            return version
+
+        target = os.path.join( folder, version )
+        tmp = '{}.tmp-{}'.format( target, os.getpid() )
+        shutil.rmtree( tmp, ignore_errors=True )
+        os.makedirs( tmp )
+        write_frame( store.read_parts( source, manifest['parts'], root ), tmp )
+        shutil.rmtree( target, ignore_errors=True )
+        os.rename( tmp, target )
+
+        pointer = os.path.join( folder, CURRENT_FILE )
+        with open( pointer + '.tmp', 'w' ) as f:
+            f.write( version + '\n' )
+        os.replace( pointer + '.tmp', pointer )
+
+        for name in os.listdir( folder ):
+            if name not in (version, previous, CURRENT_FILE, LOCK_FILE):
+                path = os.path.join( folder, name )
+                if os.path.isdir( path ):
+                    shutil.rmtree( path, ignore_errors=True )
+
+    return version
+
+
+def live_version ( source=DATASET_PATH, root=store.SNAPSHOT_DIR ):
+    """ This function returns the live version of a source file, publishing it first if it is missing or out of date
+
+        Input: path of the source csv and snapshot folder
+        Output: name of the version
+    """
+    manifest = store.read_manifest( source, root )
+    version = current_version( source, root )
+    if version is None or not store.is_fresh( manifest, source ) or version_of( manifest ) != version:
+        version = publish( source, root )
+
+    return version
+
+
+def attach ( source=DATASET_PATH, version=None, root=store.SNAPSHOT_DIR ):
+    """ This function maps a published version of the dataset into this process
+
+        Input: path of the source csv, version ( None: the live one ) and snapshot folder
+        Output: read only DataFrame backed by the shared files
+    """
+    version = version or live_version( source, root )
+    try:
+        return read_frame( os.path.join( shared_dir( source, root ), version ) )
+    except FileNotFoundError:
+        # Removed by two publications in a row since CURRENT was read: map the live one
+        return read_frame( os.path.join( shared_dir( source, root ), live_version( source, root ) ) )
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Publish the cleaned dataset as memory mapped files shared by the server processes.' )
+    parser.add_argument( '--source', default=DATASET_PATH, help='source csv file' )
+    parser.add_argument( '--root', default=store.SNAPSHOT_DIR, help='snapshot folder' )
+    parser.add_argument( '--append', nargs='+', default=[], metavar='DAILY_CSV', help='daily order files to append first' )
+    parser.add_argument( '--force', action='store_true', help='publish even if the live version is up to date' )
+    args = parser.parse_args( argv )
+
+    for daily in args.append:
+        df = store.append( daily, args.source, args.root )
+        print( 'appended {:,} new orders from {}'.format( len( df ), daily ) )
+
+    start = time.perf_counter()
+    version = publish( args.source, args.root, force=args.force )
+    folder = os.path.join( shared_dir( args.source, args.root ), version )
+    size = sum( os.path.getsize( os.path.join( folder, name ) ) for name in os.listdir( folder ) )
+    print( 'live version {} in {:.2f}s ( {:.1f} MB in {} )'.format( version, time.perf_counter() - start, size / 2**20, folder ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+""" Mergeable sketches for aggregates that are too big to keep exact.
+
+    HyperLogLog counts distinct values: every value is hashed to 64 bits, the
+    first p bits choose one of 2**p registers and the register keeps the
+    longest run of leading zeros seen in the other bits. Two sketches merge
+    with the element-wise maximum of their registers. The relative standard
+    error of the count is about 1.04 / sqrt( 2**p ), whatever the number of
+    values.
+
+    QuantileSketch keeps a bounded sample of a stream of numbers, organised in
+    levels of compactors ( in the spirit of the KLL sketch ): when a level holds
+    more than k items they are sorted and every other one is promoted to the
+    next level with twice the weight. Two sketches merge level by level, so
+    sketches of chunks or of days can be combined in any order.
+
+    The rank error shrinks with k: about 1/k per level of compaction.
+
+    precision_for_error() and k_for_error() size both sketches from an error
+    bound ( see CURRY_DISTINCT_ERROR and CURRY_QUANTILE_ERROR in curry.config ).
+"""
+
+import numpy as np
+import pandas as pd
+
+# Default number of items per level:
+DEFAULT_K = 256
+
+# Default number of index bits of the distinct counters ( 2**14 registers, 1 byte each ):
+DEFAULT_P = 14
+
+
+def precision_for_error ( error ):
+    """ This function returns the number of index bits of a HyperLogLog with the given relative standard error
+
+        Input: relative standard error, e.g. 0.01
+        Output: int between 4 and 18
+    """
+    return int( min( 18, max( 4, np.ceil( 2 * np.log2( 1.04 / error ) ) ) ) )
+
+
+def k_for_error ( error ):
+    """ This function returns the items per level of a QuantileSketch with about the given rank error
+
+        Input: rank error, as a fraction of the number of values, e.g. 0.01
+        Output: int
+    """
+    return int( max( 8, np.ceil( 2 / error ) ) )
+
+
+def _leading_zeros ( words ):
+    # Bit length of each half with frexp, exact for 32 bit integers
+    _, high = np.frexp( (words >> np.uint64( 32 )).astype( np.float64 ) )
+    _, low = np.frexp( (words & np.uint64( 0xFFFFFFFF )).astype( np.float64 ) )
+
+    return np.where( high > 0, 32 - high, 64 - low )
+
+
+class HyperLogLog:
+    """ Approximate number of distinct values of a stream, mergeable """
+
+    def __init__ ( self, p=DEFAULT_P ):
+        self.p = p
+        self.registers = np.zeros( 2 ** p, dtype=np.uint8 )
+
+    def update ( self, values ):
+        """ This function adds an array of values to the sketch ( NaNs are ignored ) """
+        values = pd.Series( values ).dropna()
+        if values.empty:
+            return self
+        hashes = pd.util.hash_array( values.astype( str ).to_numpy( dtype=object ) )
+        index = (hashes >> np.uint64( 64 - self.p )).astype( np.int64 )
+        rank = np.minimum( _leading_zeros( hashes << np.uint64( self.p ) ) + 1, 64 - self.p + 1 ).astype( np.uint8 )
+        np.maximum.at( self.registers, index, rank )
+
+        return self
+
+    def merge ( self, other ):
+        """ This function adds the content of another sketch ( of the same precision ) to this one """
+        np.maximum( self.registers, other.registers, out=self.registers )
+
+        return self
+
+    def count ( self ):
+        """ This function returns the approximate number of distinct values """
+        m = len( self.registers )
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum( np.ldexp( 1.0, -self.registers.astype( np.int64 ) ) )
+        zeros = np.count_nonzero( self.registers == 0 )
+        # Small counts: linear counting of the empty registers is more precise
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log( m / zeros )
+
+        return estimate
+
+    def error ( self ):
+        """ Relative standard error of count() """
+        return 1.04 / np.sqrt( len( self.registers ) )
+
+
+class QuantileSketch:
+    """ Approximate quantiles of a stream of numbers, mergeable """
+
+    def __init__ ( self, k=DEFAULT_K ):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty( 0 )]
+        self._offset = 0
+
+    def update ( self, values ):
+        """ This function adds an array of values to the sketch ( NaNs are ignored ) """
+        values = np.asarray( values, dtype=np.float64 )
+        values = values[~np.isnan( values )]
+        self.levels[0] = np.concatenate( [self.levels[0], values] )
+        self.n += len( values )
+        self._compress()
+
+        return self
+
+    def merge ( self, other ):
+        """ This function adds the content of another sketch to this one """
+        for h, items in enumerate( other.levels ):
+            if h == len( self.levels ):
+                self.levels.append( np.empty( 0 ) )
+            self.levels[h] = np.concatenate( [self.levels[h], items] )
+        self.n += other.n
+        self._compress()
+
+        return self
+
+    def _compress ( self ):
+        h = 0
+        while h < len( self.levels ):
+            items = self.levels[h]
+            if len( items ) > self.k:
+                items = np.sort( items )
+                kept = items[len( items ) - len( items ) % 2:]
+                # Alternating the offset keeps the compaction unbiased over time
+                promoted = items[self._offset:len( items ) - len( kept ):2]
+                self._offset ^= 1
+                self.levels[h] = kept
+                if h + 1 == len( self.levels ):
+                    self.levels.append( np.empty( 0 ) )
+                self.levels[h + 1] = np.concatenate( [self.levels[h + 1], promoted] )
+            h += 1
+
+    def quantile ( self, q ):
+        """ This function returns the approximate q-quantile ( 0 <= q <= 1 ), NaN if the sketch is empty """
+        if self.n == 0:
+            return np.nan
+        values = np.concatenate( self.levels )
+        weights = np.concatenate( [np.full( len( items ), 2.0 ** h ) for h, items in enumerate( self.levels )] )
+        order = np.argsort( values, kind='stable' )
+        cumulative = np.cumsum( weights[order] )
+        position = np.searchsorted( cumulative, q * cumulative[-1], side='left' )
+
+        return values[order][min( position, len( values ) - 1 )]
+
+    def median ( self ):
+        return self.quantile( 0.5 )
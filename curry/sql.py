@@ -0,0 +1,473 @@
+""" SQLite backend: the metrics of the pages computed by an embedded database.
+
+    The cleaned snapshot of the source ( curry.store ) is copied, batch by
+    batch, into an on-disk SQLite database next to it. The orders are stored
+    clustered by traffic condition and order date ( the primary key of a
+    WITHOUT ROWID table ), so the date and traffic filters of the sidebar are
+    range scans over contiguous rows. SqlMetrics expresses every table of the
+    pages as a SQL query with those filters in the WHERE clause: no filtered
+    copy of the rows is made and the memory of the pages does not grow with
+    the history.
+
+    Daily files appended to the snapshot are inserted into the database
+    without copying the older parts again. The pages of a process share one
+    read-only connection to it ( see connection ).
+
+    Select it with CURRY_DATA_MODE=sql ( see curry.config ). Build the database
+    and check that it answers the same tables as pandas from the terminal:
+
+        python -m curry.sql --source ftc_train.csv [--force] [--compare]
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+import numpy as np
+import pandas as pd
+
+from curry import store
+from curry.geo import grid_cells
+from curry.ingest import DATASET_PATH
+from curry.instrument import scan
+from curry.metrics import PARTIALS, Metrics
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow comes with streamlit
+    pq = None
+
+# Version of the table layout; bump it whenever the columns change, so old databases are rebuilt:
+SQL_VERSION = 1
+
+DATABASE_FILE = 'orders.sqlite'
+
+# Rows read from the snapshot and inserted at a time:
+BATCH_ROWS = 100000
+
+TIME = '"Time_taken(min)"'
+
+CREATE_ORDERS = """
+CREATE TABLE orders (
+    row INTEGER,
+    ID TEXT,
+    Delivery_person_ID TEXT,
+    Delivery_person_Age INTEGER,
+    Delivery_person_Ratings REAL,
+    Delivery_location_latitude REAL,
+    Delivery_location_longitude REAL,
+    Order_Date TEXT,
+    week_of_year TEXT,
+    Road_traffic_density TEXT,
+    Type_of_order TEXT,
+    Vehicle_condition INTEGER,
+    Festival TEXT,
+    City TEXT,
+    Weatherconditions TEXT,
+    "Time_taken(min)" INTEGER,
+    distance REAL,
+    geo_cell INTEGER,
+    PRIMARY KEY (Road_traffic_density, Order_Date, row)
+) WITHOUT ROWID"""
+
+SNAPSHOT_COLUMNS = ['ID', 'Delivery_person_ID', 'Delivery_person_Age', 'Delivery_person_Ratings',
+                    'Delivery_location_latitude', 'Delivery_location_longitude', 'Order_Date',
+                    'Road_traffic_density', 'Type_of_order', 'Vehicle_condition', 'Festival', 'City',
+                    'Weatherconditions', 'Time_taken(min)', 'distance']
+
+
+def database_path ( source, root=store.SNAPSHOT_DIR ):
+    """ Path of the SQLite database of a given source file """
+    return os.path.join( store.snapshot_dir( source, root ), DATABASE_FILE )
+
+
+def _read_meta ( path ):
+    if not os.path.exists( path ):
+        return None
+    try:
+        with sqlite3.connect( path ) as con:
+            row = con.execute( "SELECT value FROM meta WHERE key = 'manifest'" ).fetchone()
+    except sqlite3.Error:
+        return None
+
+    return json.loads( row[0] ) if row else None
+
+
+def to_rows ( df, start=0 ):
+    """ This function converts a batch of the cleaned snapshot to the columns of the orders table
+
+        Input: DataFrame with the SNAPSHOT_COLUMNS and number of the first row
+        Output: DataFrame with plain text dates, the week of the year and the grid cell, in key order
+    """
+    df = df.loc[: , SNAPSHOT_COLUMNS].copy()
+    df.insert( 0, 'row', np.arange( start, start + len( df ), dtype=np.int64 ) )
+    for col in df.columns:
+        if isinstance( df[col].dtype, pd.CategoricalDtype ):
+            df[col] = df[col].astype( object )
+
+    dates = pd.to_datetime( df['Order_Date'] )
+    df['Order_Date'] = dates.dt.strftime( '%Y-%m-%d' )
+    df['week_of_year'] = dates.dt.strftime( '%U' )
+    df['geo_cell'] = grid_cells( df['Delivery_location_latitude'].to_numpy(), df['Delivery_location_longitude'].to_numpy() )
+
+    return df.sort_values( ['Road_traffic_density', 'Order_Date', 'row'] )
+
+
+def _insert_part ( con, source, part, root, start ):
+    parquet = pq.ParquetFile( os.path.join( store.snapshot_dir( source, root ), part ) )
+    for batch in parquet.iter_batches( batch_size=BATCH_ROWS, columns=SNAPSHOT_COLUMNS ):
+        df = to_rows( batch.to_pandas(), start )
+        df.to_sql( 'orders', con, if_exists='append', index=False )
+        start += len( df )
+
+    return start
+
+
+def build_database ( source=DATASET_PATH, root=store.SNAPSHOT_DIR, force=False ):
+    """ This function creates or updates the SQLite database of a source file
+
+        The snapshot is rebuilt first if it is out of date. A database built
+        from an older snapshot is written again from scratch ( into a new file,
+        swapped in when complete ); parts appended to the same snapshot are
+        only inserted.
+
+        Input: path of the source csv, snapshot folder and force flag
+        Output: path of the database
+    """
+    if pq is None:
+        raise ImportError( 'pyarrow is required to read the dataset snapshot' )
+
+    store.rebuild( source, root )
+    manifest = store.read_manifest( source, root )
+    key = {'sql_version': SQL_VERSION, 'clean_version': manifest['version'], 'source': manifest['source']}
+
+    path = database_path( source, root )
+    built = None if force else _read_meta( path )
+    if built is None or built['key'] != key or manifest['parts'][:len( built['parts'] )] != built['parts']:
+        target = path + '.tmp'
+        if os.path.exists( target ):
+            os.remove( target )
+        con = sqlite3.connect( target )
+        con.execute( CREATE_ORDERS )
+        con.execute( 'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)' )
+        done, rows = [], 0
+    else:
+        target = path
+        con = sqlite3.connect( target )
+        done, rows = built['parts'], built['rows']
+
+    with con:
+        for part in manifest['parts'][len( done ):]:
+            rows = _insert_part( con, source, part, root, rows )
+        con.execute( 'INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                     ('manifest', json.dumps( {'key': key, 'parts': manifest['parts'], 'rows': rows} )) )
+    con.close()
+
+    if target != path:
+        os.replace( target, path )
+
+    return path
+
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def connection ( database ):
+    """ This function returns the read-only connection of this process to a database
+
+        The connection is opened once per database file and shared by every
+        session, with a lock around each query. A database swapped in by
+        build_database ( a new file ) gets a new connection; the old one is
+        closed when the last metrics that use it are released.
+
+        Input: path of the database
+        Output: connection and its lock
+    """
+    path = os.path.abspath( database )
+    inode = os.stat( path ).st_ino
+    with _connections_lock:
+        cached = _connections.get( path )
+        if cached is None or cached[0] != inode:
+            con = sqlite3.connect( 'file:{}?mode=ro'.format( pathname2url( path ) ), uri=True, check_same_thread=False )
+            cached = _connections[path] = (inode, con, threading.Lock())
+
+    return cached[1], cached[2]
+
+
+class SqlMetrics ( Metrics ):
+    """ Metrics of the pages answered by SQL queries on the SQLite database
+
+        Counts, sums, means, deviations, medians, min and max are exact; the
+        markers of the map are the centres of the grid cells, as in stream mode.
+
+        Input: path of the database, cutoff date and selected traffic conditions
+    """
+
+    def __init__ ( self, database, cutoff, traffic ):
+        super().__init__( None )
+        self.con, self.lock = connection( database )
+        self.traffic = list( traffic )
+        self.where = 'Order_Date < ? AND Road_traffic_density IN ({})'.format( ', '.join( '?' * len( self.traffic ) ) )
+        self.params = [pd.Timestamp( cutoff ).strftime( '%Y-%m-%d' )] + self.traffic
+        # Results shared by several tables of a page ( each query is a scan of the selected rows ):
+        self.memo = {}
+
+    def query ( self, select, group=None ):
+        """ This function runs a SELECT on the selected orders, grouped and ordered by the given columns
+
+            Input: select list and list of grouping columns
+            Output: DataFrame
+        """
+        sql = 'SELECT {} FROM orders WHERE {}'.format( select, self.where )
+        if group:
+            keys = ', '.join( group )
+            sql += ' GROUP BY {0} ORDER BY {0}'.format( keys )
+        scan( 'sql {}'.format( '+'.join( group ) if group else 'total' ) )
+
+        with self.lock:
+            return pd.read_sql_query( sql, self.con, params=self.params )
+
+    def _value ( self, select ):
+        scan( 'sql total' )
+        with self.lock:
+            value = self.con.execute( 'SELECT {} FROM orders WHERE {}'.format( select, self.where ), self.params ).fetchone()[0]
+
+        return np.nan if value is None else value
+
+    def _mean_std ( self, col, group ):
+        key = (col,) + tuple( group )
+        if key not in self.memo:
+            self.memo[key] = self._compute_mean_std( col, group )
+
+        return self.memo[key]
+
+    def _compute_mean_std ( self, col, group ):
+        # SQLite has no standard deviation: it comes from the count, the sum and the sum of squares
+        df = self.query( ', '.join( group + ['COUNT({0}) AS n', 'SUM({0}) AS s', 'SUM({0} * {0}) AS ss'] ).format( col ), group )
+        n = df['n'].astype( np.float64 )
+        mean = df['s'] / n
+        var = ((df['ss'] - df['s'] * mean) / (n - 1)).where( n > 1 ).clip( lower=0 )
+
+        return df.loc[: , group], mean, np.sqrt( var )
+
+    def rows ( self ):
+        # Asked by every instrumented call ( curry.instrument ): counted once
+        if 'rows' not in self.memo:
+            self.memo['rows'] = int( self._value( 'COUNT(*)' ) )
+
+        return self.memo['rows']
+
+    def orders_by_day ( self ):
+        df = self.query( 'Order_Date, COUNT(ID) AS ID', ['Order_Date'] )
+        df['Order_Date'] = pd.to_datetime( df['Order_Date'] )
+
+        return df
+
+    def orders_by_traffic ( self ):
+        df = self.query( 'Road_traffic_density, COUNT(ID) AS ID', ['Road_traffic_density'] )
+        df['perc_entrega'] = df['ID'] / df['ID'].sum()
+
+        return df
+
+    def orders_by_city_traffic ( self ):
+        return self.query( 'City, Road_traffic_density, COUNT(ID) AS ID', ['City', 'Road_traffic_density'] )
+
+    def orders_by_week ( self ):
+        return self.query( 'week_of_year, COUNT(ID) AS ID', ['week_of_year'] )
+
+    def orders_per_courier_by_week ( self ):
+        df = self.query( 'week_of_year, COUNT(ID) AS ID, COUNT(DISTINCT Delivery_person_ID) AS Delivery_person_ID',
+                         ['week_of_year'] )
+        df['Orders_by_deliver'] = df['ID'] / df['Delivery_person_ID']
+
+        return df
+
+    def location_medians ( self ):
+        keys = ['City', 'Road_traffic_density']
+        columns = ['Delivery_location_latitude', 'Delivery_location_longitude']
+        df = self.query( ', '.join( keys + ['COUNT({0}) AS {0}'.format( col ) for col in columns] ), keys )
+
+        # The median is the middle value ( or the mean of the two middle ones ) of each group, sorted by SQLite
+        scan( 'sql medians' )
+        sql = ('SELECT {0} FROM orders WHERE Road_traffic_density = ? AND Order_Date < ? AND City = ? AND {0} IS NOT NULL'
+               ' ORDER BY {0} LIMIT ? OFFSET ?')
+        for col in columns:
+            medians = []
+            for city, traffic, n in df.loc[: , keys + [col]].itertuples( index=False ):
+                with self.lock:
+                    values = self.con.execute( sql.format( col ), (traffic, self.params[0], city, 2 - n % 2, (n - 1) // 2) ).fetchall()
+                medians.append( np.mean( [value for value, in values] ) if values else np.nan )
+            df[col] = medians
+
+        return df
+
+    def courier_ratings ( self ):
+        return self.query( 'Delivery_person_ID, AVG(Delivery_person_Ratings) AS Delivery_person_Ratings', ['Delivery_person_ID'] )
+
+    def ratings ( self, col ):
+        keys, mean, std = self._mean_std( 'Delivery_person_Ratings', [col] )
+        df = pd.DataFrame( {('Delivery_person_Ratings', 'mean'): mean, ('Delivery_person_Ratings', 'std'): std} )
+        df.index = pd.Index( keys[col], name=col )
+
+        return df
+
+    def time_by ( self, group ):
+        group = list( np.atleast_1d( group ) )
+        keys, mean, std = self._mean_std( TIME, group )
+
+        return keys.assign( avg_time=mean, std_time=std )
+
+    def festival_time ( self, festival, operation ):
+        keys, mean, std = self._mean_std( TIME, ['Festival'] )
+        values = (mean if operation == 'mean' else std)[keys['Festival'] == festival]
+
+        return np.round( values.iloc[0] if len( values ) else np.nan, 2 )
+
+    def courier_time ( self ):
+        return self.query( 'City, Delivery_person_ID, AVG({0}) AS {0}'.format( TIME ), ['City', 'Delivery_person_ID'] )
+
+    def _cell_totals ( self ):
+        df = self.query( 'geo_cell, COUNT(*) AS n, SUM({}) AS s'.format( TIME ), ['geo_cell'] )
+
+        return df['geo_cell'].to_numpy( np.int64 ), df['n'].to_numpy(), df['s'].to_numpy( np.float64 )
+
+    def extreme ( self, col, operation ):
+        if col not in self.memo:
+            scan( 'sql total' )
+            with self.lock:
+                row = self.con.execute( 'SELECT MAX({0}), MIN({0}) FROM orders WHERE {1}'.format( col, self.where ), self.params ).fetchone()
+            self.memo[col] = dict( zip( ['max', 'min'], [np.nan if value is None else value for value in row] ) )
+
+        return self.memo[col][operation]
+
+    def courier_count ( self ):
+        return int( self._value( 'COUNT(DISTINCT Delivery_person_ID)' ) )
+
+    def avg_distance ( self ):
+        return np.round( self._value( 'AVG(distance)' ), 2 )
+
+    def distance_by_city ( self ):
+        return self.query( 'City, AVG(distance) AS distance', ['City'] )
+
+    def partials ( self, keys, values ):
+        keys = list( keys )
+        aggregates = ['COUNT("{0}")', 'SUM("{0}")', 'SUM(CAST("{0}" AS REAL) * "{0}")', 'MIN("{0}")', 'MAX("{0}")']
+        select = ['{} AS v{}_{}'.format( aggregate.format( col ), i, j )
+                  for i, col in enumerate( values ) for j, aggregate in enumerate( aggregates )]
+        df = self.query( ', '.join( keys + select ), keys )
+
+        table = pd.DataFrame( {(col, stat): df['v{}_{}'.format( i, j )] for i, col in enumerate( values ) for j, stat in enumerate( PARTIALS )} )
+        table.columns = pd.MultiIndex.from_tuples( table.columns )
+        if keys:
+            table.index = pd.MultiIndex.from_frame( df.loc[: , keys] ) if len( keys ) > 1 else pd.Index( df[keys[0]], name=keys[0] )
+
+        return table
+
+
+def same_tables ( a, b ):
+    """ This function checks that two results of the metrics hold the same values ( up to float rounding )
+
+        The order of the rows and of the columns does not matter: the pages read the columns by
+        name, and pandas lays out the columns of some empty tables in another order.
+    """
+    if isinstance( a, tuple ):
+        return all( same_tables( x, y ) for x, y in zip( a, b ) )
+    if not isinstance( a, pd.DataFrame ):
+        return (pd.isna( a ) and pd.isna( b )) or bool( np.isclose( a, b ) )
+
+    a = a.reset_index( drop=a.index.names == [None] )
+    b = b.reset_index( drop=b.index.names == [None] )
+    if sorted( map( str, a.columns ) ) != sorted( map( str, b.columns ) ) or len( a ) != len( b ):
+        return False
+    b = b.loc[: , list( a.columns )]
+    # pandas returns the groups of categorical columns in order of appearance, SQL sorted
+    keys = [col for col in a.columns if a[col].dtype.kind not in 'fiu']
+    if keys:
+        a = a.astype( {col: str for col in keys} ).sort_values( keys, ignore_index=True )
+        b = b.astype( {col: str for col in keys} ).sort_values( keys, ignore_index=True )
+    for col in a.columns:
+        x, y = a[col], b[col]
+        if x.dtype.kind in 'fiu' and y.dtype.kind in 'fiu':
+            if not np.allclose( x.to_numpy( np.float64 ), y.to_numpy( np.float64 ), equal_nan=True ):
+                return False
+        elif list( x.astype( str ) ) != list( y.astype( str ) ):
+            return False
+
+    return True
+
+
+# Tables of the pages compared by --compare ( the map markers are sampled differently on purpose ):
+CHECKS = {'rows': lambda m: m.rows(),
+          'orders_by_day': lambda m: m.orders_by_day(),
+          'orders_by_traffic': lambda m: m.orders_by_traffic(),
+          'orders_by_city_traffic': lambda m: m.orders_by_city_traffic(),
+          'orders_by_week': lambda m: m.orders_by_week(),
+          'orders_per_courier_by_week': lambda m: m.orders_per_courier_by_week(),
+          'location_medians': lambda m: m.location_medians(),
+          'delivery_grid': lambda m: m.delivery_grid(),
+          'courier_ratings': lambda m: m.courier_ratings(),
+          'ratings': lambda m: (m.ratings( 'Road_traffic_density' ), m.ratings( 'Weatherconditions' )),
+          'time_by': lambda m: (m.time_by( 'City' ), m.time_by( ['City', 'Type_of_order'] ),
+                                m.time_by( ['City', 'Road_traffic_density'] )),
+          'festival_time': lambda m: tuple( m.festival_time( f, op ) for f in ['Yes', 'No'] for op in ['mean', 'std'] ),
+          'courier_time': lambda m: m.courier_time(),
+          'extreme': lambda m: tuple( m.extreme( col, op ) for col in ['Delivery_person_Age', 'Vehicle_condition']
+                                      for op in ['max', 'min'] ),
+          'courier_count': lambda m: m.courier_count(),
+          'avg_distance': lambda m: m.avg_distance(),
+          'distance_by_city': lambda m: m.distance_by_city()}
+
+COMPARE_CUTOFFS = ['2022-02-13', '2022-03-10', '2022-04-06']
+COMPARE_TRAFFIC = [['Low'], ['High', 'Jam'], ['Low', 'Medium', 'High', 'Jam']]
+
+
+def compare ( source=DATASET_PATH, root=store.SNAPSHOT_DIR ):
+    """ This function compares every table of SqlMetrics with FrameMetrics ( pandas )
+
+        Input: path of the source csv and snapshot folder
+        Output: list of (table, cutoff, traffic) that differ
+    """
+    from curry.cache import frame_metrics
+
+    database = build_database( source, root )
+    different = []
+    for cutoff in COMPARE_CUTOFFS:
+        for traffic in COMPARE_TRAFFIC:
+            frame = frame_metrics( cutoff, traffic, source )
+            sql = SqlMetrics( database, cutoff, traffic )
+            for name, check in CHECKS.items():
+                if not same_tables( check( frame ), check( sql ) ):
+                    different.append( (name, cutoff, ','.join( traffic )) )
+
+    return different
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Build the SQLite database of the dataset and compare it with pandas.' )
+    parser.add_argument( '--source', default=DATASET_PATH, help='source csv file' )
+    parser.add_argument( '--root', default=store.SNAPSHOT_DIR, help='snapshot folder' )
+    parser.add_argument( '--force', action='store_true', help='write the database again from scratch' )
+    parser.add_argument( '--compare', action='store_true', help='check that every table matches the pandas metrics' )
+    args = parser.parse_args( argv )
+
+    start = time.perf_counter()
+    path = build_database( args.source, args.root, force=args.force )
+    print( '{} in {:.2f}s ( {:.1f} MB )'.format( path, time.perf_counter() - start, os.path.getsize( path ) / 2**20 ) )
+
+    if args.compare:
+        different = compare( args.source, args.root )
+        print( '{} tables x {} cutoffs x {} traffic selections compared, {} different'.format(
+            len( CHECKS ), len( COMPARE_CUTOFFS ), len( COMPARE_TRAFFIC ), len( different ) ) )
+        for name, cutoff, traffic in different:
+            print( '  {} ( cutoff {}, traffic {} )'.format( name, cutoff, traffic ) )
+        if different:
+            raise SystemExit( 1 )
+
+
+if __name__ == '__main__':
+    main()
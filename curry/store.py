@@ -0,0 +1,272 @@
+""" Columnar on-disk snapshot of the cleaned dataset.
+
+    The first load parses and cleans the csv and writes the result as Parquet
+    next to a small manifest with the fingerprint (size and mtime) of the
+    source file. The following loads memory map the Parquet file instead of
+    parsing the csv again, until the source file changes.
+
+    Daily order files are appended as new Parquet parts: only the new file is
+    cleaned, and orders whose ID is already stored are dropped, so a file
+    delivered twice is not counted twice. The appended files are listed in the
+    manifest and replayed when the snapshot of the source is rebuilt.
+
+    From the terminal:
+
+        python -m curry.store --source ftc_train.csv [--force] [--compare]
+        python -m curry.store --source ftc_train.csv --append orders_2022-06-05.csv
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from curry.ingest import CLEAN_VERSION, clean_code, read_clean
+from curry.schema import optimize
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow comes with streamlit
+    pa = None
+    pq = None
+
+# Folder where the snapshots are written, relative to the folder streamlit runs from:
+SNAPSHOT_DIR = '.curry_cache'
+MANIFEST_FILE = 'manifest.json'
+PART_FILE = 'part-{:05d}.parquet'
+
+
+def fingerprint ( path ):
+    """ This function returns the fingerprint of a source file: its size and modification time
+
+        Input: path of the file
+        Output: dict
+    """
+    stat = os.stat( path )
+
+    return {'path': os.path.abspath( path ), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def snapshot_dir ( source, root=SNAPSHOT_DIR ):
+    """ Folder of the snapshot of a given source file """
+    name = os.path.splitext( os.path.basename( source ) )[0]
+
+    return os.path.join( root, name )
+
+
+def read_manifest ( source, root=SNAPSHOT_DIR ):
+    """ This function reads the manifest of a snapshot, returning None if there is no snapshot """
+    path = os.path.join( snapshot_dir( source, root ), MANIFEST_FILE )
+    try:
+        with open( path ) as f:
+            return json.load( f )
+    except (OSError, ValueError):
+        return None
+
+
+def _replace ( path, write ):
+    """ This function writes a file atomically, through a temporary file of its own next to it
+
+        Every writer gets a unique temporary name, so two processes or sessions
+        writing the same file never write into, or rename, each other's half file.
+
+        Input: path of the file and function writing a given path
+    """
+    fd, tmp = tempfile.mkstemp( dir=os.path.dirname( path ), prefix=os.path.basename( path ) + '.', suffix='.tmp' )
+    os.close( fd )
+    try:
+        write( tmp )
+        # mkstemp cria o arquivo só para o dono: as permissões de um arquivo novo
+        os.chmod( tmp, 0o644 )
+        os.replace( tmp, path )
+    except BaseException:
+        if os.path.exists( tmp ):
+            os.remove( tmp )
+        raise
+
+
+def write_manifest ( manifest, source, root=SNAPSHOT_DIR ):
+    """ This function writes the manifest atomically, so readers never see half a file """
+    def write ( tmp ):
+        with open( tmp, 'w' ) as f:
+            json.dump( manifest, f, indent=2 )
+
+    _replace( os.path.join( snapshot_dir( source, root ), MANIFEST_FILE ), write )
+
+
+def is_fresh ( manifest, source ):
+    """ This function checks if the snapshot was built from the current version of the source and of clean_code() """
+    if manifest is None or manifest.get( 'version' ) != CLEAN_VERSION or 'source' not in manifest:
+        return False
+    current = fingerprint( source )
+    built = manifest['source']
+
+    return (built['path'] == current['path']
+            and built['size'] == current['size']
+            and built['mtime_ns'] == current['mtime_ns'])
+
+
+def read_parts ( source, parts, root=SNAPSHOT_DIR, columns=None ):
+    """ This function reads Parquet parts of a snapshot into one DataFrame
+
+        Each part has its own categories and integer widths, so several parts
+        are concatenated and converted to the compact schema again.
+
+        Input: path of the source csv, list of part files, snapshot folder and list of columns (None for all)
+        Output: DataFrame
+    """
+    folder = snapshot_dir( source, root )
+    frames = [pq.read_table( os.path.join( folder, part ), columns=columns, memory_map=True ).to_pandas()
+              for part in parts]
+    if len( frames ) == 1:
+        return frames[0]
+
+    return optimize( pd.concat( frames, ignore_index=True ) )
+
+
+def read_snapshot ( source, root=SNAPSHOT_DIR, columns=None ):
+    """ This function reads the snapshot of a source file, with the appended daily files
+
+        The Parquet parts are memory mapped and only the requested columns are read.
+
+        Input: path of the source csv, snapshot folder and list of columns (None for all)
+        Output: DataFrame, or None if the snapshot is missing or out of date
+    """
+    if pq is None:
+        return None
+    manifest = read_manifest( source, root )
+    if not is_fresh( manifest, source ):
+        return None
+
+    return read_parts( source, manifest['parts'], root, columns )
+
+
+def _write_part ( df, source, number, root=SNAPSHOT_DIR ):
+    folder = snapshot_dir( source, root )
+    os.makedirs( folder, exist_ok=True )
+
+    part = PART_FILE.format( number )
+    table = pa.Table.from_pandas( df, preserve_index=False )
+    _replace( os.path.join( folder, part ), lambda tmp: pq.write_table( table, tmp ) )
+
+    return part
+
+
+def write_snapshot ( df, source, root=SNAPSHOT_DIR ):
+    """ This function writes the cleaned DataFrame as the snapshot of a source file
+
+        Input: cleaned DataFrame, path of the source csv and snapshot folder
+        Output: manifest (dict)
+    """
+    if pq is None:
+        raise ImportError( 'pyarrow is required to write the dataset snapshot' )
+
+    part = _write_part( df, source, 0, root )
+    manifest = {'version': CLEAN_VERSION, 'source': fingerprint( source ), 'parts': [part],
+                'appends': [], 'rows': len( df )}
+    write_manifest( manifest, source, root )
+
+    return manifest
+
+
+def new_orders ( df, source, root=SNAPSHOT_DIR, manifest=None ):
+    """ This function drops the orders already stored in the snapshot, and the repeated ones
+
+        Only the ID column of the stored parts is read.
+
+        Input: cleaned DataFrame of a daily file, path of the source csv and snapshot folder
+        Output: DataFrame with the orders not stored yet
+    """
+    manifest = manifest or read_manifest( source, root )
+    stored = read_parts( source, manifest['parts'], root, columns=['ID'] )['ID']
+    df = df.loc[~df['ID'].isin( stored ), :]
+
+    return df.drop_duplicates( subset='ID', keep='first' ).reset_index( drop=True )
+
+
+def append ( daily, source, root=SNAPSHOT_DIR ):
+    """ This function appends a daily order file to the snapshot of a source file
+
+        The daily file is cleaned with clean_code(), the orders already stored
+        are dropped and the rest is written as a new Parquet part.
+
+        Input: path of the daily csv, path of the source csv and snapshot folder
+        Output: DataFrame with the appended orders
+    """
+    manifest = read_manifest( source, root )
+    if not is_fresh( manifest, source ):
+        rebuild( source, root, force=True )
+        manifest = read_manifest( source, root )
+
+    df = new_orders( optimize( clean_code( pd.read_csv( daily ) ) ), source, root, manifest )
+
+    entry = fingerprint( daily )
+    entry['rows'] = len( df )
+    if len( df ):
+        entry['part'] = _write_part( df, source, len( manifest['parts'] ), root )
+        manifest['parts'].append( entry['part'] )
+    manifest['appends'].append( entry )
+    manifest['rows'] += len( df )
+    write_manifest( manifest, source, root )
+
+    return df
+
+
+def rebuild ( source, root=SNAPSHOT_DIR, force=False ):
+    """ This function rebuilds the snapshot of a source file if it is out of date ( or always, with force=True )
+
+        The daily files appended to the previous snapshot are appended again, if they still exist.
+
+        Input: path of the source csv, snapshot folder and force flag
+        Output: True if the snapshot was rebuilt
+    """
+    previous = read_manifest( source, root )
+    if not force and is_fresh( previous, source ):
+        return False
+
+    write_snapshot( read_clean( source ), source, root )
+    for entry in (previous or {}).get( 'appends', [] ):
+        if os.path.exists( entry['path'] ):
+            append( entry['path'], source, root )
+
+    return True
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Rebuild the columnar snapshot of the cleaned dataset.' )
+    parser.add_argument( '--source', default='ftc_train.csv', help='source csv file' )
+    parser.add_argument( '--root', default=SNAPSHOT_DIR, help='snapshot folder' )
+    parser.add_argument( '--force', action='store_true', help='rebuild even if the snapshot is fresh' )
+    parser.add_argument( '--compare', action='store_true', help='time a cold load from csv and from the snapshot' )
+    parser.add_argument( '--append', nargs='+', default=[], metavar='DAILY_CSV', help='daily order files to append' )
+    args = parser.parse_args( argv )
+
+    start = time.perf_counter()
+    rebuilt = rebuild( args.source, args.root, force=args.force )
+    elapsed = time.perf_counter() - start
+    print( '{} {} in {:.2f}s'.format( 'rebuilt' if rebuilt else 'fresh', snapshot_dir( args.source, args.root ), elapsed ) )
+
+    for daily in args.append:
+        start = time.perf_counter()
+        df = append( daily, args.source, args.root )
+        print( 'appended {:,} new orders from {} in {:.2f}s'.format( len( df ), daily, time.perf_counter() - start ) )
+
+    if args.compare:
+        start = time.perf_counter()
+        optimize( clean_code( pd.read_csv( args.source ) ) )
+        csv_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        read_snapshot( args.source, args.root )
+        snapshot_time = time.perf_counter() - start
+
+        print( 'csv + clean_code: {:.3f}s'.format( csv_time ) )
+        print( 'snapshot:         {:.3f}s'.format( snapshot_time ) )
+
+
+if __name__ == '__main__':
+    main()
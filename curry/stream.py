@@ -0,0 +1,480 @@
+""" Out-of-core pipeline for datasets larger than the memory.
+
+    The source csv is read in chunks sized from a memory budget. Each chunk is
+    cleaned with clean_code() and folded into partial aggregates that merge
+    across chunks:
+
+    - counts, sums, sums of squares, min and max by group and day ( curry.asof ),
+      for the groupings with few groups ( cities, traffic, weather... );
+    - the daily aggregates of every delivery person and of every grid cell of the
+      delivery locations, which grow with the couriers, the map and the history:
+      they are spilled to a private SQLite database on disk ( Spill ), which also
+      answers the distinct counts of delivery people;
+    - quantile sketches of the delivery coordinates by city, traffic and day,
+      for the medians of the map, and with CURRY_APPROXIMATE=1 a HyperLogLog of
+      the delivery people by day and traffic ( curry.approx.DaySketches ), both
+      spilled to the same database.
+
+    The memory budget is the peak resident memory of the whole process: the
+    chunks and the page cache of SQLite get a share of what the process does
+    not use yet, and the summary kept in memory depends only on the groups of
+    the small groupings and the days. SummaryMetrics answers the same tables as
+    curry.metrics.FrameMetrics from it, so every chart of the pages works in
+    this mode ( set CURRY_DATA_MODE=stream ).
+
+    Check the peak memory from the terminal ( --check fails over the budget ):
+
+        python -m curry.stream --source big.csv --max-memory-mb 256 [--check]
+"""
+
+import argparse
+import os
+import pickle
+import resource
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from curry import config, store
+from curry.approx import DaySketches, SketchView
+from curry.asof import GROUPINGS, VALUES, AsOfIndex
+from curry.ingest import clean_code
+from curry.geo import delivery_distance, grid_cells
+from curry.metrics import Metrics
+from curry.sketches import DEFAULT_K, precision_for_error
+
+# Grid cell of the delivery location ( curry.geo ), added to every chunk for the map:
+GRID_COLUMN = 'geo_cell'
+
+# Groupings kept in memory: the one by delivery person is answered by the spill
+STREAM_GROUPINGS = [keys for keys in GROUPINGS if 'Delivery_person_ID' not in keys]
+# Extra values needed by the charts that FrameMetrics reads from the rows:
+STREAM_VALUES = VALUES + ['distance', 'Delivery_person_Age', 'Vehicle_condition']
+
+TIME = 'Time_taken(min)'
+RATINGS = 'Delivery_person_Ratings'
+
+# Daily aggregates spilled to disk, by traffic and date first ( the filters of the sidebar ):
+COURIER_KEYS = ['Road_traffic_density', 'Order_Date', 'City', 'Delivery_person_ID']
+CELL_KEYS = ['Road_traffic_density', 'Order_Date', GRID_COLUMN]
+
+# Shares of the memory the process does not use yet, when the build starts: the raw
+# chunk ( parsing, cleaning and aggregating hold a few copies of it at the same time )
+# and the page cache of SQLite ( also the memory of its sorts before they go to disk )
+CHUNK_SHARE = 0.1
+CACHE_SHARE = 0.05
+SAMPLE_ROWS = 2000
+
+SPILL_FILE = 'spill.sqlite'
+
+CREATE_SPILL = """
+CREATE TABLE couriers_chunks (Road_traffic_density TEXT, Order_Date TEXT, week_of_year TEXT, City TEXT,
+                              Delivery_person_ID TEXT, n_time INTEGER, s_time REAL, n_ratings INTEGER, s_ratings REAL);
+CREATE TABLE cells_chunks (Road_traffic_density TEXT, Order_Date TEXT, geo_cell INTEGER, n_time INTEGER, s_time REAL);
+CREATE TABLE locations_chunks (Road_traffic_density TEXT, Order_Date TEXT, City TEXT, sketch BLOB);
+CREATE TABLE hll_chunks (Road_traffic_density TEXT, Order_Date TEXT, sketch BLOB);
+"""
+
+# Aggregates of the same day and group, appended by different chunks, merged into tables
+# clustered by traffic and date ( the primary key of a WITHOUT ROWID table, as in curry.sql ); the
+# sketches are merged in Python ( Spill._merge_sketches )
+COMPACT_SPILL = """
+CREATE TABLE couriers (Road_traffic_density TEXT, Order_Date TEXT, week_of_year TEXT, City TEXT,
+                       Delivery_person_ID TEXT, n_time INTEGER, s_time REAL, n_ratings INTEGER, s_ratings REAL,
+                       PRIMARY KEY (Road_traffic_density, Order_Date, City, Delivery_person_ID)) WITHOUT ROWID;
+INSERT INTO couriers
+    SELECT Road_traffic_density, Order_Date, week_of_year, City, Delivery_person_ID,
+           SUM(n_time), TOTAL(s_time), SUM(n_ratings), TOTAL(s_ratings)
+    FROM couriers_chunks GROUP BY Road_traffic_density, Order_Date, City, Delivery_person_ID;
+DROP TABLE couriers_chunks;
+CREATE TABLE cells (Road_traffic_density TEXT, Order_Date TEXT, geo_cell INTEGER, n_time INTEGER, s_time REAL,
+                    PRIMARY KEY (Road_traffic_density, Order_Date, geo_cell)) WITHOUT ROWID;
+INSERT INTO cells
+    SELECT Road_traffic_density, Order_Date, geo_cell, SUM(n_time), TOTAL(s_time)
+    FROM cells_chunks GROUP BY Road_traffic_density, Order_Date, geo_cell;
+DROP TABLE cells_chunks;
+CREATE TABLE locations (Road_traffic_density TEXT, Order_Date TEXT, City TEXT, sketch BLOB,
+                        PRIMARY KEY (Road_traffic_density, Order_Date, City)) WITHOUT ROWID;
+CREATE TABLE hll (Road_traffic_density TEXT, Order_Date TEXT, sketch BLOB,
+                  PRIMARY KEY (Road_traffic_density, Order_Date)) WITHOUT ROWID;
+"""
+
+# Sketch tables: key columns, in the order of the keys of curry.approx.DaySketches
+SKETCH_KEYS = {'locations': ['City', 'Road_traffic_density', 'Order_Date'],
+               'hll': ['Order_Date', 'Road_traffic_density']}
+
+# Rows of merged sketches inserted at a time:
+SKETCH_BATCH = 256
+
+
+def resident_mb ():
+    """ This function returns the resident memory of the process in MB ( the peak one without /proc ) """
+    try:
+        with open( '/proc/self/status' ) as f:
+            for line in f:
+                if line.startswith( 'VmRSS:' ):
+                    return int( line.split()[1] ) / 1024
+    except OSError:
+        pass
+
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024
+
+
+def free_mb ( max_memory_mb ):
+    """ This function returns the part of the memory budget the process does not use yet, in MB """
+    return max( max_memory_mb - resident_mb(), 0 )
+
+
+def chunk_rows ( path, max_memory_mb ):
+    """ This function estimates how many csv rows fit in the memory budget
+
+        The budget covers the whole process, so the chunk gets a share of what
+        the interpreter, the libraries ( and the pages, in the server ) leave.
+
+        Input: path of the source csv and memory budget in MB
+        Output: number of rows per chunk
+    """
+    sample = pd.read_csv( path, nrows=SAMPLE_ROWS )
+    bytes_per_row = max( sample.memory_usage( index=False, deep=True ).sum() / max( len( sample ), 1 ), 1 )
+
+    return max( SAMPLE_ROWS, int( free_mb( max_memory_mb ) * 2**20 * CHUNK_SHARE / bytes_per_row ) )
+
+
+def read_chunks ( path, rows ):
+    """ This function reads the source csv in cleaned chunks
+
+        Input: path of the source csv and rows per chunk ( see chunk_rows() )
+        Output: iterator of cleaned DataFrames
+    """
+    for df_raw in pd.read_csv( path, chunksize=rows ):
+        yield clean_code( df_raw )
+
+
+def _plain ( df ):
+    # Keys as text for SQLite: dates as YYYY-MM-DD ( ordered as the dates ), categoricals as their values
+    df['Order_Date'] = df['Order_Date'].dt.strftime( '%Y-%m-%d' )
+    for col in df.columns:
+        if isinstance( df[col].dtype, pd.CategoricalDtype ):
+            df[col] = df[col].astype( object )
+
+    return df
+
+
+def _close ( con, folder ):
+    con.close()
+    shutil.rmtree( folder, ignore_errors=True )
+
+
+class Spill:
+    """ Daily aggregates of the delivery people and of the grid cells, and the day sketches, on disk
+
+        Every chunk appends its own aggregates and sketches; finish() merges the
+        ones of the same day and group. The queries read the rows of the selected
+        traffic conditions and days only, through the primary keys. The database
+        lives in a temporary folder, deleted with the summary.
+
+        Input: parent folder of the database and size of the SQLite page cache in MB
+    """
+
+    def __init__ ( self, parent, cache_mb ):
+        os.makedirs( parent, exist_ok=True )
+        self.folder = tempfile.mkdtemp( prefix='stream-', dir=parent )
+        self.con = sqlite3.connect( os.path.join( self.folder, SPILL_FILE ), check_same_thread=False )
+        self.lock = threading.Lock()
+        weakref.finalize( self, _close, self.con, self.folder )
+
+        # A scratch database: no journal, no sync; sorts larger than the cache go to temporary files
+        for pragma in ['journal_mode = OFF', 'synchronous = OFF', 'temp_store = FILE',
+                       'cache_size = {}'.format( -max( int( cache_mb * 1024 ), 1024 ) )]:
+            self.con.execute( 'PRAGMA ' + pragma )
+        self.con.executescript( CREATE_SPILL )
+
+    def fold ( self, df, sketches ):
+        """ This function appends the daily aggregates of a cleaned chunk ( with its grid cells ) and its day sketches """
+        couriers = (df.groupby( COURIER_KEYS, observed=True, sort=False )
+                      .agg( n_time=(TIME, 'count'), s_time=(TIME, 'sum'), n_ratings=(RATINGS, 'count'), s_ratings=(RATINGS, 'sum') )
+                      .reset_index())
+        couriers.insert( 2, 'week_of_year', couriers['Order_Date'].dt.strftime( '%U' ) )
+        cells = (df.groupby( CELL_KEYS, observed=True, sort=False )
+                   .agg( n_time=(TIME, 'count'), s_time=(TIME, 'sum') )
+                   .reset_index())
+
+        locations = [(traffic, day.strftime( '%Y-%m-%d' ), city, pickle.dumps( pair, pickle.HIGHEST_PROTOCOL ))
+                     for (city, traffic, day), pair in sketches.locations.items()]
+        hll = [(traffic, day.strftime( '%Y-%m-%d' ), pickle.dumps( sketch, pickle.HIGHEST_PROTOCOL ))
+               for (day, traffic), sketch in sketches.couriers.items()]
+
+        with self.con:
+            _plain( couriers ).to_sql( 'couriers_chunks', self.con, if_exists='append', index=False )
+            _plain( cells ).to_sql( 'cells_chunks', self.con, if_exists='append', index=False )
+            self.con.executemany( 'INSERT INTO locations_chunks VALUES (?, ?, ?, ?)', locations )
+            self.con.executemany( 'INSERT INTO hll_chunks VALUES (?, ?, ?)', hll )
+
+    def _merge_sketches ( self, table ):
+        # Sketches of the same key are read in key order and merged one key at a time
+        keys = ', '.join( SKETCH_KEYS[table] )
+        insert = 'INSERT INTO {} ({}, sketch) VALUES ({}?)'.format( table, keys, '?, ' * len( SKETCH_KEYS[table] ) )
+
+        batch, key, merged = [], None, None
+        for row in self.con.execute( 'SELECT {0}, sketch FROM {1}_chunks ORDER BY {0}'.format( keys, table ) ):
+            sketch = pickle.loads( row[-1] )
+            if row[:-1] != key:
+                if key is not None:
+                    batch.append( key + (pickle.dumps( merged, pickle.HIGHEST_PROTOCOL ),) )
+                key, merged = row[:-1], sketch
+            elif isinstance( merged, list ):
+                for total, part in zip( merged, sketch ):
+                    total.merge( part )
+            else:
+                merged.merge( sketch )
+            if len( batch ) >= SKETCH_BATCH:
+                self.con.executemany( insert, batch )
+                batch = []
+        if key is not None:
+            batch.append( key + (pickle.dumps( merged, pickle.HIGHEST_PROTOCOL ),) )
+        self.con.executemany( insert, batch )
+        self.con.execute( 'DROP TABLE {}_chunks'.format( table ) )
+
+    def finish ( self ):
+        """ This function merges the aggregates and sketches appended by the chunks; call it once after the last one """
+        self.con.executescript( COMPACT_SPILL )
+        with self.con:
+            for table in SKETCH_KEYS:
+                self._merge_sketches( table )
+        self.con.execute( 'VACUUM' )
+
+    def query ( self, sql, params ):
+        """ This function runs a query on the spilled aggregates ( the connection is shared by the sessions )
+
+            Output: DataFrame
+        """
+        with self.lock:
+            return pd.read_sql_query( sql, self.con, params=params )
+
+    def size_mb ( self ):
+        """ This function returns the size of the database on disk, in MB """
+        return os.path.getsize( os.path.join( self.folder, SPILL_FILE ) ) / 2**20
+
+
+class SpilledSketches:
+    """ Day sketches read back from the spill, with the view() of curry.approx.DaySketches
+
+        Only the sketches of the selected days and traffic conditions are loaded,
+        for the time of a query.
+    """
+
+    def __init__ ( self, spill, k, p ):
+        self.spill = spill
+        self.k = k
+        self.p = p
+
+    def _items ( self, table, cutoff, traffic ):
+        keys = SKETCH_KEYS[table]
+        df = self.spill.query( 'SELECT {}, sketch FROM {} WHERE Order_Date < ? AND Road_traffic_density IN ({})'
+                               .format( ', '.join( keys ), table, ', '.join( '?' * len( traffic ) ) ),
+                               [pd.Timestamp( cutoff ).strftime( '%Y-%m-%d' )] + list( traffic ) )
+        for row in df.itertuples( index=False ):
+            yield tuple( row[:-1] ), pickle.loads( row[-1] )
+
+    def view ( self, cutoff, traffic ):
+        """ This function returns the SketchView of the orders with date < cutoff and the selected traffic """
+        selected = types.SimpleNamespace( k=self.k, p=self.p,
+                                          locations=types.SimpleNamespace( items=lambda: self._items( 'locations', cutoff, traffic ) ),
+                                          couriers=types.SimpleNamespace( items=lambda: self._items( 'hll', cutoff, traffic ) ) )
+
+        return SketchView( selected, cutoff, traffic )
+
+
+class StreamSummary:
+    """ Mergeable partial aggregates of the cleaned dataset
+
+        Input: items per level of the quantile sketches, index bits of the distinct
+               counters ( None: exact distinct counts, from the spill ), folder of the
+               spill and size of its page cache in MB
+    """
+
+    def __init__ ( self, k=DEFAULT_K, p=None, folder=None, cache_mb=16 ):
+        self.k = k
+        self.p = p
+        self.rows = 0
+        self.index = None
+        self.spill = Spill( folder or tempfile.gettempdir(), cache_mb )
+        self.sketches = None
+
+    def fold ( self, df ):
+        """ This function folds a cleaned chunk into the summary """
+        if 'distance' not in df.columns:
+            df = df.assign( distance=delivery_distance( df ) )
+        df = df.assign( **{GRID_COLUMN: grid_cells( df['Delivery_location_latitude'].to_numpy(),
+                                                    df['Delivery_location_longitude'].to_numpy() )} )
+        self.rows += len( df )
+
+        if self.index is None:
+            self.index = AsOfIndex( df, groupings=STREAM_GROUPINGS, values=STREAM_VALUES )
+        else:
+            self.index.fold( df )
+
+        self.spill.fold( df, DaySketches( k=self.k, p=self.p ).fold( df ) )
+
+        return self
+
+    def finish ( self ):
+        """ This function merges the pending partials; call it once after the last chunk """
+        self.index.finish()
+        self.spill.finish()
+        self.sketches = SpilledSketches( self.spill, self.k, self.p )
+
+        return self
+
+
+def build_summary ( path, max_memory_mb=None, k=DEFAULT_K, approximate=None ):
+    """ This function streams the source csv into a StreamSummary
+
+        The spill goes to a temporary folder next to the snapshot of the source ( curry.store ).
+
+        Input: path of the source csv, memory budget of the process in MB, size of the quantile
+               sketches and whether the distinct counts are approximate ( None: CURRY_APPROXIMATE )
+        Output: StreamSummary
+    """
+    max_memory_mb = max_memory_mb or config.STREAM_MAX_MEMORY_MB
+    approximate = config.APPROXIMATE if approximate is None else approximate
+    rows = chunk_rows( path, max_memory_mb )
+    summary = StreamSummary( k, precision_for_error( config.DISTINCT_ERROR ) if approximate else None,
+                             store.snapshot_dir( path ), free_mb( max_memory_mb ) * CACHE_SHARE )
+    summary.chunk_rows = rows
+    for chunk in read_chunks( path, rows ):
+        summary.fold( chunk )
+
+    return summary.finish()
+
+
+class SummaryMetrics ( Metrics ):
+    """ Metrics of the pages answered from a StreamSummary
+
+        Counts, means, deviations, min, max and distinct counts are exact ( the
+        distinct counts come from the HyperLogLogs with CURRY_APPROXIMATE=1 ); the
+        medians of the map come from the quantile sketches. The tables by delivery
+        person and by grid cell are queried from the spill.
+
+        Input: StreamSummary, cutoff date and selected traffic conditions
+    """
+
+    def __init__ ( self, summary, cutoff, traffic ):
+        super().__init__( summary.index.asof( cutoff, traffic ) )
+        self.summary = summary
+        self.sketches = summary.sketches.view( cutoff, traffic )
+        self.cutoff = np.datetime64( pd.Timestamp( cutoff ) )
+        self.traffic = traffic
+        # Filters of the sidebar on the spilled tables, as in curry.sql
+        self.where = 'Order_Date < ? AND Road_traffic_density IN ({})'.format( ', '.join( '?' * len( traffic ) ) )
+        self.params = [pd.Timestamp( cutoff ).strftime( '%Y-%m-%d' )] + list( traffic )
+
+    def _query ( self, select, table, group ):
+        return self.summary.spill.query( 'SELECT {} FROM {} WHERE {} GROUP BY {} ORDER BY {}'.format( select, table, self.where, group, group ),
+                                         self.params )
+
+    def orders_by_day ( self ):
+        counts = self.asof.counts_by_day()
+
+        return pd.DataFrame( {'Order_Date': counts.index, 'ID': counts.to_numpy()} )
+
+    def orders_by_traffic ( self ):
+        df = (self.asof.agg( 'Road_traffic_density', {'Time_taken(min)': 'count'} )
+                  .rename( columns={'Time_taken(min)': 'ID'} )
+                  .reset_index())
+        df['perc_entrega'] = df['ID'] / df['ID'].sum()
+
+        return df
+
+    def orders_by_city_traffic ( self ):
+        return (self.asof.agg( ['City', 'Road_traffic_density'], {'Time_taken(min)': 'count'} )
+                    .rename( columns={'Time_taken(min)': 'ID'} )
+                    .reset_index())
+
+    def orders_by_week ( self ):
+        df = self.orders_by_day()
+        df['week_of_year'] = df['Order_Date'].dt.strftime( '%U' )
+
+        return df.loc[: , ['week_of_year', 'ID']].groupby( 'week_of_year' ).sum().reset_index()
+
+    def orders_per_courier_by_week ( self ):
+        df_aux4 = self.orders_by_week()
+        if self.summary.p is None:
+            df_aux5 = self._query( 'week_of_year, COUNT(DISTINCT Delivery_person_ID) AS Delivery_person_ID', 'couriers', 'week_of_year' )
+        else:
+            df_aux5 = self.sketches.couriers_by_week()
+        df_aux6 = pd.merge( df_aux4, df_aux5, how='inner' )
+        df_aux6['Orders_by_deliver'] = df_aux6['ID'] / df_aux6['Delivery_person_ID']
+
+        return df_aux6
+
+    def location_medians ( self ):
+        return self.sketches.location_medians()
+
+    def _cell_totals ( self ):
+        totals = self._query( 'geo_cell, SUM(n_time) AS count, TOTAL(s_time) AS sum', 'cells', 'geo_cell' )
+
+        return totals['geo_cell'].to_numpy( np.int64 ), totals['count'].to_numpy(), totals['sum'].to_numpy()
+
+    def extreme ( self, col, operation ):
+        values = self.asof.agg( 'Road_traffic_density', {col: operation} )[col]
+        result = values.max() if operation == 'max' else values.min()
+
+        return int( result ) if float( result ).is_integer() else result
+
+    def courier_ratings ( self ):
+        return self._query( 'Delivery_person_ID, TOTAL(s_ratings) / SUM(n_ratings) AS Delivery_person_Ratings',
+                            'couriers', 'Delivery_person_ID' )
+
+    def courier_time ( self ):
+        return self._query( 'City, Delivery_person_ID, TOTAL(s_time) / SUM(n_time) AS "Time_taken(min)"',
+                            'couriers', 'City, Delivery_person_ID' )
+
+    def courier_count ( self ):
+        if self.summary.p is None:
+            count = self.summary.spill.query( 'SELECT COUNT(DISTINCT Delivery_person_ID) FROM couriers WHERE ' + self.where, self.params )
+            return int( count.iloc[0, 0] )
+
+        return self.sketches.courier_count()
+
+    def avg_distance ( self ):
+        totals = self.asof.agg( 'Road_traffic_density', {'distance': ['sum', 'count']} )['distance'].sum()
+
+        return np.round( totals['sum'] / totals['count'], 2 )
+
+    def distance_by_city ( self ):
+        return self.asof.agg( 'City', {'distance': 'mean'} ).reset_index()
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Stream the source csv into partial aggregates and report the peak memory.' )
+    parser.add_argument( '--source', default='ftc_train.csv', help='source csv file' )
+    parser.add_argument( '--max-memory-mb', type=int, default=config.STREAM_MAX_MEMORY_MB, help='memory budget of the process ( peak resident memory ) in MB' )
+    parser.add_argument( '--k', type=int, default=DEFAULT_K, help='items per level of the quantile sketches' )
+    parser.add_argument( '--check', action='store_true', help='fail if the peak resident memory exceeds the budget' )
+    args = parser.parse_args( argv )
+
+    start = time.perf_counter()
+    summary = build_summary( args.source, args.max_memory_mb, args.k )
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024
+
+    print( 'rows:        {:,}'.format( summary.rows ) )
+    print( 'chunk rows:  {:,}'.format( summary.chunk_rows ) )
+    print( 'time:        {:.1f}s'.format( elapsed ) )
+    print( 'spill:       {:.1f} MB on disk'.format( summary.spill.size_mb() ) )
+    print( 'peak memory: {:.0f} MB ( budget {} MB )'.format( peak_mb, args.max_memory_mb ) )
+
+    if args.check and peak_mb > args.max_memory_mb:
+        raise SystemExit( 'peak memory {:.0f} MB exceeds the budget of {} MB'.format( peak_mb, args.max_memory_mb ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,660 @@
+""" Materialized views: the tables of the pages precomputed for every slider cutoff.
+
+    The date slider of the pages moves over a fixed window, one day at a
+    time, and the traffic filter has 15 possible selections. Every cutoff
+    between two days with orders gives the same tables, so the states to
+    precompute are the days with orders inside the window ( plus the empty
+    state before the first order ) times the traffic selections.
+
+    The batch job computes every table of the pages ( curry.metrics ) for
+    each state, spread over processes by traffic selection, and writes one
+    Parquet file per table next to the snapshot of the source. The states of
+    a selection are not computed from its rows one by one: the running daily
+    aggregates of the selection ( SelectionIndex ) give the tables of every
+    cutoff. A manifest keeps a hash of the orders of each day: when new
+    orders arrive only the states from the first changed day on are computed
+    again.
+
+    With CURRY_DATA_MODE=views the pages read these tables instead of
+    computing them; when the views are older than the dataset they fall back
+    to the computation in memory. --compare checks the views against the
+    tables computed in memory ( FrameMetrics ).
+
+        python -m curry.views --source ftc_train.csv [--jobs 4] [--force] [--compare]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from curry import cache, store
+from curry.asof import PrefixTable
+from curry.geo import MAX_CELLS, grid_cells, grid_summary
+from curry.ingest import CLEAN_VERSION, DATASET_PATH
+from curry.metrics import Metrics, extremes_by_group
+from curry.sql import CHECKS, COMPARE_CUTOFFS, same_tables
+
+# Version of the tables written here; bump it whenever they change, so old views are rebuilt:
+VIEW_VERSION = 2
+
+VIEWS_FOLDER = 'views'
+MANIFEST_FILE = 'manifest.json'
+
+# Window of the date slider of the pages:
+SLIDER_START = '2022-02-04'
+SLIDER_END = '2022-06-04'
+
+TRAFFIC = ['Low', 'Medium', 'High', 'Jam']
+
+# Largest number of delivery people by city of the Delivery page rankings ( its sidebar input ):
+TOP_N = 100
+
+# State of the cutoffs before the first order:
+EMPTY_DAY = pd.Timestamp( '1970-01-01' )
+
+EXTREMES = [(col, op) for col in ['Delivery_person_Age', 'Vehicle_condition'] for op in ['max', 'min']]
+FESTIVAL = [(festival, op) for festival in ['Yes', 'No'] for op in ['mean', 'std']]
+INTEGER_SCALARS = ['rows', 'courier_count'] + ['extreme_{}_{}'.format( col, op ) for col, op in EXTREMES]
+RATING_COLUMNS = ['Road_traffic_density', 'Weatherconditions']
+TIME_GROUPS = [['City'], ['City', 'Type_of_order'], ['City', 'Road_traffic_density']]
+
+# Grid cell of the delivery location ( curry.geo ), for the map:
+GRID_COLUMN = 'geo_cell'
+LOCATION = ['Delivery_location_latitude', 'Delivery_location_longitude']
+
+TIME = 'Time_taken(min)'
+RATINGS = 'Delivery_person_Ratings'
+
+# Running aggregates of a traffic selection ( SelectionIndex ): grouping -> value columns its tables read
+STATE_TABLES = {('Festival',): [TIME],
+                ('City',): [TIME, 'distance'],
+                ('City', 'Road_traffic_density'): [TIME],
+                ('City', 'Type_of_order'): [TIME],
+                ('Road_traffic_density',): [TIME, RATINGS, 'distance', 'Delivery_person_Age', 'Vehicle_condition'],
+                ('Weatherconditions',): [RATINGS],
+                ('Delivery_person_ID',): [RATINGS],
+                ('City', 'Delivery_person_ID'): [TIME],
+                (GRID_COLUMN,): [TIME]}
+
+# Cutoffs of --compare, besides the ones of curry.sql: the empty state and the end of the slider
+COMPARE_STATES = [SLIDER_START] + COMPARE_CUTOFFS + [SLIDER_END]
+# Sizes of the rankings of the Delivery page compared by --compare ( head of the stored TOP_N ):
+COMPARE_TOP = [1, 10, TOP_N]
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def selection_key ( traffic ):
+    """ Key of a traffic selection: the sorted conditions, comma separated """
+    return ','.join( sorted( traffic ) )
+
+
+def selections ():
+    """ This function returns the keys of every non empty traffic selection """
+    return [selection_key( combo ) for size in range( 1, len( TRAFFIC ) + 1 )
+            for combo in itertools.combinations( TRAFFIC, size )]
+
+
+def state_of ( cutoff, days ):
+    """ This function returns the state of a cutoff: the last day with orders before it ( or EMPTY_DAY )
+
+        Input: cutoff date and sorted numpy array of the days with orders
+        Output: Timestamp
+    """
+    n = int( np.searchsorted( days, np.datetime64( pd.Timestamp( cutoff ) ), side='left' ) )
+
+    return pd.Timestamp( days[n - 1] ) if n else EMPTY_DAY
+
+
+def slider_states ( days ):
+    """ This function returns the distinct states of the cutoffs of the slider window """
+    cutoffs = pd.date_range( SLIDER_START, SLIDER_END, freq='D' )
+
+    return sorted( {state_of( cutoff, days ) for cutoff in cutoffs} )
+
+
+def day_hashes ( df ):
+    """ This function returns a fingerprint of the orders of each day
+
+        The hashes of the rows of a day are combined with xor, so the
+        fingerprint does not depend on the order of the rows.
+
+        Input: cleaned DataFrame
+        Output: dict {day ( ISO date ): hexadecimal hash}
+    """
+    hashes = pd.util.hash_pandas_object( df, index=False ).to_numpy()
+    days = df['Order_Date'].to_numpy()
+    order = np.argsort( days, kind='stable' )
+    days = days[order]
+    starts = np.flatnonzero( np.r_[True, days[1:] != days[:-1]] ) if len( days ) else np.array( [], dtype=np.int64 )
+    combined = np.bitwise_xor.reduceat( hashes[order], starts ) if len( days ) else []
+
+    return {str( pd.Timestamp( day ).date() ): '{:016x}'.format( int( h ) ) for day, h in zip( days[starts], combined )}
+
+
+class SelectionIndex:
+    """ Running daily aggregates of the orders of one traffic selection
+
+        The prefix tables of an as-of index ( curry.asof ) over the rows of the
+        selection, without the traffic split, hold the running totals of every
+        group day by day: one vectorized binary search gives the aggregates of
+        every group at every cutoff, so each table of the pages is computed
+        for all the states at once instead of once per state from the selected
+        rows. The tables that do not add up across days come from arrays
+        sorted by day: the distinct delivery people from the first day of each
+        one ( overall and in every week ), the medians of the map from the
+        coordinates of every city and traffic.
+
+        Input: cleaned DataFrame and selected traffic conditions
+    """
+
+    def __init__ ( self, df, traffic ):
+        rows = df.loc[df['Road_traffic_density'].isin( traffic ), :]
+        # Orders of every day, in order, and the week of the year of each row from the one of its day
+        by_day = rows.groupby( 'Order_Date' )['ID'].count()
+        self.days = by_day.index.to_numpy()
+        self.day_orders = by_day.to_numpy()
+        self.day_weeks = by_day.index.strftime( '%U' ).to_numpy()
+        rows = rows.assign( **{GRID_COLUMN: grid_cells( rows['Delivery_location_latitude'].to_numpy(),
+                                                        rows['Delivery_location_longitude'].to_numpy() ),
+                               'week_of_year': self.day_weeks[np.searchsorted( self.days, rows['Order_Date'].to_numpy() )]} )
+
+        # The PrefixTables of an as-of index, each with the values of its tables only
+        self.prefix = {keys: PrefixTable( rows, keys, values, self.days, split=None ) for keys, values in STATE_TABLES.items()}
+
+        # First day of every delivery person, overall and in each week ( sorted )
+        self.first_days = np.sort( rows.groupby( 'Delivery_person_ID', observed=True )['Order_Date'].min().to_numpy() )
+        first = rows.groupby( ['week_of_year', 'Delivery_person_ID'], observed=True )['Order_Date'].min()
+        self.first_by_week = {week: np.sort( days.to_numpy() ) for week, days in first.groupby( level='week_of_year' )}
+
+        # Coordinates of every city and traffic, sorted by day
+        self.locations = []
+        for (city, density), group in rows.groupby( ['City', 'Road_traffic_density'], observed=True, sort=True ):
+            group = group.sort_values( 'Order_Date', kind='stable' )
+            self.locations.append( (city, density, group['Order_Date'].to_numpy(),
+                                    [group[col].to_numpy() for col in LOCATION]) )
+        self.location_dtypes = [rows[col].dtype for col in LOCATION]
+
+    def _grouped ( self, keys, spec, cutoffs ):
+        """ This function aggregates a grouping of the index at every cutoff
+
+            Input: grouping columns, dict {value column: list of statistics} and numpy array of cutoffs
+            Output: DataFrame with the state ( position of its cutoff ), the keys and the
+                    statistics, for the groups with orders; by state and then by group
+        """
+        table = self.prefix[tuple( keys )]
+        day = np.searchsorted( self.days, cutoffs, side='left' )
+        groups = np.arange( len( table.labels ) )
+
+        # PrefixTable.rows_before for every state and group at once
+        state = np.repeat( np.arange( len( cutoffs ) ), len( groups ) )
+        group = np.tile( groups, len( cutoffs ) )
+        pos = np.searchsorted( table.key, group * table.n_days + day[state], side='left' ) - 1
+        valid = pos >= 0
+        valid[valid] = table.code[pos[valid]] == group[valid]
+        pos, state, group = pos[valid], state[valid], group[valid]
+
+        aggregates = {'count': table.count[pos], 'sum': table.sum[pos], 'sumsq': table.sumsq[pos],
+                      'min': table.min[pos], 'max': table.max[pos]}
+        df = table.labels[group].to_frame( index=False )
+        df.insert( 0, 'state', state )
+        for col, stats in spec.items():
+            for stat in stats:
+                df[(col, stat)] = table.stat( aggregates, col, stat )
+
+        return df
+
+    def _scalars ( self, cutoffs ):
+        # One row per state, as the scalars of a Metrics object
+        traffic = self._grouped( ['Road_traffic_density'], {'Time_taken(min)': ['count'], 'distance': ['count', 'sum']}
+                                                          | {col: ['min', 'max'] for col, _ in EXTREMES}, cutoffs )
+        state, n_states = traffic['state'].to_numpy(), len( cutoffs )
+        orders = np.bincount( state, traffic[('Time_taken(min)', 'count')], minlength=n_states )
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            avg_distance = np.round( np.bincount( state, traffic[('distance', 'sum')], minlength=n_states )
+                                     / np.bincount( state, traffic[('distance', 'count')], minlength=n_states ), 2 )
+        scalars = {'rows': orders.astype( np.int64 ),
+                   'courier_count': np.searchsorted( self.first_days, cutoffs, side='left' ),
+                   'avg_distance': avg_distance}
+
+        festival = self._grouped( ['Festival'], {'Time_taken(min)': ['mean', 'std']}, cutoffs )
+        for name, op in FESTIVAL:
+            values = np.full( n_states, np.nan )
+            rows = festival.loc[festival['Festival'] == name, :]
+            values[rows['state'].to_numpy()] = rows[('Time_taken(min)', op)].to_numpy()
+            scalars['festival_{}_{}'.format( name, op )] = np.round( values, 2 )
+        for col, op in EXTREMES:
+            values = np.full( n_states, np.inf if op == 'min' else -np.inf )
+            (np.minimum if op == 'min' else np.maximum).at( values, state, traffic[(col, op)].to_numpy() )
+            values[np.isinf( values )] = np.nan
+            scalars['extreme_{}_{}'.format( col, op )] = values
+
+        return pd.DataFrame( {'state': np.arange( n_states )} | scalars )
+
+    def _top_couriers ( self, cutoffs ):
+        courier_time = self._grouped( ['City', 'Delivery_person_ID'], {'Time_taken(min)': ['mean']}, cutoffs )
+        courier_time.columns = ['state', 'City', 'Delivery_person_ID', 'Time_taken(min)']
+        # The n fastest and slowest of every city of every state: the rankings of Metrics.top_couriers
+        cities = pd.factorize( courier_time['City'], sort=True )[0]
+        courier_time['group'] = courier_time['state'].to_numpy() * (cities.max( initial=0 ) + 1) + cities
+        fastest, slowest = extremes_by_group( courier_time, 'group', 'Time_taken(min)', TOP_N, tie='Delivery_person_ID' )
+
+        return pd.concat( [fastest.assign( end='fastest' ), slowest.assign( end='slowest' )], ignore_index=True ) \
+                 .sort_values( 'state', kind='stable' ).drop( columns='group' )
+
+    def _delivery_grid ( self, cutoffs ):
+        cells = self._grouped( [GRID_COLUMN], {'Time_taken(min)': ['count', 'sum']}, cutoffs )
+        grids = []
+        for state, part in cells.groupby( 'state', sort=True ):
+            grid = grid_summary( part[GRID_COLUMN].to_numpy(), part[('Time_taken(min)', 'count')].to_numpy(),
+                                 part[('Time_taken(min)', 'sum')].to_numpy() )
+            grids.append( grid.assign( state=state ) )
+
+        return pd.concat( grids, ignore_index=True ) if grids else grid_summary( [], [], [] ).assign( state=0 ).iloc[:0]
+
+    def _orders ( self, cutoffs ):
+        # Orders of every day before each cutoff, by week, and by week per distinct delivery person
+        n = np.searchsorted( self.days, cutoffs, side='left' )
+        state = np.repeat( np.arange( len( cutoffs ) ), n )
+        day = np.concatenate( [np.arange( k ) for k in n] ) if len( n ) else np.array( [], dtype=np.int64 )
+        by_day = pd.DataFrame( {'state': state, 'Order_Date': self.days[day], 'ID': self.day_orders[day]} )
+
+        by_week = (pd.DataFrame( {'state': state, 'week_of_year': self.day_weeks[day], 'ID': self.day_orders[day]} )
+                     .groupby( ['state', 'week_of_year'], sort=True ).sum().reset_index())
+        couriers = pd.DataFrame( [(i, week, int( np.searchsorted( first, cutoff, side='left' ) ))
+                                  for week, first in self.first_by_week.items() for i, cutoff in enumerate( cutoffs )],
+                                 columns=['state', 'week_of_year', 'Delivery_person_ID'] )
+        per_courier = pd.merge( by_week, couriers.loc[couriers['Delivery_person_ID'] > 0, :], how='inner' )
+        per_courier['Orders_by_deliver'] = per_courier['ID'] / per_courier['Delivery_person_ID']
+
+        return by_day, by_week, per_courier
+
+    def _location_medians ( self, cutoffs ):
+        rows = []
+        for i, cutoff in enumerate( cutoffs ):
+            for city, density, days, columns in self.locations:
+                n = int( np.searchsorted( days, cutoff, side='left' ) )
+                if n:
+                    # pandas takes the median in float64 and keeps the dtype of the column
+                    rows.append( [i, city, density] + [np.median( values[:n].astype( np.float64 ) ) for values in columns] )
+        df = pd.DataFrame( rows, columns=['state', 'City', 'Road_traffic_density'] + LOCATION )
+
+        return df.astype( dict( zip( LOCATION, self.location_dtypes ) ) )
+
+    def tables ( self, cutoffs ):
+        """ This function computes every table of the pages for the orders of the selection before each cutoff
+
+            Input: list of cutoff dates
+            Output: dict {name: DataFrame with the columns of the table of the pages, after a state
+                    column ( position of the cutoff in the list ); the rows of each state in order}
+        """
+        cutoffs = np.array( [np.datetime64( pd.Timestamp( cutoff ) ) for cutoff in cutoffs], dtype='datetime64[ns]' )
+        result = {}
+        result['orders_by_day'], result['orders_by_week'], result['orders_per_courier_by_week'] = self._orders( cutoffs )
+
+        traffic = self._grouped( ['Road_traffic_density'], {'Time_taken(min)': ['count']}, cutoffs )
+        traffic.columns = ['state', 'Road_traffic_density', 'ID']
+        traffic['perc_entrega'] = traffic['ID'] / np.bincount( traffic['state'], traffic['ID'], minlength=len( cutoffs ) )[traffic['state']]
+        result['orders_by_traffic'] = traffic
+        city_traffic = self._grouped( ['City', 'Road_traffic_density'], {'Time_taken(min)': ['count']}, cutoffs )
+        city_traffic.columns = ['state', 'City', 'Road_traffic_density', 'ID']
+        result['orders_by_city_traffic'] = city_traffic
+
+        result['location_medians'] = self._location_medians( cutoffs )
+        result['delivery_grid'] = self._delivery_grid( cutoffs )
+        for name, keys, col in [('courier_ratings', ['Delivery_person_ID'], 'Delivery_person_Ratings'),
+                                ('distance_by_city', ['City'], 'distance')]:
+            table = self._grouped( keys, {col: ['mean']}, cutoffs )
+            table.columns = ['state'] + keys + [col]
+            result[name] = table
+        result['top_couriers'] = self._top_couriers( cutoffs )
+
+        for col in RATING_COLUMNS:
+            ratings = self._grouped( [col], {'Delivery_person_Ratings': ['mean', 'std']}, cutoffs )
+            ratings.columns = ['state', col, 'mean', 'std']
+            result['ratings_' + col] = ratings
+        for group in TIME_GROUPS:
+            time_by = self._grouped( group, {'Time_taken(min)': ['mean', 'std']}, cutoffs )
+            time_by.columns = ['state'] + group + ['avg_time', 'std_time']
+            result['time_by_' + '_'.join( group )] = time_by
+
+        result['scalars'] = self._scalars( cutoffs )
+
+        return result
+
+
+def _concat ( parts ):
+    """ Concatenates the tables of several states, with the columns in the order of the last one
+        ( the tables of the empty state may come with the columns in another order ) """
+    df = pd.concat( parts, ignore_index=True )
+
+    return df.loc[: , list( parts[-1].columns ) + [col for col in df.columns if col not in parts[-1].columns]]
+
+
+def _compute ( path, key, states ):
+    """ This function computes the tables of one traffic selection for the given states ( runs in a worker )
+
+        Input: path of the source csv, selection key and list of (state, cutoff)
+        Output: dict {name: DataFrame with the traffic and asof_day columns first}
+    """
+    selection = SelectionIndex( cache.get_dataset( path ), key.split( ',' ) )
+    days = np.array( [state for state, _ in states], dtype='datetime64[ns]' )
+    frames = {}
+    for name, table in selection.tables( [cutoff for _, cutoff in states] ).items():
+        table.insert( 0, 'asof_day', days[table.pop( 'state' ).to_numpy()] )
+        table.insert( 0, 'traffic', key )
+        frames[name] = table.reset_index( drop=True )
+
+    return frames
+
+
+def views_dir ( source, root=store.SNAPSHOT_DIR ):
+    """ Folder of the views of a given source file """
+    return os.path.join( store.snapshot_dir( source, root ), VIEWS_FOLDER )
+
+
+def read_manifest ( source, root=store.SNAPSHOT_DIR ):
+    try:
+        with open( os.path.join( views_dir( source, root ), MANIFEST_FILE ) ) as f:
+            return json.load( f )
+    except (OSError, ValueError):
+        return None
+
+
+def _write_table ( df, folder, name ):
+    path = os.path.join( folder, name + '.parquet' )
+    df.to_parquet( path + '.tmp', index=False )
+    os.replace( path + '.tmp', path )
+
+
+def build ( source=DATASET_PATH, root=store.SNAPSHOT_DIR, jobs=None, force=False ):
+    """ This function precomputes the views of a source file, only for the states that changed
+
+        Input: path of the source csv, snapshot folder, number of worker processes and force flag
+        Output: dict with the number of states computed and kept
+    """
+    df = cache.get_dataset( source )
+    hashes = day_hashes( df )
+    days = np.array( sorted( pd.to_datetime( list( hashes ) ) ), dtype='datetime64[ns]' )
+    states = slider_states( days )
+    version = list( cache.dataset_version( source ) )
+
+    folder = views_dir( source, root )
+    previous = None if force else read_manifest( source, root )
+    if previous is not None and (previous.get( 'view_version' ) != VIEW_VERSION
+                                 or previous.get( 'clean_version' ) != CLEAN_VERSION):
+        previous = None
+
+    if previous is None:
+        todo, kept = states, []
+    else:
+        changed = [day for day in set( previous['days'] ) | set( hashes ) if previous['days'].get( day ) != hashes.get( day )]
+        first = pd.Timestamp( min( changed ) ) if changed else None
+        todo = [s for s in states if first is not None and s >= first]
+        kept = [s for s in states if s not in todo]
+
+    cutoffs = [(s, pd.Timestamp( days[0] ) if s == EMPTY_DAY else s + pd.Timedelta( days=1 )) for s in todo]
+    keys = selections()
+    results = []
+    if cutoffs:
+        if jobs == 1:
+            results = [_compute( source, key, cutoffs ) for key in keys]
+        else:
+            with ProcessPoolExecutor( max_workers=jobs ) as pool:
+                results = list( pool.map( _compute, [source] * len( keys ), keys, [cutoffs] * len( keys ) ) )
+
+    os.makedirs( folder, exist_ok=True )
+    names = sorted( results[0] ) if results else previous['tables']
+    for name in names:
+        parts = [result[name] for result in results]
+        if kept:
+            old = pd.read_parquet( os.path.join( folder, name + '.parquet' ) )
+            parts.insert( 0, old.loc[old['asof_day'].isin( kept ), :] )
+        if results or kept:
+            _write_table( _concat( parts ), folder, name )
+
+    manifest = {'view_version': VIEW_VERSION, 'clean_version': CLEAN_VERSION, 'dataset_version': version,
+                'days': hashes, 'selections': keys, 'states': [str( s.date() ) for s in states], 'tables': names,
+                'built_at': time.time()}
+    tmp = os.path.join( folder, MANIFEST_FILE + '.tmp' )
+    with open( tmp, 'w' ) as f:
+        json.dump( manifest, f, indent=2 )
+    os.replace( tmp, os.path.join( folder, MANIFEST_FILE ) )
+
+    return {'computed': len( todo ), 'kept': len( kept ), 'selections': len( keys )}
+
+
+class Views:
+    """ Precomputed tables of a source file, loaded on first use """
+
+    def __init__ ( self, folder, manifest, source=DATASET_PATH ):
+        self.folder = folder
+        self.manifest = manifest
+        self.source = source
+        self.days = np.array( sorted( pd.to_datetime( list( manifest['days'] ) ) ), dtype='datetime64[ns]' )
+        self.selections = set( manifest['selections'] )
+        self.states = set( pd.to_datetime( manifest['states'] ) )
+        self.tables = {}
+
+    def _table ( self, name ):
+        with _lock:
+            if name not in self.tables:
+                df = pd.read_parquet( os.path.join( self.folder, name + '.parquet' ) )
+                self.tables[name] = df.set_index( ['traffic', 'asof_day'] ).sort_index()
+
+        return self.tables[name]
+
+    def table ( self, name, key, state ):
+        """ This function returns the rows of a table for one traffic selection and state """
+        df = self._table( name )
+        try:
+            rows = df.index.get_loc( (key, state) )
+        except KeyError:
+            return df.iloc[:0].reset_index( drop=True )
+        if isinstance( rows, int ):
+            rows = [rows]
+
+        return df.iloc[rows].reset_index( drop=True )
+
+    def metrics ( self, cutoff, traffic ):
+        """ This function returns the metrics of a cutoff and traffic selection, or None if they were not precomputed
+
+            Only the states of the slider window are built: a cutoff after the
+            last day of the window with new orders ( daily files appended after
+            it ) has a state of its own, answered by the caller from the rows.
+        """
+        key = selection_key( traffic )
+        state = state_of( cutoff, self.days )
+        if key not in self.selections or state not in self.states:
+            return None
+
+        return ViewMetrics( self, state, key, cutoff, traffic )
+
+
+def load_views ( source=DATASET_PATH, root=store.SNAPSHOT_DIR ):
+    """ This function returns the views of a source file, or None if they are missing or older than the dataset
+
+        Input: path of the source csv and snapshot folder
+        Output: Views or None
+    """
+    manifest = read_manifest( source, root )
+    if manifest is None or manifest['dataset_version'] != list( cache.dataset_version( source ) ):
+        return None
+
+    folder = views_dir( source, root )
+    with _lock:
+        views = _loaded.get( folder )
+        if views is None or views.manifest['built_at'] != manifest['built_at']:
+            views = _loaded[folder] = Views( folder, manifest, source )
+
+    return views
+
+
+class ViewMetrics ( Metrics ):
+    """ Metrics of the pages read from the precomputed views
+
+        Input: Views, state ( last day with orders before the cutoff ), traffic selection key,
+               and the cutoff and traffic conditions asked for
+    """
+
+    def __init__ ( self, views, state, key, cutoff, traffic ):
+        super().__init__( None )
+        self.views = views
+        self.state = state
+        self.key = key
+        self.cutoff = cutoff
+        self.traffic = list( traffic )
+
+    def _table ( self, name ):
+        return self.views.table( name, self.key, self.state )
+
+    def _scalar ( self, name ):
+        scalars = self._table( 'scalars' )
+        value = scalars[name].iloc[0] if len( scalars ) else np.nan
+
+        # the columns of the integer scalars are stored as float when the empty state has NaN
+        return int( value ) if name in INTEGER_SCALARS and float( value ).is_integer() else value
+
+    def rows ( self ):
+        return self._scalar( 'rows' )
+
+    def orders_by_day ( self ):
+        return self._table( 'orders_by_day' )
+
+    def orders_by_traffic ( self ):
+        return self._table( 'orders_by_traffic' )
+
+    def orders_by_city_traffic ( self ):
+        return self._table( 'orders_by_city_traffic' )
+
+    def orders_by_week ( self ):
+        return self._table( 'orders_by_week' )
+
+    def orders_per_courier_by_week ( self ):
+        return self._table( 'orders_per_courier_by_week' )
+
+    def location_medians ( self ):
+        return self._table( 'location_medians' )
+
+    def delivery_grid ( self, max_cells=MAX_CELLS ):
+        return self._table( 'delivery_grid' )
+
+    def courier_ratings ( self ):
+        return self._table( 'courier_ratings' )
+
+    def ratings ( self, col ):
+        ratings = self._table( 'ratings_' + col ).set_index( col )
+        ratings.columns = pd.MultiIndex.from_product( [['Delivery_person_Ratings'], ['mean', 'std']] )
+
+        return ratings
+
+    def time_by ( self, group ):
+        return self._table( 'time_by_' + '_'.join( np.atleast_1d( group ) ) )
+
+    def festival_time ( self, festival, operation ):
+        return self._scalar( 'festival_{}_{}'.format( festival, operation ) )
+
+    def top_couriers ( self, n=10 ):
+        if n > TOP_N:
+            # Só os TOP_N primeiros de cada cidade são guardados: rankings maiores vêm das linhas
+            return cache.frame_metrics( self.cutoff, self.traffic, self.views.source ).top_couriers( n )
+
+        top = self._table( 'top_couriers' )
+        ends = []
+        for end in ['fastest', 'slowest']:
+            rows = top.loc[top['end'] == end, :].drop( columns='end' )
+            ends.append( rows.groupby( 'City', sort=False, observed=True ).head( n ).reset_index( drop=True ) )
+
+        return tuple( ends )
+
+    def extreme ( self, col, operation ):
+        return self._scalar( 'extreme_{}_{}'.format( col, operation ) )
+
+    def courier_count ( self ):
+        return self._scalar( 'courier_count' )
+
+    def avg_distance ( self ):
+        return self._scalar( 'avg_distance' )
+
+    def distance_by_city ( self ):
+        return self._table( 'distance_by_city' )
+
+
+def _same_ranking ( a, b ):
+    """ This function checks that two rankings ( top_couriers ) list the same delivery people in the same order """
+    for x, y in zip( a, b ):
+        if len( x ) != len( y ) or not np.allclose( x['Time_taken(min)'], y['Time_taken(min)'] ):
+            return False
+        if any( list( x[col].astype( str ) ) != list( y[col].astype( str ) ) for col in ['City', 'Delivery_person_ID'] ):
+            return False
+
+    return True
+
+
+# Tables of the views compared by --compare ( curry.sql.CHECKS without courier_time, which the views
+# keep only through the rankings ):
+VIEW_CHECKS = {name: check for name, check in CHECKS.items() if name != 'courier_time'}
+
+
+def compare ( source=DATASET_PATH, root=store.SNAPSHOT_DIR ):
+    """ This function compares every table of the views with FrameMetrics ( pandas ), for every traffic selection
+
+        The rankings of the Delivery page are compared in order, for several sizes.
+
+        Input: path of the source csv and snapshot folder ( the views must be up to date )
+        Output: list of (table, cutoff, traffic) that differ
+    """
+    views = load_views( source, root )
+    if views is None:
+        raise ValueError( 'the views of {} are missing or older than the dataset'.format( source ) )
+
+    different = []
+    for cutoff in COMPARE_STATES:
+        for key in selections():
+            traffic = key.split( ',' )
+            frame = cache.frame_metrics( cutoff, traffic, source )
+            view = views.metrics( cutoff, traffic )
+            for name, check in VIEW_CHECKS.items():
+                if not same_tables( check( frame ), check( view ) ):
+                    different.append( (name, cutoff, key) )
+            for n in COMPARE_TOP:
+                if not _same_ranking( frame.top_couriers( n ), view.top_couriers( n ) ):
+                    different.append( ('top_couriers( {} )'.format( n ), cutoff, key) )
+
+    return different
+
+
+def main ( argv=None ):
+    parser = argparse.ArgumentParser( description='Precompute the tables of the pages for every slider cutoff.' )
+    parser.add_argument( '--source', default=DATASET_PATH, help='source csv file' )
+    parser.add_argument( '--root', default=store.SNAPSHOT_DIR, help='snapshot folder' )
+    parser.add_argument( '--jobs', type=int, default=None, help='worker processes ( default: one per core )' )
+    parser.add_argument( '--force', action='store_true', help='compute every state again' )
+    parser.add_argument( '--compare', action='store_true', help='check that the views match the tables computed in memory' )
+    args = parser.parse_args( argv )
+
+    start = time.perf_counter()
+    stats = build( args.source, args.root, args.jobs, args.force )
+    print( 'computed {computed} states, kept {kept}, for {selections} traffic selections'.format( **stats )
+           + ' in {:.1f}s -> {}'.format( time.perf_counter() - start, views_dir( args.source, args.root ) ) )
+
+    if args.compare:
+        different = compare( args.source, args.root )
+        print( '{} tables and {} rankings x {} cutoffs x {} traffic selections compared, {} different'.format(
+            len( VIEW_CHECKS ), len( COMPARE_TOP ), len( COMPARE_STATES ), len( selections() ), len( different ) ) )
+        for name, cutoff, traffic in different:
+            print( '  {} ( cutoff {}, traffic {} )'.format( name, cutoff, traffic ) )
+        if different:
+            raise SystemExit( 1 )
+
+
+if __name__ == '__main__':
+    main()
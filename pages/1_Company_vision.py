@@ -2,15 +2,16 @@
 # Libraries
 
 import pandas as pd
-from haversine import haversine
-import re
-import numpy as np
-import plotly
-import plotly.express as px
-import folium
 import streamlit as st
 from PIL import Image
-from streamlit_folium import folium_static
+import streamlit.components.v1 as components
+
+from curry.cache import get_metrics
+from curry.columns import page_columns
+from curry.figures import cached_figure, cached_html, render_key
+from curry.geo import grid_geojson
+from curry.instrument import debug_panel, instrument
+from curry.layout import page_tabs
 
 st.set_page_config( page_title='Company Vision',page_icon='📈', layout='wide' )
 
@@ -18,73 +19,82 @@ st.set_page_config( page_title='Company Vision',page_icon='📈', layout='wide'
 # Functions
 # -----------------------------------
 
-def country_maps( df ):
+@instrument
+def country_maps( metrics ):
+    # folium só é importado quando o mapa é desenhado ( aba do mapa, sem HTML no cache )
+    import folium
+    from branca.colormap import LinearColormap
+    from folium.plugins import FastMarkerCluster
+
+    # Orders and average delivery time by grid cell ( at most MAX_CELLS cells, see curry/geo.py ):
+    grid = metrics.delivery_grid()
     # Selecting median locations by City:
-    df_aux7 = (df.loc[: , ['City' , 'Road_traffic_density' , 'Delivery_location_latitude' , 'Delivery_location_longitude'] ]
-                      .groupby(['City' , 'Road_traffic_density'])
-                      .median()
-                      .reset_index())
+    df_aux7 = metrics.location_medians()
 
     # Creating the map:
-    map = folium.Map()
+    map = folium.Map( location=[20, 80], zoom_start=5 )
+
+    # Grid layer: one GeoJSON with a square by cell, coloured by the number of orders
+    if len( grid ):
+        colormap = LinearColormap( ['#ffffb2', '#fd8d3c', '#bd0026'], vmin=grid['orders'].min(), vmax=grid['orders'].max(),
+                                   caption='Orders by cell' )
+        folium.GeoJson( grid_geojson( grid ),
+                        name='Orders by area',
+                        style_function=lambda feature: {'fillColor': colormap( feature['properties']['orders'] ),
+                                                        'fillOpacity': 0.6, 'weight': 0},
+                        tooltip=folium.GeoJsonTooltip( fields=['orders', 'avg_time'], aliases=['Orders', 'AVG time (min)'] ) ).add_to( map )
+        colormap.add_to( map )
+
+    # Drill-down: clustered markers of a bounded sample of the delivery locations
+    points = metrics.delivery_points()
+    FastMarkerCluster( points[['Delivery_location_latitude', 'Delivery_location_longitude']].values.tolist(),
+                       name='Delivery locations', show=False ).add_to( map )
 
     #Inserting the location medians by City and Road traffic density: 
-    for index, location_info in df_aux7.iterrows():
-        folium.Marker( [location_info['Delivery_location_latitude' ],
-                      location_info['Delivery_location_longitude']],
-                      popup=location_info[['City', 'Road_traffic_density']] ).add_to( map )
+    medians = folium.FeatureGroup( name='Medians by city and traffic' )
+    for lat, lng, city, traffic in zip( df_aux7['Delivery_location_latitude'], df_aux7['Delivery_location_longitude'],
+                                        df_aux7['City'], df_aux7['Road_traffic_density'] ):
+        folium.Marker( [lat, lng], popup='{} {}'.format( city, traffic ) ).add_to( medians )
+    medians.add_to( map )
+
+    folium.LayerControl().add_to( map )
     
-    # Salvar o mapa como uma imagem
-    folium_static(map, width=1024 , height=600 ) 
+    # Salvar o mapa como HTML ( guardado no cache de figuras, curry/figures.py )
+    html = folium.Figure( height=600 ).add_child( map ).render()
 
-    return None
+    return html
        
 
-def order_share_by_week ( df ):
-          
-    # Groupby:
-    df_aux4 = ( df.loc[: , ['ID'  , 'week_of_year']]
-                  .groupby('week_of_year')
-                  .count()
-                  .reset_index() )
-    df_aux5 = ( df.loc[: , ['Delivery_person_ID' , 'week_of_year']]
-                  .groupby('week_of_year')
-                  .nunique()
-                  .reset_index() )
-
-    # Joining two DFs:
-    df_aux6 = pd.merge(df_aux4,df_aux5,how='inner')
+@instrument
+def order_share_by_week ( metrics ):
+    # plotly.express só é importado quando um gráfico é desenhado ( sem figura no cache )
+    import plotly.express as px
 
-    # Creating the column of orders average by Deliveries:  
-    df_aux6['Orders_by_deliver'] = df_aux6['ID']/df_aux6['Delivery_person_ID']
+    # Orders, delivery people and orders by delivery person for each week:
+    df_aux6 = metrics.orders_per_courier_by_week()
 
     # Creating the graphic:
     fig = px.line(df_aux6 , x='week_of_year' , y='Orders_by_deliver')
 
     return fig
         
-def order_by_week ( df ):
+@instrument
+def order_by_week ( metrics ):
+    import plotly.express as px
             
-    # Creating a column with weeks of the year:
-    df['week_of_year'] = df.Order_Date.dt.strftime('%U')
-
-    # Groupby week_of_year:
-    pedidos_por_semana = (df.loc[: , ['week_of_year' , 'ID']]
-                            .groupby('week_of_year')
-                            .count()
-                            .reset_index())
+    # Orders by week_of_year:
+    pedidos_por_semana = metrics.orders_by_week()
 
     # Building graphic:
     fig = px.line( pedidos_por_semana , x='week_of_year' , y='ID' )
 
     return fig
         
-def traffic_order_city( df ):
-    # Groupby:
-    df_aux3 = (df.loc[: , ['City' , 'Road_traffic_density' , 'ID']]
-                       .groupby(['City','Road_traffic_density'])
-                       .count()
-                       .reset_index())
+@instrument
+def traffic_order_city( metrics ):
+    import plotly.express as px
+    # Orders by city and type of traffic:
+    df_aux3 = metrics.orders_by_city_traffic()
 
     #Building a Bubble graphic:
     fig = px.scatter(df_aux3 , x='City' , y='Road_traffic_density' , size='ID' , color='City')
@@ -94,101 +104,32 @@ def traffic_order_city( df ):
 
     return fig    
    
-def traffic_order_share( df ):
+@instrument
+def traffic_order_share( metrics ):
+    import plotly.express as px
                                     
-    # Groupby Road traffic density:
-    pedidos_por_tipodetrafego = (df.loc[: , ['Road_traffic_density' , 'ID']]
-                                   .groupby('Road_traffic_density')
-                                   .count()
-                                   .reset_index())
-    pedidos_por_tipodetrafego['perc_entrega'] = pedidos_por_tipodetrafego['ID']/pedidos_por_tipodetrafego['ID'].sum()
+    # Orders by Road traffic density:
+    pedidos_por_tipodetrafego = metrics.orders_by_traffic()
 
     # Building graphic:
     fig = px.pie(pedidos_por_tipodetrafego , values='perc_entrega' ,  names='Road_traffic_density')
 
     return fig
 
-def order_metric ( df ):
+@instrument
+def order_metric ( metrics ):
+    import plotly.express as px
             
-    # Selecting columns by day:
-    df_aux = df.loc[: , ['Order_Date' , 'ID']].groupby('Order_Date').count().reset_index()
+    # Orders by day:
+    df_aux = metrics.orders_by_day()
 
     #Building graphic:
     fig = px.bar(df_aux,x='Order_Date',y='ID')
 
     return fig
         
-def clean_code ( df_raw ):
-    """ This function cleans the DataFrame
-    
-        Types of cleaning:
-        1. Removing NaN datas
-        2. Changing the type of the columns
-        3. Removing spaces from strings variables
-        4. Formatation of Date Column
-        5. Cleaning of Time column - removing text from number variable
-        
-        Input: DataFrame
-        Output: DataFrame   
-    """
-    
-    # Remover espaco da string
-    df_raw.loc[: , 'ID'] = df_raw.loc[: , 'ID' ].str.strip()
-    df_raw.loc[: , 'Delivery_person_ID'] = df_raw.loc[: , 'Delivery_person_ID' ].str.strip()
-    df_raw.loc[: , 'Road_traffic_density'] = df_raw.loc[: , 'Road_traffic_density' ].str.strip()
-    df_raw.loc[: , 'Type_of_order'] = df_raw.loc[: , 'Type_of_order' ].str.strip()
-    df_raw.loc[: , 'Type_of_vehicle'] = df_raw.loc[: , 'Type_of_vehicle' ].str.strip()
-    df_raw.loc[: , 'Festival'] = df_raw.loc[: , 'Festival' ].str.strip()
-    df_raw.loc[: , 'City'] = df_raw.loc[: , 'City' ].str.strip()
-
-    # Excluir as linhas com a idade dos entregadores vazia
-    # ( Conceitos de seleção condicional )
-    linhas_vazias = df_raw['Delivery_person_Age'] != 'NaN '
-    df_raw = df_raw.loc[linhas_vazias, :]
-
-    # Conversao de texto/categoria/string para numeros inteiros
-    df_raw['Delivery_person_Age'] = df_raw['Delivery_person_Age'].astype( int )
-
-    # Conversao de texto/categoria/strings para numeros decimais
-    df_raw['Delivery_person_Ratings'] = df_raw['Delivery_person_Ratings'].astype( float )
-
-    # Conversao de texto para data
-    df_raw['Order_Date'] = pd.to_datetime( df_raw['Order_Date'], format='%d-%m-%Y' )
-
-    # Remove as linhas de algumas colunas que tenham o 
-    # conteudo igual a NaN:
-    linhas_vazias = df_raw['multiple_deliveries'] != 'NaN ' 
-    linhas_vazias2 = df_raw['Weatherconditions'] != 'conditions NaN'
-    df_raw = df_raw.loc[linhas_vazias, :]
-    df_raw = df_raw.loc[linhas_vazias2, :]
-    df_raw = df_raw.loc[df_raw['City'] != 'NaN' , :]
-    df_raw['multiple_deliveries'] = df_raw['multiple_deliveries'].astype( int )
-    
-    # Filtro de Trânsito
-
-    #linhas_selecionadas = df['Road_traffic_density'].isin(traffic_options)
-    #df = df.loc[linhas_selecionadas , :]
-    #st.dataframe( df )
-
-    # Comando para remover o texto de números
-    df_raw = df_raw.reset_index( drop=True )
-    for i in range( len( df_raw ) ):
-        df_raw.loc[i, 'Time_taken(min)'] = re.findall( r'\d+', df_raw.loc[i, 'Time_taken(min)'] )
-
-    return df_raw
-
 # ----------------- Starting the logical structure of the code -------------------------------
-# -----------------
-# Import dataset:
-# -----------------
-df_raw = pd.read_csv('ftc_train.csv')
-
-# -------------------
-# Cleaning DataFrame
-# -------------------
-
-df = clean_code (df_raw)
-
+# The dataset is loaded once per process by curry.cache and read through get_metrics() below
     
 #======================================================================
 
@@ -224,9 +165,14 @@ traffic_options = st.sidebar.multiselect(
 st.sidebar.markdown('''---''')
 st.sidebar.markdown('### Powered by Bruno Boneto ###')
 
-# Filtro de Data
-linhas_selecionadas = df['Order_Date'] < data_slider
-df = df.loc[linhas_selecionadas , :]
+# Tabelas da página: só as colunas que elas leem são carregadas ( curry/columns.py )
+TABLES = [('orders_by_day',) , ('orders_by_traffic',) , ('orders_by_city_traffic',) , ('orders_by_week',) ,
+          ('orders_per_courier_by_week',) , ('delivery_grid',) , ('delivery_points',) , ('location_medians',)]
+
+# Filtro de Data e de Trânsito: tabelas agregadas dos gráficos ( curry/metrics.py )
+# As linhas são selecionadas só quando uma tabela é lida, e cada tabela copia apenas as suas colunas:
+# a chamada aqui não copia dados, e só a aba selecionada abaixo faz trabalho
+metrics = get_metrics( data_slider , traffic_options , 'ftc_train.csv' , columns=page_columns( TABLES ) )
 
 
 #======================================================================
@@ -235,44 +181,50 @@ df = df.loc[linhas_selecionadas , :]
 
 #======================================================================
 
-tab1, tab2, tab3 = st.tabs(['Management Vision' , 'Tactical Vision' , 'Geographic Vision'])
+# Abas: no modo lazy só a aba selecionada é calculada ( curry/layout.py )
+tab1, tab2, tab3 = page_tabs(['Management Vision' , 'Tactical Vision' , 'Geographic Vision'] , key='company')
 
-with tab1:
-    with st.container():
-        # Order Metric
-        fig = order_metric(df)
-        st.markdown('# Orders by day')
-        st.plotly_chart(fig , use_container_width=True)
-        
-        
-        
-    with st.container():
-        col1, col2 = st.columns( 2 )
-        
-        with col1:
-            fig = traffic_order_share( df )
-            st.header( "Orders by Road Traffic Density" )
-            st.plotly_chart( fig, use_container_width=True )
-     
-        with col2:
-            st.header('Orders by City and Type of Traffic')
-            fig = traffic_order_city ( df )
-            st.plotly_chart( fig , use_container_width=True)
+if tab1:
+    with tab1:
+        with st.container():
+            # Order Metric
+            fig = cached_figure( render_key( 'Company', 'order_metric', data_slider, traffic_options ), lambda: order_metric(metrics) )
+            st.markdown('# Orders by day')
+            st.plotly_chart(fig , use_container_width=True)
+            
+            
+            
+        with st.container():
+            col1, col2 = st.columns( 2 )
+            
+            with col1:
+                fig = cached_figure( render_key( 'Company', 'traffic_order_share', data_slider, traffic_options ), lambda: traffic_order_share( metrics ) )
+                st.header( "Orders by Road Traffic Density" )
+                st.plotly_chart( fig, use_container_width=True )
+         
+            with col2:
+                st.header('Orders by City and Type of Traffic')
+                fig = cached_figure( render_key( 'Company', 'traffic_order_city', data_slider, traffic_options ), lambda: traffic_order_city ( metrics ) )
+                st.plotly_chart( fig , use_container_width=True)
+                
+if tab2:
+    with tab2:
+        with st.container():
+            st.markdown('Order by Week')
+            fig = cached_figure( render_key( 'Company', 'order_by_week', data_slider, traffic_options ), lambda: order_by_week ( metrics ) )
+            st.plotly_chart (fig, use_container_width=True)
+                       
+        with st.container():
+            st.markdown('Orders by Delivery Person by Week')
+            fig = cached_figure( render_key( 'Company', 'order_share_by_week', data_slider, traffic_options ), lambda: order_share_by_week ( metrics ) )
+            st.plotly_chart ( fig , use_container_width=True)
             
-with tab2:
-    with st.container():
-        st.markdown('Order by Week')
-        fig = order_by_week ( df )
-        st.plotly_chart (fig, use_container_width=True)
-                   
-    with st.container():
-        st.markdown('Orders by Delivery Person by Week')
-        fig = order_share_by_week ( df )
-        st.plotly_chart ( fig , use_container_width=True)
-        
 
-with tab3:
-    st.markdown('# Country Maps')
-    country_maps  ( df )
-    
-    
\ No newline at end of file
+if tab3:
+    with tab3:
+        st.markdown('# Country Maps')
+        html = cached_html( render_key( 'Company', 'country_maps', data_slider, traffic_options ), lambda: country_maps ( metrics ) )
+        components.html( html, width=1024 , height=610 )
+
+# Painel de depuração com os tempos desta execução ( só com CURRY_PROFILE=1, curry/instrument.py )
+debug_panel( 'Company' )
@@ -1,17 +1,16 @@
 # Libraries
 
 import pandas as pd
-from haversine import haversine
-import re
 import numpy as np
-import plotly
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import folium
 import streamlit as st
 from PIL import Image
-from streamlit_folium import folium_static
+
+from curry.cache import get_metrics
+from curry.columns import page_columns
+from curry.figures import cached_figure, render_key
+from curry.instrument import debug_panel, instrument
+from curry.layout import page_tabs
+from curry.planner import plan_metrics
 
 st.set_page_config( page_title='Restaurant Vision',page_icon='📈', layout='wide' )
 
@@ -19,38 +18,42 @@ st.set_page_config( page_title='Restaurant Vision',page_icon='📈', layout='wid
 # Functions
 # -----------------------------------
 
-def avg_time_city (df):
-    # Fazendo a tabela dinâmica e calculando a média e o desvio padrão:
-    df_time = (df.loc[: , ['City' , 'Road_traffic_density' , 'Time_taken(min)']]
-               .groupby(['City' , 'Road_traffic_density'])
-               .agg( {'Time_taken(min)': ['mean' , 'std'] } ))
-    #Renaming average and standard deviation columns and reseting index:
-    df_time.columns = ['avg_time' , 'std_time']
-    df_time = df_time.reset_index()
+@instrument
+def avg_time_city (metrics):
+    # plotly só é importado quando um gráfico é desenhado ( sem figura no cache )
+    import plotly.express as px
+
+    # Média e desvio padrão por cidade e tráfego ( colunas avg_time e std_time ):
+    df_time = metrics.time_by( ['City' , 'Road_traffic_density'] )
+    # Meio da escala: média dos desvios, ignorando os grupos de um só pedido ( desvio NaN )
     #Making the graphic
-    fig = px.sunburst(df_time , path=['City' , 'Road_traffic_density'] , values='avg_time' , color='std_time' , color_continuous_scale='RdBu' , color_continuous_midpoint=np.average(df_time['std_time'] ) )
+    fig = px.sunburst(df_time , path=['City' , 'Road_traffic_density'] , values='avg_time' , color='std_time' , color_continuous_scale='RdBu' , color_continuous_midpoint=df_time['std_time'].mean() )
     return fig
 
-def dist_distr_city (df):
-    #Calculate the distance between restaurants and order locations:
-    #haversine( (latitude , longitude) , (latitude , longitude) )
-    cols = ['Restaurant_latitude' , 'Restaurant_longitude' , 'Delivery_location_latitude' , 'Delivery_location_longitude']
-    df['distance'] = df.loc[: , ['Restaurant_latitude' , 'Restaurant_longitude' , 'Delivery_location_latitude' , 'Delivery_location_longitude']]\
-                       .apply( lambda x: haversine( (x['Restaurant_latitude'] , x['Restaurant_longitude']) , (x['Delivery_location_latitude'] , x['Delivery_location_longitude'])), axis=1)
-    #Calculate average distances between restarants and order locations:
-    avg_distance = df.loc[: , ['City' , 'distance']].groupby('City').mean().reset_index()
+@instrument
+def dist_distr_city (metrics):
+    import plotly.graph_objects as go
+
+    #Average distances between restarants and order locations by city:
+    avg_distance = metrics.distance_by_city()
     #pull is given as a fraction of a pie radius
     fig = go.Figure( data=[go.Pie( labels=avg_distance['City'], values=avg_distance['distance'],pull=[0, 0 , 0.1])])
     return fig
             
-def avg_std_time_graph (df , col , group , returning):
-    df_time = df.loc[: , col].groupby(group).agg( {'Time_taken(min)': ['mean' , 'std'] } )
-    df_time.columns = ['avg_time' , 'std_time']
-    df_time = df_time.reset_index()
+def time_bars (df_time):
+    import plotly.graph_objects as go
+
+    graph = go.Figure()
+    graph.add_trace( go.Bar( name='Control', x=df_time['City'] , y=df_time['avg_time'] , error_y=dict( type='data' , array=df_time['std_time'] ) ) )
+    graph.update_layout(barmode='group')
+    return graph
+
+@instrument
+def avg_std_time_graph (metrics , group , returning):
+    df_time = metrics.time_by( group )
     if returning  == 'graph':
-        graph = go.Figure()
-        graph.add_trace( go.Bar( name='Control', x=df_time['City'] , y=df_time['avg_time'] , error_y=dict( type='data' , array=df_time['std_time'] ) ) )
-        graph.update_layout(barmode='group')
+        graph = cached_figure( render_key( 'Restaurant', 'avg_std_time_graph', data_slider, traffic_options, tuple( np.atleast_1d( group ) ) ),
+                               lambda: time_bars( df_time ) )
         #fig.show()    
         fig = st.plotly_chart(graph, use_container_width=True)
         return fig
@@ -59,94 +62,25 @@ def avg_std_time_graph (df , col , group , returning):
         return table
 
                 
-def time (df , festival , operation):
+@instrument
+def time (metrics , festival , operation):
     """ This function calculates the average and the standard deviation from all the time deliveries:
         
-        Input: DataFrame, during festival or not, operation ('avg' or 'std')'
+        Input: metrics of the selected orders, during festival or not, operation ('mean' or 'std')'
         Output: avg or std with or without festival   
     """
-    if operation == 'mean':
-        result = np.round(df.loc[df['Festival'] == festival , 'Time_taken(min)'].mean() , 2 )
-    elif operation == 'std':
-        result = np.round(df.loc[df['Festival'] == festival , 'Time_taken(min)'].std() , 2 )
+    result = metrics.festival_time( festival , operation )
     return result      
         
-def distance (df):
-    #Calculating the distance between restaurants and delivery locations by latitude and longitude:
-    df['distance'] = df.loc[: , ['Restaurant_latitude' , 'Restaurant_longitude' , 'Delivery_location_latitude' , 'Delivery_location_longitude']]\
-                       .apply( lambda x: haversine( (x['Restaurant_latitude'] , x['Restaurant_longitude']) , (x['Delivery_location_latitude'] , x['Delivery_location_longitude'])), axis=1)
-    #Calculating the average of the distances:
-    avg_distance = np.round(df['distance'].mean() , 2)
+@instrument
+def distance (metrics):
+    #Calculating the average of the distances between restaurants and delivery locations:
+    avg_distance = metrics.avg_distance()
 
     return avg_distance
             
-def clean_code ( df_raw ):
-    """ This function cleans the DataFrame
-    
-        Types of cleaning:
-        1. Removing NaN datas
-        2. Changing the type of the columns
-        3. Removing spaces from strings variables
-        4. Formatation of Date Column
-        5. Cleaning of Time column - removing text from number variable
-        
-        Input: DataFrame
-        Output: DataFrame   
-    """
-    
-    # Remover espaco da string
-    df_raw.loc[: , 'ID'] = df_raw.loc[: , 'ID' ].str.strip()
-    df_raw.loc[: , 'Delivery_person_ID'] = df_raw.loc[: , 'Delivery_person_ID' ].str.strip()
-    df_raw.loc[: , 'Road_traffic_density'] = df_raw.loc[: , 'Road_traffic_density' ].str.strip()
-    df_raw.loc[: , 'Type_of_order'] = df_raw.loc[: , 'Type_of_order' ].str.strip()
-    df_raw.loc[: , 'Type_of_vehicle'] = df_raw.loc[: , 'Type_of_vehicle' ].str.strip()
-    df_raw.loc[: , 'Festival'] = df_raw.loc[: , 'Festival' ].str.strip()
-    df_raw.loc[: , 'City'] = df_raw.loc[: , 'City' ].str.strip()
-
-    # Excluir as linhas com a idade dos entregadores vazia
-    # ( Conceitos de seleção condicional )
-    linhas_vazias = df_raw['Delivery_person_Age'] != 'NaN '
-    df_raw = df_raw.loc[linhas_vazias, :]
-
-    # Conversao de texto/categoria/string para numeros inteiros
-    df_raw['Delivery_person_Age'] = df_raw['Delivery_person_Age'].astype( int )
-
-    # Conversao de texto/categoria/strings para numeros decimais
-    df_raw['Delivery_person_Ratings'] = df_raw['Delivery_person_Ratings'].astype( float )
-
-    # Conversao de texto para data
-    df_raw['Order_Date'] = pd.to_datetime( df_raw['Order_Date'], format='%d-%m-%Y' )
-
-    # Remove as linhas de algumas colunas que tenham o 
-    # conteudo igual a NaN:
-    linhas_vazias = df_raw['multiple_deliveries'] != 'NaN ' 
-    linhas_vazias2 = df_raw['Weatherconditions'] != 'conditions NaN'
-    df_raw = df_raw.loc[linhas_vazias, :]
-    df_raw = df_raw.loc[linhas_vazias2, :]
-    df_raw = df_raw.loc[df_raw['City'] != 'NaN' , :]
-    df_raw['multiple_deliveries'] = df_raw['multiple_deliveries'].astype( int )
-    
-    # Comando para remover o texto de números
-    df_raw = df_raw.reset_index( drop=True )
-    for i in range( len( df_raw ) ):
-        df_raw.loc[i, 'Time_taken(min)'] = re.findall( r'\d+', df_raw.loc[i, 'Time_taken(min)'] )
-
-    # Transformando os elementos da coluna "Time_taken" de listas para int:
-    df_raw['Time_taken(min)'] = df_raw['Time_taken(min)'].explode().astype(int)
-
-    return df_raw
-
 # ----------------- Starting the logical structure of the code -------------------------------
-# -----------------
-# Import dataset:
-# -----------------
-df_raw = pd.read_csv('ftc_train.csv')
-
-# -------------------
-# Cleaning Dataset
-# -------------------
-
-df = clean_code (df_raw)
+# The dataset is loaded once per process by curry.cache and read through get_metrics() below
 
 #======================================================================
 
@@ -181,9 +115,14 @@ traffic_options = st.sidebar.multiselect(
 st.sidebar.markdown('''---''')
 st.sidebar.markdown('### Powered by Bruno Boneto ###')
 
-# Filtro de Data
-linhas_selecionadas = df['Order_Date'] < data_slider
-df = df.loc[linhas_selecionadas , :]
+# Tabelas da página declaradas de uma vez: só as colunas que elas leem são carregadas ( curry/columns.py )
+TABLES = [('festival_time',) , ('avg_distance',) , ('distance_by_city',) , ('time_by' , 'City') ,
+          ('time_by' , ['City' , 'Type_of_order']) , ('time_by' , ['City' , 'Road_traffic_density']) , ('courier_count',)]
+
+# Filtro de Data e de Trânsito: tabelas agregadas dos gráficos ( curry/metrics.py )
+metrics = get_metrics( data_slider , traffic_options , 'ftc_train.csv' , columns=page_columns( TABLES ) )
+# O planner calcula as agregações declaradas em passadas compartilhadas ( curry/planner.py )
+metrics = plan_metrics( metrics , TABLES )
 
 #======================================================================
 
@@ -192,77 +131,74 @@ df = df.loc[linhas_selecionadas , :]
 #======================================================================
 
 
-tab1, tab2, tab3 = st.tabs(['Management Vision' , '_' , '_'])
+# Abas: no modo lazy só a aba selecionada é calculada ( curry/layout.py )
+tab1, tab2, tab3 = page_tabs(['Management Vision' , '_' , '_'] , key='restaurant')
 
-with tab1:
-    
-    #Container 1
-    with st.container():
-        st.title('Overal Metrics')
+if tab1:
+    with tab1:
         
-        col1, col2, col3, col4, col5, col6 = st.columns( 6 )
-        
-        with col1: 
-            #Calculating the number of unique delivery people and showing the result:
-            unique_deliveries = len(df.loc[: , 'Delivery_person_ID'].unique())
-            col1.metric('Delivery People',unique_deliveries )
-        
-        with col2:
-            avg_distance = distance (df)           
-            col2.metric('AVG delivery distance' , avg_distance)
-        
-        with col3: 
-            avg_time_yes = time (df , 'Yes' , 'mean')
-            col3.metric('AVG time with Fest' , avg_time_yes)
-        
-        with col4:
-            std_time_yes = time (df , 'Yes' , 'std')
-            col4.metric('STD time with Fest' , std_time_yes)
-                                   
-        with col5:
-            avg_time_no = time (df , 'No' , 'mean')
-            col5.metric('AVG time without Fest' , avg_time_no)
+        #Container 1
+        with st.container():
+            st.title('Overal Metrics')
             
-        with col6:
-            std_time_no = time (df , 'No' , 'std')
-            col6.metric('STD time without Fest' , std_time_no)
+            col1, col2, col3, col4, col5, col6 = st.columns( 6 )
             
-    # Container 2
-    with st.container():
-        st.title('Time Distribution')
-        col1, col2 = st.columns( 2 )
-        
-        with col1:
-            st.markdown('##### By Cities')
-            avg_std_time_graph (df , ['City' , 'Time_taken(min)'] , 'City' , 'graph')
+            with col1: 
+                #Calculating the number of unique delivery people and showing the result:
+                unique_deliveries = metrics.courier_count()
+                col1.metric('Delivery People',unique_deliveries )
             
-        with col2:  #Média e desv pdr por cidade e tipo de entrega
-            st.markdown('##### Avg and Std by City and type of order')
-            avg_std_time_graph (df , ['City' , 'Type_of_order' , 'Time_taken(min)'] , ['City' , 'Type_of_order'] , 'dframe')
+            with col2:
+                avg_distance = distance (metrics)           
+                col2.metric('AVG delivery distance' , avg_distance)
             
-    #Container 3
-    with st.container():
-        #st.title('Distance Distribution')
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown('##### Distance distribution by cities')
-            figure = dist_distr_city (df)
-            st.plotly_chart(figure, use_container_width=True)
-            
-        with col2:
-            st.markdown('##### Average time by cities and type of traffic') 
-            figure = avg_time_city (df)
-            st.plotly_chart(figure)
+            with col3: 
+                avg_time_yes = time (metrics , 'Yes' , 'mean')
+                col3.metric('AVG time with Fest' , avg_time_yes)
             
+            with col4:
+                std_time_yes = time (metrics , 'Yes' , 'std')
+                col4.metric('STD time with Fest' , std_time_yes)
+                                       
+            with col5:
+                avg_time_no = time (metrics , 'No' , 'mean')
+                col5.metric('AVG time without Fest' , avg_time_no)
+                
+            with col6:
+                std_time_no = time (metrics , 'No' , 'std')
+                col6.metric('STD time without Fest' , std_time_no)
+                
+        # Container 2
+        with st.container():
+            st.title('Time Distribution')
+            col1, col2 = st.columns( 2 )
             
-                 
+            with col1:
+                st.markdown('##### By Cities')
+                avg_std_time_graph (metrics , 'City' , 'graph')
+                
+            with col2:  #Média e desv pdr por cidade e tipo de entrega
+                st.markdown('##### Avg and Std by City and type of order')
+                avg_std_time_graph (metrics , ['City' , 'Type_of_order'] , 'dframe')
+                
+        #Container 3
+        with st.container():
+            #st.title('Distance Distribution')
+            col1, col2 = st.columns(2)
             
-        
-        
-    
-        
-        
-        
-        
-       
\ No newline at end of file
+            with col1:
+                st.markdown('##### Distance distribution by cities')
+                figure = cached_figure( render_key( 'Restaurant', 'dist_distr_city', data_slider, traffic_options ), lambda: dist_distr_city (metrics) )
+                st.plotly_chart(figure, use_container_width=True)
+                
+            with col2:
+                st.markdown('##### Average time by cities and type of traffic') 
+                # O sunburst do plotly não desenha uma tabela vazia ( data antes do primeiro pedido ou nenhum tráfego )
+                if metrics.time_by( ['City' , 'Road_traffic_density'] ).empty:
+                    st.info('No orders for the selected date and traffic conditions')
+                else:
+                    figure = cached_figure( render_key( 'Restaurant', 'avg_time_city', data_slider, traffic_options ), lambda: avg_time_city (metrics) )
+                    st.plotly_chart(figure)
+
+# Painel de depuração com os tempos desta execução ( só com CURRY_PROFILE=1, curry/instrument.py )
+debug_panel( 'Restaurant' )